@@ -0,0 +1,34 @@
+"""add fuel_data_updated_at to motorcycles
+
+Revision ID: a3b4c5d6e7f8
+Revises: f2a3b4c5d6e7
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a3b4c5d6e7f8'
+down_revision = 'f2a3b4c5d6e7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('motorcycles', schema=None) as batch_op:
+        batch_op.add_column(sa.Column(
+            'fuel_data_updated_at',
+            sa.DateTime(),
+            nullable=True,
+            comment='給油記録の最終更新日時 (チャートAPIのETag算出用)',
+        ))
+
+    # 既存車両は適用時刻で初期化し、以降の更新で確実にETagが変わるようにする
+    op.execute("UPDATE motorcycles SET fuel_data_updated_at = (now() AT TIME ZONE 'utc')")
+
+
+def downgrade():
+    with op.batch_alter_table('motorcycles', schema=None) as batch_op:
+        batch_op.drop_column('fuel_data_updated_at')
@@ -0,0 +1,29 @@
+"""add updated_at to track_schedules
+
+Revision ID: a5b6c7d8e9f0
+Revises: f4a5b6c7d8e9
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a5b6c7d8e9f0'
+down_revision = 'f4a5b6c7d8e9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('track_schedules', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False, comment='最終更新日時 (カレンダーフィードの変更検知用)'))
+
+    # 既存の走行枠は登録日時を最終更新日時とする
+    op.execute("UPDATE track_schedules SET updated_at = created_at")
+
+
+def downgrade():
+    with op.batch_alter_table('track_schedules', schema=None) as batch_op:
+        batch_op.drop_column('updated_at')
@@ -0,0 +1,26 @@
+"""add row_version to event_participants for optimistic concurrency
+
+Revision ID: a9b0c1d2e3f4
+Revises: f8a9b0c1d2e3
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'a9b0c1d2e3f4'
+down_revision = 'f8a9b0c1d2e3'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('event_participants', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('row_version', sa.Integer(), nullable=False, server_default='1', comment='楽観的排他制御用のバージョン番号'))
+
+
+def downgrade():
+    with op.batch_alter_table('event_participants', schema=None) as batch_op:
+        batch_op.drop_column('row_version')
@@ -0,0 +1,28 @@
+"""add calendar_feed_token to users
+
+Revision ID: b0c1d2e3f4a5
+Revises: a9b0c1d2e3f4
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b0c1d2e3f4a5'
+down_revision = 'a9b0c1d2e3f4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('calendar_feed_token', sa.String(length=64), nullable=True, comment='購読用カレンダーフィード (ICS) のURLトークン'))
+        batch_op.create_index(batch_op.f('ix_users_calendar_feed_token'), ['calendar_feed_token'], unique=True)
+
+
+def downgrade():
+    with op.batch_alter_table('users', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_users_calendar_feed_token'))
+        batch_op.drop_column('calendar_feed_token')
@@ -0,0 +1,63 @@
+"""add mileage cache columns to motorcycles
+
+Revision ID: b4c5d6e7f8a9
+Revises: a3b4c5d6e7f8
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'b4c5d6e7f8a9'
+down_revision = 'a3b4c5d6e7f8'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('motorcycles', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('current_total_distance', sa.Integer(), nullable=False, server_default='0', comment='記録上の最大総走行距離 (ODO保留記録を除く)'))
+        batch_op.add_column(sa.Column('current_odometer', sa.Integer(), nullable=True, comment='最新の給油・整備記録時点のメーターODO値'))
+        batch_op.add_column(sa.Column('latest_log_date', sa.Date(), nullable=True, comment='最新の給油・整備記録の日付 (ODO保留記録を除く)'))
+        batch_op.add_column(sa.Column('max_maintenance_hours', sa.Numeric(precision=8, scale=2), nullable=True, comment='整備記録上の最大稼働時間 (レーサー用)'))
+
+    # 既存車両の値を給油・整備記録から埋める (Motorcycle.refresh_mileage_cache と同じ算出方法)
+    op.execute("""
+        UPDATE motorcycles m SET current_total_distance = GREATEST(
+            COALESCE((SELECT MAX(f.total_distance) FROM fuel_entries f
+                      WHERE f.motorcycle_id = m.id AND f.is_odo_pending = FALSE), 0),
+            COALESCE((SELECT MAX(e.total_distance_at_maintenance) FROM maintenance_entries e
+                      WHERE e.motorcycle_id = m.id AND e.is_odo_pending = FALSE), 0)
+        )
+    """)
+    op.execute("""
+        UPDATE motorcycles m SET max_maintenance_hours = (
+            SELECT MAX(e.operating_hours_at_maintenance) FROM maintenance_entries e
+            WHERE e.motorcycle_id = m.id
+        )
+    """)
+    op.execute("""
+        UPDATE motorcycles m SET current_odometer = latest.odo, latest_log_date = latest.log_date
+        FROM (
+            SELECT DISTINCT ON (motorcycle_id) motorcycle_id, odo, log_date
+            FROM (
+                SELECT motorcycle_id, odometer_reading AS odo, entry_date AS log_date, total_distance AS dist
+                FROM fuel_entries WHERE is_odo_pending = FALSE
+                UNION ALL
+                SELECT motorcycle_id, odometer_reading_at_maintenance, maintenance_date, total_distance_at_maintenance
+                FROM maintenance_entries WHERE is_odo_pending = FALSE
+            ) logs
+            ORDER BY motorcycle_id, log_date DESC, dist DESC
+        ) latest
+        WHERE latest.motorcycle_id = m.id
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('motorcycles', schema=None) as batch_op:
+        batch_op.drop_column('max_maintenance_hours')
+        batch_op.drop_column('latest_log_date')
+        batch_op.drop_column('current_odometer')
+        batch_op.drop_column('current_total_distance')
@@ -0,0 +1,59 @@
+"""add team_circuit_bests aggregate table and team_members.team_id index
+
+Revision ID: c1d2e3f4a5b6
+Revises: b0c1d2e3f4a5
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c1d2e3f4a5b6'
+down_revision = 'b0c1d2e3f4a5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('team_members', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_team_members_team_id'), ['team_id'], unique=False)
+
+    op.create_table(
+        'team_circuit_bests',
+        sa.Column('team_id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('circuit_name', sa.String(length=150), nullable=False),
+        sa.Column('best_lap_seconds', sa.Numeric(precision=8, scale=3), nullable=False, comment='共有された活動ログでのベストラップ（秒）'),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['team_id'], ['teams.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('team_id', 'user_id', 'circuit_name'),
+    )
+    with op.batch_alter_table('team_circuit_bests', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_team_circuit_bests_user_id'), ['user_id'], unique=False)
+        batch_op.create_index('ix_team_circuit_bests_ranking', ['team_id', 'circuit_name', 'best_lap_seconds'], unique=False)
+
+    # 既存データから集計を作成する (以降は flask rebuild-team-rankings で作り直せる)
+    op.execute("""
+        INSERT INTO team_circuit_bests (team_id, user_id, circuit_name, best_lap_seconds)
+        SELECT tm.team_id, a.user_id, a.circuit_name, min(s.best_lap_seconds)
+        FROM activity_logs a
+        JOIN session_logs s ON s.activity_log_id = a.id
+        JOIN team_members tm ON tm.user_id = a.user_id
+        WHERE a.circuit_name IS NOT NULL
+          AND s.best_lap_seconds IS NOT NULL
+          AND a.share_with_teams = true
+        GROUP BY tm.team_id, a.user_id, a.circuit_name
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('team_circuit_bests', schema=None) as batch_op:
+        batch_op.drop_index('ix_team_circuit_bests_ranking')
+        batch_op.drop_index(batch_op.f('ix_team_circuit_bests_user_id'))
+    op.drop_table('team_circuit_bests')
+
+    with op.batch_alter_table('team_members', schema=None) as batch_op:
+        batch_op.drop_index(batch_op.f('ix_team_members_team_id'))
@@ -0,0 +1,53 @@
+"""add next due columns to maintenance_reminders
+
+Revision ID: c5d6e7f8a9b0
+Revises: b4c5d6e7f8a9
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'c5d6e7f8a9b0'
+down_revision = 'b4c5d6e7f8a9'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 生成列のため既存行の値は追加時にDBが算出する (バックフィル不要)
+    with op.batch_alter_table('maintenance_reminders', schema=None) as batch_op:
+        batch_op.add_column(sa.Column(
+            'next_due_km',
+            sa.Integer(),
+            sa.Computed('last_done_km + interval_km', persisted=True),
+            comment='次回期限の総走行距離 (最終実施時の総走行距離 + 距離間隔)',
+        ))
+        batch_op.add_column(sa.Column(
+            'next_due_date',
+            sa.Date(),
+            sa.Computed("(last_done_date + interval_months * interval '1 month')::date", persisted=True),
+            comment='次回期限日 (最終実施日 + 期間間隔)',
+        ))
+        batch_op.create_index(
+            'ix_maintenance_reminders_motorcycle_next_due_km',
+            ['motorcycle_id', 'next_due_km'],
+            unique=False,
+            postgresql_where=sa.text('is_dismissed = false'),
+        )
+        batch_op.create_index(
+            'ix_maintenance_reminders_next_due_date',
+            ['next_due_date'],
+            unique=False,
+            postgresql_where=sa.text('is_dismissed = false'),
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('maintenance_reminders', schema=None) as batch_op:
+        batch_op.drop_index('ix_maintenance_reminders_next_due_date')
+        batch_op.drop_index('ix_maintenance_reminders_motorcycle_next_due_km')
+        batch_op.drop_column('next_due_date')
+        batch_op.drop_column('next_due_km')
@@ -0,0 +1,40 @@
+"""add lap statistics cache columns to session_logs
+
+Revision ID: d0e1f2a3b4c5
+Revises: c9d0e1f2a3b4
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd0e1f2a3b4c5'
+down_revision = 'c9d0e1f2a3b4'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 既存レコードの値は `flask backfill-lap-stats` で埋める
+    with op.batch_alter_table('session_logs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('lap_seconds', postgresql.JSONB(astext_type=sa.Text()), nullable=True, comment='lap_timesを秒に変換した数値配列（無効ラップはnull）'))
+        batch_op.add_column(sa.Column('average_lap_seconds', sa.Numeric(precision=8, scale=3), nullable=True, comment='有効ラップの平均タイム（秒）'))
+        batch_op.add_column(sa.Column('median_lap_seconds', sa.Numeric(precision=8, scale=3), nullable=True, comment='有効ラップの中央値（秒）'))
+        batch_op.add_column(sa.Column('worst_lap_seconds', sa.Numeric(precision=8, scale=3), nullable=True, comment='有効ラップの最遅タイム（秒）'))
+        batch_op.add_column(sa.Column('lap_stddev_seconds', sa.Numeric(precision=8, scale=3), nullable=True, comment='有効ラップの標準偏差（秒）'))
+        batch_op.add_column(sa.Column('lap_consistency', sa.Numeric(precision=5, scale=2), nullable=True, comment='ラップの安定度 (1 - 標準偏差/平均) * 100'))
+        batch_op.add_column(sa.Column('valid_lap_count', sa.Integer(), nullable=False, server_default='0', comment='有効ラップ数'))
+
+
+def downgrade():
+    with op.batch_alter_table('session_logs', schema=None) as batch_op:
+        batch_op.drop_column('valid_lap_count')
+        batch_op.drop_column('lap_consistency')
+        batch_op.drop_column('lap_stddev_seconds')
+        batch_op.drop_column('worst_lap_seconds')
+        batch_op.drop_column('median_lap_seconds')
+        batch_op.drop_column('average_lap_seconds')
+        batch_op.drop_column('lap_seconds')
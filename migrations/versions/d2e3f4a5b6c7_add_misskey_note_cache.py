@@ -0,0 +1,33 @@
+"""add misskey_note_cache table for touring scrapbooks
+
+Revision ID: d2e3f4a5b6c7
+Revises: c1d2e3f4a5b6
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'd2e3f4a5b6c7'
+down_revision = 'c1d2e3f4a5b6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    op.create_table(
+        'misskey_note_cache',
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('misskey_note_id', sa.String(length=32), nullable=False),
+        sa.Column('payload', postgresql.JSONB(astext_type=sa.Text()), nullable=False, comment='表示に必要な項目だけに絞ったノート'),
+        sa.Column('fetched_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('user_id', 'misskey_note_id'),
+    )
+
+
+def downgrade():
+    op.drop_table('misskey_note_cache')
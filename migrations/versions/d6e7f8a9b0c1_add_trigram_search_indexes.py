@@ -0,0 +1,55 @@
+"""add pg_trgm GIN indexes for global search
+
+Revision ID: d6e7f8a9b0c1
+Revises: c5d6e7f8a9b0
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'd6e7f8a9b0c1'
+down_revision = 'c5d6e7f8a9b0'
+branch_labels = None
+depends_on = None
+
+
+# (テーブル名, カラム名) の組。インデックス名は ix_<テーブル>_<カラム>_trgm
+TRGM_INDEX_TARGETS = [
+    ('fuel_entries', 'station_name'),
+    ('fuel_entries', 'notes'),
+    ('maintenance_entries', 'description'),
+    ('maintenance_entries', 'category'),
+    ('maintenance_entries', 'notes'),
+    ('general_notes', 'title'),
+    ('general_notes', 'content'),
+    ('activity_logs', 'activity_title'),
+    ('activity_logs', 'custom_location'),
+    ('activity_logs', 'notes'),
+    ('events', 'title'),
+    ('events', 'location'),
+    ('touring_logs', 'title'),
+    ('touring_logs', 'memo'),
+]
+
+
+def upgrade():
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+
+    for table_name, column_name in TRGM_INDEX_TARGETS:
+        op.create_index(
+            f'ix_{table_name}_{column_name}_trgm',
+            table_name,
+            [column_name],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={column_name: 'gin_trgm_ops'},
+        )
+
+
+def downgrade():
+    for table_name, column_name in reversed(TRGM_INDEX_TARGETS):
+        op.drop_index(f'ix_{table_name}_{column_name}_trgm', table_name=table_name)
+    # pg_trgm 拡張は他で利用されている可能性があるため削除しない
@@ -0,0 +1,43 @@
+"""add has_gps_data flag to session_logs
+
+Revision ID: e1f2a3b4c5d6
+Revises: d0e1f2a3b4c5
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e1f2a3b4c5d6'
+down_revision = 'd0e1f2a3b4c5'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('session_logs', schema=None) as batch_op:
+        batch_op.add_column(sa.Column(
+            'has_gps_data',
+            sa.Boolean(),
+            nullable=False,
+            server_default='false',
+            comment='GPS軌跡データを保持しているか',
+        ))
+
+    # 既存レコードのフラグを gps_tracks の内容から埋める
+    op.execute("""
+        UPDATE session_logs
+        SET has_gps_data = TRUE
+        WHERE CASE
+            WHEN jsonb_typeof(gps_tracks -> 'laps') = 'array'
+                THEN jsonb_array_length(gps_tracks -> 'laps') > 0
+            ELSE FALSE
+        END
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('session_logs', schema=None) as batch_op:
+        batch_op.drop_column('has_gps_data')
@@ -0,0 +1,39 @@
+"""add todo_total / todo_done progress columns to general_notes
+
+Revision ID: e3f4a5b6c7d8
+Revises: d2e3f4a5b6c7
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'e3f4a5b6c7d8'
+down_revision = 'd2e3f4a5b6c7'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('general_notes', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('todo_total', sa.Integer(), server_default='0', nullable=False, comment='TODOの件数'))
+        batch_op.add_column(sa.Column('todo_done', sa.Integer(), server_default='0', nullable=False, comment='チェック済みTODOの件数'))
+
+    # 既存のタスクの進捗を todos から計算する
+    op.execute("""
+        UPDATE general_notes
+        SET todo_total = jsonb_array_length(todos),
+            todo_done = (
+                SELECT count(*) FROM jsonb_array_elements(todos) AS item
+                WHERE item -> 'checked' = 'true'::jsonb
+            )
+        WHERE todos IS NOT NULL AND jsonb_typeof(todos) = 'array'
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('general_notes', schema=None) as batch_op:
+        batch_op.drop_column('todo_done')
+        batch_op.drop_column('todo_total')
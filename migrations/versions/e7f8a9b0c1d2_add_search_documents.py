@@ -0,0 +1,76 @@
+"""add search_documents table for global search
+
+Revision ID: e7f8a9b0c1d2
+Revises: d6e7f8a9b0c1
+Create Date: 2026-10-19 12:00:00.000000
+
+適用後に `flask rebuild-search-index` を実行して既存レコードを登録すること。
+"""
+from alembic import op
+import sqlalchemy as sa
+from sqlalchemy.dialects import postgresql
+
+
+# revision identifiers, used by Alembic.
+revision = 'e7f8a9b0c1d2'
+down_revision = 'd6e7f8a9b0c1'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # user_id と search_text の複合GINインデックスに btree_gin が必要
+    op.execute('CREATE EXTENSION IF NOT EXISTS pg_trgm')
+    op.execute('CREATE EXTENSION IF NOT EXISTS btree_gin')
+
+    op.create_table(
+        'search_documents',
+        sa.Column('id', sa.Integer(), nullable=False),
+        sa.Column('user_id', sa.Integer(), nullable=False),
+        sa.Column('motorcycle_id', sa.Integer(), nullable=True, comment='関連する車両のID (車両削除時に一緒に削除)'),
+        sa.Column('entity_type', sa.String(length=30), nullable=False, comment='検索対象の種類 (例: fuel, maintenance)'),
+        sa.Column('entity_id', sa.Integer(), nullable=False, comment='検索対象レコードのID'),
+        sa.Column('title', sa.Text(), nullable=False, server_default='', comment='検索結果に表示するタイトル'),
+        sa.Column('summary', sa.Text(), nullable=True, comment='検索結果に表示する補足テキスト'),
+        sa.Column('body', sa.Text(), nullable=False, server_default='', comment='タイトル以外の検索対象テキスト'),
+        sa.Column('doc_date', sa.DateTime(), nullable=True, comment='並び替え用の日付'),
+        sa.Column(
+            'search_text', sa.Text(),
+            sa.Computed("title || E'\\n' || body", persisted=True),
+            comment='部分一致検索の対象 (タイトル + 本文)'
+        ),
+        sa.Column(
+            'search_vector', postgresql.TSVECTOR(),
+            sa.Computed("to_tsvector('simple'::regconfig, title || ' ' || body)", persisted=True),
+            comment='全文検索用の tsvector'
+        ),
+        sa.Column('updated_at', sa.DateTime(), server_default=sa.text('now()'), nullable=False),
+        sa.ForeignKeyConstraint(['user_id'], ['users.id'], ondelete='CASCADE'),
+        sa.ForeignKeyConstraint(['motorcycle_id'], ['motorcycles.id'], ondelete='CASCADE'),
+        sa.PrimaryKeyConstraint('id'),
+        sa.UniqueConstraint('entity_type', 'entity_id', name='uq_search_documents_entity'),
+    )
+    with op.batch_alter_table('search_documents', schema=None) as batch_op:
+        batch_op.create_index(batch_op.f('ix_search_documents_motorcycle_id'), ['motorcycle_id'], unique=False)
+        batch_op.create_index(
+            'ix_search_documents_user_search_text_trgm',
+            ['user_id', 'search_text'],
+            unique=False,
+            postgresql_using='gin',
+            postgresql_ops={'search_text': 'gin_trgm_ops'},
+        )
+        batch_op.create_index(
+            'ix_search_documents_search_vector',
+            ['search_vector'],
+            unique=False,
+            postgresql_using='gin',
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('search_documents', schema=None) as batch_op:
+        batch_op.drop_index('ix_search_documents_search_vector')
+        batch_op.drop_index('ix_search_documents_user_search_text_trgm')
+        batch_op.drop_index(batch_op.f('ix_search_documents_motorcycle_id'))
+
+    op.drop_table('search_documents')
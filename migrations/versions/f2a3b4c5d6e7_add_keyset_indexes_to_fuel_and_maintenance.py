@@ -0,0 +1,41 @@
+"""add composite indexes for keyset pagination of fuel and maintenance logs
+
+Revision ID: f2a3b4c5d6e7
+Revises: e1f2a3b4c5d6
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f2a3b4c5d6e7'
+down_revision = 'e1f2a3b4c5d6'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    # 一覧の既定の並び順 (日付, 総走行距離, id) に一致させ、シーク時にインデックスを辿れるようにする
+    with op.batch_alter_table('fuel_entries', schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_fuel_entries_motorcycle_date_distance_id',
+            ['motorcycle_id', 'entry_date', 'total_distance', 'id'],
+            unique=False,
+        )
+
+    with op.batch_alter_table('maintenance_entries', schema=None) as batch_op:
+        batch_op.create_index(
+            'ix_maintenance_entries_motorcycle_date_distance_id',
+            ['motorcycle_id', 'maintenance_date', 'total_distance_at_maintenance', 'id'],
+            unique=False,
+        )
+
+
+def downgrade():
+    with op.batch_alter_table('maintenance_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_maintenance_entries_motorcycle_date_distance_id')
+
+    with op.batch_alter_table('fuel_entries', schema=None) as batch_op:
+        batch_op.drop_index('ix_fuel_entries_motorcycle_date_distance_id')
@@ -0,0 +1,42 @@
+"""add motorcycle name to the body of vehicle-bound search_documents
+
+Revision ID: f4a5b6c7d8e9
+Revises: e3f4a5b6c7d8
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f4a5b6c7d8e9'
+down_revision = 'e3f4a5b6c7d8'
+branch_labels = None
+depends_on = None
+
+# utils/search_index.py の SEARCHABLE_TYPES で show_motorcycle_name=True の種類
+MOTORCYCLE_BOUND_TYPES = ('maintenance', 'fuel', 'activity', 'reminder', 'setting', 'touring', 'spec_sheet')
+
+
+def upgrade():
+    # 既存の検索ドキュメントの本文の先頭に車両名を追加する (search_index._build_documents と同じ形式)
+    op.get_bind().execute(sa.text("""
+        UPDATE search_documents AS sd
+        SET body = CASE WHEN sd.body = '' THEN m.name ELSE m.name || E'\\n' || sd.body END
+        FROM motorcycles AS m
+        WHERE m.id = sd.motorcycle_id
+          AND m.name <> ''
+          AND sd.entity_type IN :types
+    """).bindparams(sa.bindparam('types', expanding=True)), {'types': list(MOTORCYCLE_BOUND_TYPES)})
+
+
+def downgrade():
+    op.get_bind().execute(sa.text("""
+        UPDATE search_documents AS sd
+        SET body = CASE WHEN sd.body = m.name THEN '' ELSE substr(sd.body, length(m.name) + 2) END
+        FROM motorcycles AS m
+        WHERE m.id = sd.motorcycle_id
+          AND m.name <> ''
+          AND sd.entity_type IN :types
+    """).bindparams(sa.bindparam('types', expanding=True)), {'types': list(MOTORCYCLE_BOUND_TYPES)})
@@ -0,0 +1,43 @@
+"""add attending/tentative counters to events
+
+Revision ID: f8a9b0c1d2e3
+Revises: e7f8a9b0c1d2
+Create Date: 2026-10-19 12:00:00.000000
+
+"""
+from alembic import op
+import sqlalchemy as sa
+
+
+# revision identifiers, used by Alembic.
+revision = 'f8a9b0c1d2e3'
+down_revision = 'e7f8a9b0c1d2'
+branch_labels = None
+depends_on = None
+
+
+def upgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.add_column(sa.Column('attending_count', sa.Integer(), nullable=False, server_default='0', comment='「参加」の参加者数'))
+        batch_op.add_column(sa.Column('tentative_count', sa.Integer(), nullable=False, server_default='0', comment='「未定」の参加者数'))
+
+    # 既存イベントの件数を参加者テーブルから埋める
+    op.execute("""
+        UPDATE events AS e
+        SET attending_count = counts.attending_count,
+            tentative_count = counts.tentative_count
+        FROM (
+            SELECT event_id,
+                   count(*) FILTER (WHERE status = 'attending') AS attending_count,
+                   count(*) FILTER (WHERE status = 'tentative') AS tentative_count
+            FROM event_participants
+            GROUP BY event_id
+        ) AS counts
+        WHERE counts.event_id = e.id
+    """)
+
+
+def downgrade():
+    with op.batch_alter_table('events', schema=None) as batch_op:
+        batch_op.drop_column('tentative_count')
+        batch_op.drop_column('attending_count')
@@ -52,6 +52,7 @@ def create_app(config_name=None):
         LOCAL_DEV_USER_ID=os.environ.get('LOCAL_DEV_USER_ID'),
         FUEL_ENTRIES_PER_PAGE = int(os.environ.get('FUEL_ENTRIES_PER_PAGE', 20)),
         MAINTENANCE_ENTRIES_PER_PAGE = int(os.environ.get('MAINTENANCE_ENTRIES_PER_PAGE', 20)),
+        FUEL_CHART_MAX_POINTS = int(os.environ.get('FUEL_CHART_MAX_POINTS', 200)),  # 燃費推移チャートの最大返却点数
         NOTES_PER_PAGE = int(os.environ.get('NOTES_PER_PAGE', 20)),
         ACTIVITIES_PER_PAGE = 10,
         GOOGLE_PLACES_API_KEY=os.environ.get('GOOGLE_PLACES_API_KEY'),
@@ -94,6 +95,14 @@ def create_app(config_name=None):
     login_manager.init_app(app)
     limiter.init_app(app)
 
+    # 検索対象レコードの変更を横断検索用の search_documents に同期する
+    from .utils.search_index import register_search_index_listeners
+    register_search_index_listeners()
+
+    # 活動ログ・セッションの変更をチームダッシュボードのサーキット別ランキング集計に同期する
+    from .utils.team_rankings import register_team_ranking_listeners
+    register_team_ranking_listeners()
+
     from .utils.datetime_helpers import format_utc_to_jst_string, to_user_localtime
     app.jinja_env.filters['to_jst'] = format_utc_to_jst_string
     app.jinja_env.filters['user_localtime'] = to_user_localtime
@@ -31,7 +31,9 @@ def check_achievements_for_event(user: User, event_type: str, event_data: dict =
 
     definitions_to_evaluate = []
 
-    directly_triggered_defs = AchievementDefinition.query.filter(
+    directly_triggered_defs = AchievementDefinition.query.options(
+        db.undefer(AchievementDefinition.criteria)
+    ).filter(
         AchievementDefinition.trigger_event_type == event_type,
         AchievementDefinition.code.notin_(unlocked_achievement_codes)
     ).all()
@@ -46,7 +48,9 @@ def check_achievements_for_event(user: User, event_type: str, event_data: dict =
     # mileage_achievement_defs の評価対象は実質的に公道車に限られる。
     # --- ▲▲▲ フェーズ1変更点 ▲▲▲
     if event_type in [EVENT_ADD_FUEL_LOG, EVENT_ADD_MAINTENANCE_LOG]: # これらは公道車のみのイベント
-        mileage_achievement_defs = AchievementDefinition.query.filter(
+        mileage_achievement_defs = AchievementDefinition.query.options(
+            db.undefer(AchievementDefinition.criteria)
+        ).filter(
             AchievementDefinition.criteria['type'].astext == 'mileage_vehicle', # mileage_vehicle は公道車の走行距離を指す
             AchievementDefinition.code.notin_(unlocked_achievement_codes)
         ).all()
@@ -68,6 +72,15 @@ def check_achievements_for_event(user: User, event_type: str, event_data: dict =
             current_app.logger.debug(f"Condition NOT met for achievement {ach_def.code} for user_id: {user.id}")
 
 
+def _reached_by_event(actual_count: int, target: int, event_data: dict = None) -> bool:
+    """
+    今回のイベントで件数が target に到達したかを判定する。
+    CSVインポートのように1回のイベントで複数件追加される場合は、event_data['added_count'] に追加件数を渡す。
+    """
+    added_count = (event_data or {}).get('added_count', 1)
+    return actual_count - added_count < target <= actual_count
+
+
 def evaluate_achievement_condition(user: User, achievement_def: AchievementDefinition, event_type: str, event_data: dict = None) -> bool:
     """
     個別の実績解除条件を評価する。(リアルタイム用)
@@ -94,14 +107,16 @@ def evaluate_achievement_condition(user: User, achievement_def: AchievementDefin
             return event_data and event_data.get('vehicle_count_after_add') == 1
         elif code == "FIRST_FUEL_LOG" and event_type == EVENT_ADD_FUEL_LOG:
             # FuelLog は公道車のみなので、カウントが1ならOK
-            return db.session.query(FuelEntry.id).join(Motorcycle, Motorcycle.id == FuelEntry.motorcycle_id).filter(Motorcycle.user_id == user_id).count() == 1
+            fuel_count = db.session.query(FuelEntry.id).join(Motorcycle, Motorcycle.id == FuelEntry.motorcycle_id).filter(Motorcycle.user_id == user_id).count()
+            return _reached_by_event(fuel_count, 1, event_data)
         elif code == "FIRST_MAINT_LOG" and event_type == EVENT_ADD_MAINTENANCE_LOG:
             # --- ▼▼▼ 変更点 ▼▼▼ ---
             # 「システム登録」カテゴリは除外する
-            return db.session.query(MaintenanceEntry.id).join(Motorcycle, Motorcycle.id == MaintenanceEntry.motorcycle_id).filter(
+            maint_count = db.session.query(MaintenanceEntry.id).join(Motorcycle, Motorcycle.id == MaintenanceEntry.motorcycle_id).filter(
                 Motorcycle.user_id == user_id,
                 MaintenanceEntry.category != 'システム登録'
-            ).count() == 1
+            ).count()
+            return _reached_by_event(maint_count, 1, event_data)
             # --- ▲▲▲ 変更点 ▲▲▲ ---
         elif code == "FIRST_NOTE" and event_type == EVENT_ADD_NOTE:
             return GeneralNote.query.filter_by(user_id=user_id).count() == 1
@@ -124,7 +139,7 @@ def evaluate_achievement_condition(user: User, achievement_def: AchievementDefin
             elif crit_target_model_name == "GeneralNote" and event_type == EVENT_ADD_NOTE:
                 actual_count = GeneralNote.query.filter_by(user_id=user_id).count()
             else: return False
-            return actual_count == crit_value
+            return _reached_by_event(actual_count, crit_value, event_data)
 
         # --- 車両登録台数系 (全車種対象) ---
         elif crit_type == "vehicle_count" and isinstance(crit_value, int) and event_type == EVENT_ADD_VEHICLE:
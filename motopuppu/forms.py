@@ -1081,6 +1081,7 @@ class ScheduleImportConfirmForm(FlaskForm):
     """プレビュー確認後に一括登録するためのフォーム (管理者用)"""
     payload = HiddenField()
     source_url = HiddenField()
+    delete_missing = BooleanField('取り込む日付の既存枠のうち、JSONに含まれないものを削除する', default=False)
     submit_confirm = SubmitField('この内容で一括登録')
 
 
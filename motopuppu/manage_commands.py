@@ -1,36 +1,22 @@
 # motopuppu/manage_commands.py
 import click
 from flask.cli import with_appcontext
-from decimal import Decimal
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, defer
 
 from . import db
 from .models import (
     User, AchievementDefinition, UserAchievement, ActivityLog, SessionLog,
-    Motorcycle, FuelEntry, OdoResetLog
+    Motorcycle, FuelEntry, OdoResetLog, MaintenanceReminder
 )
 from sqlalchemy import asc
 from sqlalchemy.exc import IntegrityError
 from flask import current_app
 from .forms import JAPANESE_CIRCUITS
+from .utils.lap_time_utils import (
+    calculate_lap_stats, compute_lap_statistics, format_seconds_to_time, _calculate_and_set_best_lap
+)
 
 
-# --- データ移行用のヘルパー関数 ---
-def parse_time_to_seconds(time_str):
-    """ "M:S.f" 形式の文字列を秒(Decimal)に変換 """
-    if not isinstance(time_str, str): return None
-    try:
-        parts = time_str.split(':')
-        seconds = Decimal(0)
-        if len(parts) == 2:
-            seconds += Decimal(parts[0]) * 60
-            seconds += Decimal(parts[1])
-        else:
-            seconds += Decimal(parts[0])
-        return seconds
-    except (ValueError, TypeError):
-        return None
-
 # --- CLIコマンドの定義 ---
 
 @click.command("backfill-achievements")
@@ -121,12 +107,10 @@ def migrate_activity_data_command():
 
         # 2. 関連する SessionLog のデータ移行
         for session in activity.sessions:
-            if session.lap_times and isinstance(session.lap_times, list) and len(session.lap_times) > 0:
-                lap_seconds = [s for s in (parse_time_to_seconds(t) for t in session.lap_times) if s is not None]
-
-                if lap_seconds:
-                    session.best_lap_seconds = min(lap_seconds)
-                    migrated_sessions += 1
+            # ベストラップだけでなくラップ統計キャッシュ列もまとめて計算する
+            _calculate_and_set_best_lap(session, session.lap_times)
+            if session.best_lap_seconds is not None:
+                migrated_sessions += 1
 
         migrated_activities += 1
 
@@ -279,6 +263,8 @@ def recalculate_total_distance_command(motorcycle_id, dry_run):
 
     if not dry_run:
         try:
+            motorcycle.touch_fuel_data()
+            motorcycle.refresh_mileage_cache()
             db.session.commit()
             click.echo(click.style("\nデータベースの更新が完了しました。", fg='green', bold=True))
         except Exception as e:
@@ -815,6 +801,305 @@ def post_misskey_bot_command(dry_run):
         raise SystemExit(1)
 
 
+# ▼▼▼ ラップ統計キャッシュ (SessionLog) の backfill / 整合性チェック ▼▼▼
+_LAP_STATS_BATCH_SIZE = 500
+
+
+def _iter_session_batches(only_missing=False):
+    """SessionLog を ID 順のキーセットで分割して取得するジェネレータ (全件ロードを避ける)"""
+    last_id = 0
+    while True:
+        query = SessionLog.query.options(
+            defer(SessionLog.gps_tracks)
+        ).filter(SessionLog.id > last_id)
+        if only_missing:
+            query = query.filter(SessionLog.lap_seconds.is_(None), SessionLog.lap_times.isnot(None))
+        batch = query.order_by(SessionLog.id.asc()).limit(_LAP_STATS_BATCH_SIZE).all()
+        if not batch:
+            return
+        last_id = batch[-1].id
+        yield batch
+
+
+def _diff_lap_stats(session):
+    """キャッシュ列とその場で計算した統計値を比較し、不一致のフィールド名リストを返す"""
+    expected = compute_lap_statistics(session.lap_times)
+    mismatched = [
+        field for field, value in expected.items()
+        if getattr(session, field) != value
+    ]
+
+    # 表示に使われていた従来の計算経路 (calculate_lap_stats) とも突き合わせる
+    best_str, avg_str, _ = calculate_lap_stats(session.lap_times)
+    cached_best = format_seconds_to_time(session.best_lap_seconds) if session.best_lap_seconds is not None else "N/A"
+    cached_avg = format_seconds_to_time(session.average_lap_seconds) if session.average_lap_seconds is not None else "N/A"
+    if best_str != cached_best and 'best_lap_seconds' not in mismatched:
+        mismatched.append('best_lap_seconds')
+    if avg_str != cached_avg and 'average_lap_seconds' not in mismatched:
+        mismatched.append('average_lap_seconds')
+    return mismatched
+
+
+@click.command('backfill-lap-stats')
+@with_appcontext
+@click.option('--all', 'recalculate_all', is_flag=True, help='キャッシュ済みのセッションも含めて全件を再計算します（省略時は未計算のみ）。')
+@click.option('--dry-run', is_flag=True, help='実際にはDBを更新せず、実行結果のプレビューのみ表示します。')
+def backfill_lap_stats_command(recalculate_all, dry_run):
+    """
+    SessionLog のラップ統計キャッシュ列 (lap_seconds, average_lap_seconds 等) を
+    lap_times から計算して埋めます。マイグレーション適用後に一度実行してください。
+    """
+    click.echo("--- ラップ統計キャッシュの backfill を開始します ---")
+    if dry_run:
+        click.echo(click.style("*** ドライランモードで実行中。データベースは更新されません。 ***", fg='yellow'))
+
+    updated_count = 0
+    for batch in _iter_session_batches(only_missing=not recalculate_all):
+        for session in batch:
+            if _diff_lap_stats(session):
+                _calculate_and_set_best_lap(session, session.lap_times)
+                updated_count += 1
+        if dry_run:
+            db.session.rollback()
+            continue
+        try:
+            db.session.commit()
+        except Exception as e:
+            db.session.rollback()
+            click.echo(click.style(f"エラー: バッチ (ID {batch[0].id}〜{batch[-1].id}) の更新に失敗しました。{e}", fg='red'))
+            raise SystemExit(1)
+        click.echo(f"  ID {batch[0].id}〜{batch[-1].id} を処理しました。")
+
+    label = "更新対象" if dry_run else "更新"
+    click.echo(click.style(f"完了: {updated_count} 件のセッションを{label}しました。", fg='green'))
+
+
+@click.command('check-lap-stats')
+@with_appcontext
+@click.option('--limit', 'max_report', default=50, type=int, help='詳細を表示する不一致セッションの最大件数。')
+def check_lap_stats_command(max_report):
+    """
+    SessionLog のラップ統計キャッシュ列を、lap_times からその場で計算した値と比較し、
+    不一致のセッションを報告します。不一致がある場合は終了コード 1 を返します。
+    """
+    click.echo("--- ラップ統計キャッシュの整合性チェックを開始します ---")
+
+    checked_count = 0
+    mismatch_count = 0
+    for batch in _iter_session_batches():
+        for session in batch:
+            checked_count += 1
+            mismatched = _diff_lap_stats(session)
+            if not mismatched:
+                continue
+            mismatch_count += 1
+            if mismatch_count <= max_report:
+                click.echo(click.style(f"  [不一致] SessionLog ID={session.id}: {', '.join(mismatched)}", fg='red'))
+        # 読み取り専用のため、バッチごとにセッションを破棄してメモリを解放する
+        db.session.rollback()
+
+    click.echo("-" * 40)
+    click.echo(f"チェック対象: {checked_count} 件")
+    if mismatch_count:
+        click.echo(click.style(f"不一致: {mismatch_count} 件 (`flask backfill-lap-stats --all` で再計算できます)", fg='red', bold=True))
+        raise SystemExit(1)
+    click.echo(click.style("全てのセッションでキャッシュが一致しました。", fg='green'))
+# ▲▲▲ 追加ここまで ▲▲▲
+
+
+
+# ▼▼▼ 追加: 車両の走行距離キャッシュ列の検証・再計算コマンド ▼▼▼
+@click.command('check-mileage-cache')
+@with_appcontext
+@click.option('--fix', is_flag=True, help='不一致の車両について保持列を再計算してDBを更新します。')
+@click.option('--user-id', default=None, type=int, help='特定のユーザーIDの車両に対して実行（省略時は全車両）')
+def check_mileage_cache_command(fix, user_id):
+    """
+    Motorcycle の current_total_distance / current_odometer / latest_log_date / max_maintenance_hours を
+    給油・整備記録から再計算した値と比較し、不一致を報告します。
+    --fix を付けない場合、不一致があれば終了コード 1 を返します。
+    """
+    fields = ('current_total_distance', 'current_odometer', 'latest_log_date', 'max_maintenance_hours')
+    query = Motorcycle.query.order_by(Motorcycle.id)
+    if user_id:
+        query = query.filter(Motorcycle.user_id == user_id)
+
+    click.echo("--- 車両の走行距離キャッシュ列の整合性チェックを開始します ---")
+    if not fix:
+        click.echo(click.style("--- チェックのみ実行します（DBは更新されません）---", fg='yellow'))
+
+    checked_count = 0
+    mismatch_count = 0
+    for motorcycle in query.all():
+        checked_count += 1
+        stored = {field: getattr(motorcycle, field) for field in fields}
+        motorcycle.refresh_mileage_cache()
+        recalculated = {field: getattr(motorcycle, field) for field in fields}
+        if stored == recalculated:
+            continue
+
+        mismatch_count += 1
+        click.echo(click.style(f"  [不一致] Motorcycle ID={motorcycle.id} ({motorcycle.name})", fg='red'))
+        for field in fields:
+            if stored[field] != recalculated[field]:
+                click.echo(f"    {field}: {stored[field]} -> {click.style(str(recalculated[field]), fg='green')}")
+
+    if fix and mismatch_count:
+        try:
+            db.session.commit()
+            click.echo(click.style(f"\n{mismatch_count} 台の車両を更新しました。", fg='green', bold=True))
+        except Exception as e:
+            db.session.rollback()
+            click.echo(click.style(f"\nエラーが発生しました: {e}", fg='red'))
+            raise SystemExit(1)
+    else:
+        db.session.rollback()
+
+    click.echo("-" * 40)
+    click.echo(f"チェック対象: {checked_count} 台 / 不一致: {mismatch_count} 台")
+    if mismatch_count and not fix:
+        click.echo(click.style("`flask check-mileage-cache --fix` で再計算できます。", fg='red', bold=True))
+        raise SystemExit(1)
+# ▲▲▲ 追加ここまで ▲▲▲
+
+# ▼▼▼ 追加: CSVインポートの負荷確認用フィクスチャ生成コマンド ▼▼▼
+@click.command('generate-import-fixture')
+@click.option('--kind', type=click.Choice(['fuel', 'maintenance']), default='maintenance', help='生成するCSVの種類。')
+@click.option('--rows', default=20000, type=int, help='生成するデータ行数。')
+@click.option('--start-date', default='2000-01-01', help='最初の記録の日付 (YYYY-MM-DD)。')
+@click.option('--seed', default=0, type=int, help='乱数シード (同じ値なら同じCSVを生成します)。')
+@click.argument('output', type=click.File('w', encoding='utf-8-sig'))
+def generate_import_fixture_command(kind, rows, start_date, seed, output):
+    """
+    CSVインポート (給油記録/整備記録) の所要時間を確認するためのダミーCSVを生成します。
+    例: flask generate-import-fixture --kind maintenance --rows 20000 maintenance_20k.csv
+    """
+    import csv
+    import random
+    from datetime import date, timedelta
+    from .constants import MAINTENANCE_CATEGORIES
+
+    rng = random.Random(seed)
+    writer = csv.writer(output)
+    current_date = date.fromisoformat(start_date)
+    odo = 1000
+
+    if kind == 'fuel':
+        writer.writerow(['entry_date', 'odometer_reading', 'fuel_volume', 'price_per_liter', 'total_cost', 'station_name', 'fuel_type', 'is_full_tank', 'exclude_from_average', 'notes'])
+    else:
+        writer.writerow(['maintenance_date', 'odometer_reading_at_maintenance', 'description', 'category', 'location', 'parts_cost', 'labor_cost', 'notes'])
+
+    for i in range(rows):
+        # 日付とODOは単調増加させ、重複チェックに掛からないようにする
+        current_date += timedelta(days=rng.randint(0, 2))
+        odo += rng.randint(50, 400)
+        if kind == 'fuel':
+            volume = round(rng.uniform(5.0, 15.0), 2)
+            price = rng.randint(160, 190)
+            writer.writerow([
+                current_date.isoformat(), odo, f"{volume:.2f}", price, round(volume * price),
+                'テストスタンド', 'レギュラー', 'true' if rng.random() > 0.1 else 'false', 'false', f'fixture #{i + 1}'
+            ])
+        else:
+            category = rng.choice(MAINTENANCE_CATEGORIES)
+            writer.writerow([
+                current_date.isoformat(), odo, f'{category} (fixture #{i + 1})', category,
+                '自宅', rng.randint(0, 20000), rng.choice([0, 0, 1500, 3000]), ''
+            ])
+
+    click.echo(f"{kind} のダミーCSVを {rows} 行生成しました: {output.name}")
+# ▲▲▲ 追加ここまで ▲▲▲
+
+# ▼▼▼ 追加: 全ユーザーの期限が近いリマインダーを一括抽出するコマンド ▼▼▼
+@click.command('report-due-reminders')
+@with_appcontext
+@click.option('--km', 'km_warning', default=None, type=int, help='残り距離がこの値以下なら対象 (省略時は REMINDER_KM_WARNING)')
+@click.option('--days', 'days_warning', default=None, type=int, help='残り日数がこの値以下なら対象 (省略時は REMINDER_DAYS_WARNING)')
+@click.option('--user-id', default=None, type=int, help='特定のユーザーIDに限定（省略時は全ユーザー）')
+def report_due_reminders_command(km_warning, days_warning, user_id):
+    """
+    期限が近い (または過ぎた) メンテナンスリマインダーを全ユーザー分まとめて1回のクエリで抽出し、ユーザーごとに報告します。
+    夜間バッチでの実行を想定しています。例: flask report-due-reminders --days 7
+    """
+    from .utils.reminder_due import select_due_reminders
+
+    stmt = select_due_reminders(km_warning=km_warning, days_warning=days_warning).where(
+        Motorcycle.is_archived == False
+    ).order_by(Motorcycle.user_id, Motorcycle.id, MaintenanceReminder.id)
+    if user_id:
+        stmt = stmt.where(Motorcycle.user_id == user_id)
+
+    click.echo("--- 期限が近いリマインダーの抽出を開始します ---")
+    reminder_count = 0
+    user_ids = set()
+    for row in db.session.execute(stmt):
+        reminder_count += 1
+        user_ids.add(row.user_id)
+        due_parts = []
+        if row.remaining_km is not None:
+            due_parts.append(f"残り {row.remaining_km:,} km")
+        if row.remaining_days is not None:
+            due_parts.append(f"残り {row.remaining_days} 日")
+        click.echo(f"  User ID={row.user_id} / {row.motorcycle_name}: {row.task_description} ({', '.join(due_parts)})")
+
+    click.echo("-" * 40)
+    click.echo(f"対象ユーザー: {len(user_ids)} 人 / リマインダー: {reminder_count} 件")
+# ▲▲▲ 追加ここまで ▲▲▲
+
+# ▼▼▼ 追加: 横断検索用の検索ドキュメントを再構築するコマンド ▼▼▼
+@click.command('rebuild-search-index')
+@with_appcontext
+@click.option('--user-id', default=None, type=int, help='特定のユーザーIDに限定（省略時は全ユーザー）')
+def rebuild_search_index_command(user_id):
+    """
+    search_documents テーブルを検索対象レコードから作り直します。
+    マイグレーション適用直後や、同期漏れが疑われる場合に実行してください。
+    """
+    from .utils.search_index import rebuild_search_documents
+
+    click.echo("--- 検索ドキュメントの再構築を開始します ---")
+    try:
+        counts = rebuild_search_documents(user_id=user_id)
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        click.echo(click.style(f"エラーが発生しました: {e}", fg='red'))
+        raise SystemExit(1)
+
+    for entity_type, count in counts.items():
+        click.echo(f"  {entity_type}: {count} 件")
+    click.echo("-" * 40)
+    click.echo(click.style(f"合計 {sum(counts.values())} 件を登録しました。", fg='green', bold=True))
+# ▲▲▲ 追加ここまで ▲▲▲
+
+# ▼▼▼ 追加: チームダッシュボードのサーキット別ランキング集計を再構築するコマンド ▼▼▼
+@click.command('rebuild-team-rankings')
+@with_appcontext
+@click.option('--team-id', default=None, type=int, help='特定のチームIDに限定（省略時は全チーム）')
+def rebuild_team_rankings_command(team_id):
+    """
+    team_circuit_bests テーブルを活動ログから作り直します。
+    同期漏れが疑われる場合や、ORMを経由せずに活動ログを更新した後に実行してください。
+    """
+    from .models import TeamCircuitBest
+    from .utils.team_rankings import refresh_team_circuit_bests
+
+    click.echo("--- チームランキング集計の再構築を開始します ---")
+    try:
+        refresh_team_circuit_bests(team_id=team_id)
+        query = db.session.query(TeamCircuitBest)
+        if team_id is not None:
+            query = query.filter(TeamCircuitBest.team_id == team_id)
+        count = query.count()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        click.echo(click.style(f"エラーが発生しました: {e}", fg='red'))
+        raise SystemExit(1)
+
+    click.echo(click.style(f"{count} 件のベストラップを登録しました。", fg='green', bold=True))
+# ▲▲▲ 追加ここまで ▲▲▲
+
 # --- アプリケーションへのコマンド登録 ---
 def register_commands(app):
     """FlaskアプリケーションインスタンスにCLIコマンドを登録する"""
@@ -832,4 +1117,11 @@ def register_commands(app):
     app.cli.add_command(post_event_reminders_command)
     app.cli.add_command(post_misskey_bot_command)
     app.cli.add_command(set_admin_command)
+    app.cli.add_command(backfill_lap_stats_command)
+    app.cli.add_command(check_lap_stats_command)
+    app.cli.add_command(generate_import_fixture_command)
+    app.cli.add_command(check_mileage_cache_command)
+    app.cli.add_command(report_due_reminders_command)
+    app.cli.add_command(rebuild_search_index_command)
+    app.cli.add_command(rebuild_team_rankings_command)
     # ▲▲▲ 登録ここまで ▲▲▲
\ No newline at end of file
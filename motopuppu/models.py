@@ -1,14 +1,20 @@
 # motopuppu/models.py
 from . import db
 from datetime import datetime, date
-from sqlalchemy.dialects.postgresql import JSONB
+from sqlalchemy.dialects.postgresql import JSONB, TSVECTOR
 from sqlalchemy import Index, func, text
+from sqlalchemy.orm import deferred
 import uuid
 from decimal import Decimal
 from enum import Enum as PyEnum
 from werkzeug.security import generate_password_hash, check_password_hash
 from flask_login import UserMixin
 
+
+def _trgm_index(name, column):
+    """pg_trgm による部分一致 (ILIKE '%...%') 検索用の GIN インデックス"""
+    return Index(name, column, postgresql_using='gin', postgresql_ops={column: 'gin_trgm_ops'})
+
 # --- データベースモデル定義 ---
 
 class User(UserMixin, db.Model):
@@ -37,6 +43,7 @@ class User(UserMixin, db.Model):
     encrypted_misskey_api_token = db.Column(db.Text, nullable=True, comment="暗号化されたMisskey APIトークン")
 
     completed_tutorials = db.Column(JSONB, nullable=False, server_default=text("'{}'::jsonb"), comment="完了したチュートリアルのキーを格納する (例: {'initial_setup': true})")
+    calendar_feed_token = db.Column(db.String(64), unique=True, nullable=True, index=True, comment="購読用カレンダーフィード (ICS) のURLトークン")
 
     motorcycles = db.relationship('Motorcycle', foreign_keys='Motorcycle.user_id', backref='owner', lazy=True, cascade="all, delete-orphan")
     general_notes = db.relationship('GeneralNote', backref='owner', lazy=True, cascade="all, delete-orphan")
@@ -94,6 +101,14 @@ class Motorcycle(db.Model):
     primary_ratio = db.Column(db.Numeric(7, 4), nullable=True, comment="一次減速比")
     gear_ratios = db.Column(JSONB, nullable=True, comment="各ギアの変速比 (例: {'1': 2.846, '2': 2.000, ...})")
 
+    fuel_data_updated_at = db.Column(db.DateTime, nullable=True, comment="給油記録の最終更新日時 (チャートAPIのETag算出用)")
+
+    # 給油・整備記録から算出する値の保持列 (記録の書き込み時に refresh_mileage_cache() で更新)
+    current_total_distance = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment="記録上の最大総走行距離 (ODO保留記録を除く)")
+    current_odometer = db.Column(db.Integer, nullable=True, comment="最新の給油・整備記録時点のメーターODO値")
+    latest_log_date = db.Column(db.Date, nullable=True, comment="最新の給油・整備記録の日付 (ODO保留記録を除く)")
+    max_maintenance_hours = db.Column(db.Numeric(8, 2), nullable=True, comment="整備記録上の最大稼働時間 (レーサー用)")
+
     fuel_entries = db.relationship('FuelEntry', backref='motorcycle', lazy='dynamic', order_by="desc(FuelEntry.entry_date)", cascade="all, delete-orphan")
     maintenance_entries = db.relationship('MaintenanceEntry', backref='motorcycle', lazy='dynamic', order_by="desc(MaintenanceEntry.maintenance_date)", cascade="all, delete-orphan")
     consumable_logs = db.relationship('ConsumableLog', backref='motorcycle', lazy='dynamic', order_by="desc(ConsumableLog.change_date)", cascade="all, delete-orphan")
@@ -108,6 +123,53 @@ class Motorcycle(db.Model):
 
     maintenance_spec_sheets = db.relationship('MaintenanceSpecSheet', backref='motorcycle', lazy='dynamic', order_by="desc(MaintenanceSpecSheet.updated_at)", cascade="all, delete-orphan")
 
+    def touch_fuel_data(self):
+        """給油記録の追加・更新・削除時に呼び出し、チャートAPIのキャッシュ(ETag)を無効化する"""
+        self.fuel_data_updated_at = datetime.utcnow()
+
+    def refresh_mileage_cache(self):
+        """
+        給油・整備記録の追加・更新・削除の後、commit 前に呼び出し、
+        current_total_distance / current_odometer / latest_log_date / max_maintenance_hours を再計算する。
+        集計は呼び出し元と同じトランザクション内で行われる。
+        """
+        db.session.flush()
+
+        latest_fuel = db.session.query(
+            FuelEntry.entry_date, FuelEntry.odometer_reading, FuelEntry.total_distance
+        ).filter(
+            FuelEntry.motorcycle_id == self.id,
+            FuelEntry.is_odo_pending == False
+        ).order_by(FuelEntry.entry_date.desc(), FuelEntry.total_distance.desc(), FuelEntry.id.desc()).first()
+        latest_maint = db.session.query(
+            MaintenanceEntry.maintenance_date, MaintenanceEntry.odometer_reading_at_maintenance,
+            MaintenanceEntry.total_distance_at_maintenance
+        ).filter(
+            MaintenanceEntry.motorcycle_id == self.id,
+            MaintenanceEntry.is_odo_pending == False
+        ).order_by(
+            MaintenanceEntry.maintenance_date.desc(), MaintenanceEntry.total_distance_at_maintenance.desc(), MaintenanceEntry.id.desc()
+        ).first()
+        max_fuel_dist, max_maint_dist, max_hours = db.session.query(
+            db.select(func.max(FuelEntry.total_distance)).where(
+                FuelEntry.motorcycle_id == self.id, FuelEntry.is_odo_pending == False
+            ).scalar_subquery(),
+            db.select(func.max(MaintenanceEntry.total_distance_at_maintenance)).where(
+                MaintenanceEntry.motorcycle_id == self.id, MaintenanceEntry.is_odo_pending == False
+            ).scalar_subquery(),
+            db.select(func.max(MaintenanceEntry.operating_hours_at_maintenance)).where(
+                MaintenanceEntry.motorcycle_id == self.id
+            ).scalar_subquery()
+        ).one()
+
+        candidates = [log for log in (latest_fuel, latest_maint) if log is not None]
+        latest = max(candidates, key=lambda log: (log[0], log[2])) if candidates else None
+
+        self.current_total_distance = max(max_fuel_dist or 0, max_maint_dist or 0)
+        self.current_odometer = latest[1] if latest else None
+        self.latest_log_date = latest[0] if latest else None
+        self.max_maintenance_hours = max_hours
+
     def calculate_cumulative_offset_from_logs(self, target_date=None):
         if self.is_racer:
             return 0
@@ -117,27 +179,18 @@ class Motorcycle(db.Model):
         return result if result is not None else 0
 
     def get_display_total_mileage(self):
-        # ODO保留中 (is_odo_pending=True) のレコードは最大距離計算から除外
-        latest_fuel_dist = db.session.query(func.max(FuelEntry.total_distance)).filter(
-            FuelEntry.motorcycle_id == self.id,
-            FuelEntry.is_odo_pending == False
-        ).scalar() or 0
-        latest_maint_dist = db.session.query(func.max(MaintenanceEntry.total_distance_at_maintenance)).filter(
-            MaintenanceEntry.motorcycle_id == self.id,
-            MaintenanceEntry.is_odo_pending == False
-        ).scalar() or 0
+        # ODO保留中 (is_odo_pending=True) のレコードは current_total_distance の算出から除外済み
         current_offset = self.odometer_offset if self.odometer_offset is not None else 0
-        return max(latest_fuel_dist, latest_maint_dist, current_offset)
+        return max(self.current_total_distance or 0, current_offset)
 
     @property
     def display_operating_hours(self):
         base_hours = self.total_operating_hours if self.total_operating_hours is not None else Decimal('0.00')
         if not self.is_racer:
             return base_hours
-            
-        max_maintenance_hours = db.session.query(func.max(MaintenanceEntry.operating_hours_at_maintenance)).filter_by(motorcycle_id=self.id).scalar()
-        if max_maintenance_hours is not None:
-            return max(base_hours, max_maintenance_hours)
+
+        if self.max_maintenance_hours is not None:
+            return max(base_hours, self.max_maintenance_hours)
         return base_hours
 
     def __repr__(self):
@@ -159,10 +212,19 @@ class FuelEntry(db.Model):
     is_full_tank = db.Column(db.Boolean, nullable=False, server_default='true')
     exclude_from_average = db.Column(db.Boolean, nullable=False, default=False, server_default='false')
     is_odo_pending = db.Column(db.Boolean, nullable=False, default=False, server_default='false', comment="ODO入力保留フラグ")
-    __table_args__ = (Index('ix_fuel_entries_entry_date', 'entry_date'),)
+    __table_args__ = (
+        Index('ix_fuel_entries_entry_date', 'entry_date'),
+        Index('ix_fuel_entries_motorcycle_date_distance_id', 'motorcycle_id', 'entry_date', 'total_distance', 'id'),
+        _trgm_index('ix_fuel_entries_station_name_trgm', 'station_name'),
+        _trgm_index('ix_fuel_entries_notes_trgm', 'notes'),
+    )
 
     @property
     def km_per_liter(self):
+        # services.preload_fuel_kpl() で一括計算済みならその値を使う
+        if hasattr(self, '_preloaded_kpl'):
+            return self._preloaded_kpl
+
         if self.motorcycle and self.motorcycle.is_racer:
             return None
 
@@ -226,7 +288,14 @@ class MaintenanceEntry(db.Model):
     notes = db.Column(db.Text, nullable=True)
     is_odo_pending = db.Column(db.Boolean, nullable=False, default=False, server_default='false', comment="ODO/稼働時間入力保留フラグ")
     attachments = db.relationship('Attachment', backref='maintenance_entry', lazy=True, cascade="all, delete-orphan", order_by='Attachment.sort_order, Attachment.id')
-    __table_args__ = (Index('ix_maintenance_entries_category', 'category'), Index('ix_maintenance_entries_maintenance_date', 'maintenance_date'),)
+    __table_args__ = (
+        Index('ix_maintenance_entries_category', 'category'),
+        Index('ix_maintenance_entries_maintenance_date', 'maintenance_date'),
+        Index('ix_maintenance_entries_motorcycle_date_distance_id', 'motorcycle_id', 'maintenance_date', 'total_distance_at_maintenance', 'id'),
+        _trgm_index('ix_maintenance_entries_description_trgm', 'description'),
+        _trgm_index('ix_maintenance_entries_category_trgm', 'category'),
+        _trgm_index('ix_maintenance_entries_notes_trgm', 'notes'),
+    )
     @property
     def total_cost(self):
         cost_parts = self.parts_cost if self.parts_cost is not None else 0.0
@@ -275,12 +344,28 @@ class MaintenanceReminder(db.Model):
     snoozed_until = db.Column(db.DateTime, nullable=True, comment="スヌーズ期限 (UTC)")
     is_dismissed = db.Column(db.Boolean, nullable=False, default=False, server_default='false', comment="非表示フラグ")
 
+    # ▼▼▼ 追加: 次回期限 (DB側で算出される生成列) ▼▼▼
+    next_due_km = db.Column(
+        db.Integer, db.Computed('last_done_km + interval_km', persisted=True),
+        comment="次回期限の総走行距離 (最終実施時の総走行距離 + 距離間隔)"
+    )
+    next_due_date = db.Column(
+        db.Date, db.Computed("(last_done_date + interval_months * interval '1 month')::date", persisted=True),
+        comment="次回期限日 (最終実施日 + 期間間隔)"
+    )
+    # ▲▲▲ 追加ここまで ▲▲▲
+
     last_maintenance_entry = db.relationship(
         'MaintenanceEntry', 
         foreign_keys=[last_maintenance_entry_id],
         backref=db.backref('reminders_as_last', lazy='dynamic'), 
         lazy='joined' 
     )
+    __table_args__ = (
+        # 期限が近いリマインダーの抽出 (utils/reminder_due.py) 用。非表示のものは対象外
+        Index('ix_maintenance_reminders_motorcycle_next_due_km', 'motorcycle_id', 'next_due_km', postgresql_where=text('is_dismissed = false')),
+        Index('ix_maintenance_reminders_next_due_date', 'next_due_date', postgresql_where=text('is_dismissed = false')),
+    )
     def __repr__(self): return f'<MaintenanceReminder id={self.id} task={self.task_description}>'
 
 class Attachment(db.Model):
@@ -305,10 +390,31 @@ class GeneralNote(db.Model):
     content = db.Column(db.Text, nullable=True)
     category = db.Column(db.String(20), nullable=False, default='note', server_default='note', index=True)
     is_pinned = db.Column(db.Boolean, nullable=False, default=False, server_default='false', index=True)
-    todos = db.Column(JSONB, nullable=True)
+    # 重いJSONB列は既定で遅延ロードし、使用箇所で undefer する
+    todos = deferred(db.Column(JSONB, nullable=True))
+    # ▼▼▼ 追加: タスクの進捗 (todos から保存時に計算する。一覧で todos を走査しないため) ▼▼▼
+    todo_total = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment='TODOの件数')
+    todo_done = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment='チェック済みTODOの件数')
+    # ▲▲▲ 追加ここまで ▲▲▲
     created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now())
     event = db.relationship('Event', backref=db.backref('notes', lazy='dynamic', order_by='GeneralNote.is_pinned.desc(), GeneralNote.note_date.desc()'))
+    __table_args__ = (
+        _trgm_index('ix_general_notes_title_trgm', 'title'),
+        _trgm_index('ix_general_notes_content_trgm', 'content'),
+    )
+
+    def refresh_todo_progress(self):
+        """todos から todo_total / todo_done を計算し直す。todos を変更したら保存前に呼ぶこと"""
+        todos = self.todos or []
+        self.todo_total = len(todos)
+        self.todo_done = sum(1 for item in todos if item.get('checked'))
+
+    @property
+    def is_completed_task(self):
+        """TODOが1件以上あり、すべてチェック済みのタスクか"""
+        return self.category == 'task' and self.todo_total > 0 and self.todo_done == self.todo_total
+
     def __repr__(self): return f'<GeneralNote id={self.id} user_id={self.user_id} title="{self.title[:20]}">'
 
 class OdoResetLog(db.Model):
@@ -333,7 +439,7 @@ class AchievementDefinition(db.Model):
     category_name = db.Column(db.String(100), nullable=False)
     share_text_template = db.Column(db.Text, nullable=True)
     trigger_event_type = db.Column(db.String(100), nullable=True, index=True)
-    criteria = db.Column(JSONB, nullable=True)
+    criteria = deferred(db.Column(JSONB, nullable=True))
     user_achievements = db.relationship('UserAchievement', backref='definition', lazy='dynamic')
     def __repr__(self): return f'<AchievementDefinition code={self.code} name="{self.name}">'
 
@@ -352,7 +458,7 @@ class SettingSheet(db.Model):
     motorcycle_id = db.Column(db.Integer, db.ForeignKey('motorcycles.id', ondelete='CASCADE'), nullable=False)
     user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
     sheet_name = db.Column(db.String(100), nullable=False, index=True)
-    details = db.Column(JSONB, nullable=False)
+    details = deferred(db.Column(JSONB, nullable=False))
     notes = db.Column(db.Text, nullable=True)
     is_archived = db.Column(db.Boolean, default=False, nullable=False)
     created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
@@ -381,6 +487,12 @@ class ActivityLog(db.Model):
     
     share_with_teams = db.Column(db.Boolean, nullable=False, default=False, server_default='false', comment="この活動ログを所属チームに共有するか")
 
+    __table_args__ = (
+        _trgm_index('ix_activity_logs_activity_title_trgm', 'activity_title'),
+        _trgm_index('ix_activity_logs_custom_location_trgm', 'custom_location'),
+        _trgm_index('ix_activity_logs_notes_trgm', 'notes'),
+    )
+
     @property
     def location_name_display(self):
         if self.location_type == 'circuit' and self.circuit_name:
@@ -400,7 +512,9 @@ class SessionLog(db.Model):
     setting_sheet_id = db.Column(db.Integer, db.ForeignKey('setting_sheets.id', ondelete='SET NULL'), nullable=True)
     session_name = db.Column(db.String(100), nullable=True, default='Session 1')
     lap_times = db.Column(JSONB, nullable=True)
-    gps_tracks = db.Column(JSONB, nullable=True, comment="ラップごとのGPS軌跡データ")
+    # GPS軌跡は数MBになり得るため既定で遅延ロードする。表示可否の判定は has_gps_data を使うこと
+    gps_tracks = deferred(db.Column(JSONB, nullable=True, comment="ラップごとのGPS軌跡データ"))
+    has_gps_data = db.Column(db.Boolean, nullable=False, default=False, server_default='false', comment="GPS軌跡データを保持しているか")
     rider_feel = db.Column(db.Text, nullable=True)
     operating_hours_start = db.Column(db.Numeric(8, 2), nullable=True)
     operating_hours_end = db.Column(db.Numeric(8, 2), nullable=True)
@@ -409,11 +523,26 @@ class SessionLog(db.Model):
     session_duration_hours = db.Column(db.Numeric(8, 2), nullable=True)
     session_distance = db.Column(db.Integer, nullable=True)
     best_lap_seconds = db.Column(db.Numeric(8, 3), nullable=True, index=True, comment="このセッションでのベストラップ（秒）")
+    # ▼▼▼ ラップ統計キャッシュ (ラップ保存時に一度だけ計算) ▼▼▼
+    lap_seconds = db.Column(JSONB, nullable=True, comment="lap_timesを秒に変換した数値配列（無効ラップはnull）")
+    average_lap_seconds = db.Column(db.Numeric(8, 3), nullable=True, comment="有効ラップの平均タイム（秒）")
+    median_lap_seconds = db.Column(db.Numeric(8, 3), nullable=True, comment="有効ラップの中央値（秒）")
+    worst_lap_seconds = db.Column(db.Numeric(8, 3), nullable=True, comment="有効ラップの最遅タイム（秒）")
+    lap_stddev_seconds = db.Column(db.Numeric(8, 3), nullable=True, comment="有効ラップの標準偏差（秒）")
+    lap_consistency = db.Column(db.Numeric(5, 2), nullable=True, comment="ラップの安定度 (1 - 標準偏差/平均) * 100")
+    valid_lap_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment="有効ラップ数")
+    # ▲▲▲ 追加ここまで ▲▲▲
     include_in_leaderboard = db.Column(db.Boolean, nullable=False, default=True, server_default='true', comment="この記録をリーダーボードに掲載するか")
     allow_misskey_post = db.Column(db.Boolean, nullable=False, default=True, server_default='true', comment="このセッションのベストラップをMisskey botが自動投稿してよいか")
     public_share_token = db.Column(db.String(36), unique=True, nullable=True, index=True, comment="外部共有用の一意なトークン (UUID)")
     is_public = db.Column(db.Boolean, nullable=False, default=False, server_default='false', comment="このセッションを外部共有するか")
     setting_sheet = db.relationship('SettingSheet', backref='sessions')
+
+    def set_gps_tracks(self, gps_tracks):
+        """GPS軌跡データをセットし、has_gps_data フラグを同期する"""
+        self.gps_tracks = gps_tracks
+        self.has_gps_data = bool(gps_tracks and gps_tracks.get('laps'))
+
     def __repr__(self):
         return f'<SessionLog id={self.id} activity_id={self.activity_log_id}>'
 
@@ -470,6 +599,11 @@ class Event(db.Model):
     # 写真置き場 (Misskey Media Share のアルバムURL)
     album_url = db.Column(db.String(500), nullable=True, comment="イベント写真置き場のURL (例: Misskey Media Share アルバム)")
 
+    # ▼▼▼ 追加: 出欠人数 (参加者の追加・変更・削除時に refresh_participant_counts で更新) ▼▼▼
+    attending_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment="「参加」の参加者数")
+    tentative_count = db.Column(db.Integer, nullable=False, default=0, server_default='0', comment="「未定」の参加者数")
+    # ▲▲▲ 追加ここまで ▲▲▲
+
     created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
     updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now())
     
@@ -482,6 +616,27 @@ class Event(db.Model):
     
     participants = db.relationship('EventParticipant', backref='event', lazy='dynamic', cascade="all, delete-orphan")
     activity_logs = db.relationship('ActivityLog', backref='origin_event', lazy='dynamic', order_by="desc(ActivityLog.activity_date)")
+
+    __table_args__ = (
+        _trgm_index('ix_events_title_trgm', 'title'),
+        _trgm_index('ix_events_location_trgm', 'location'),
+    )
+
+    def refresh_participant_counts(self):
+        """
+        参加者の追加・出欠変更・削除の後、commit 前に呼び出し、attending_count / tentative_count を再計算する。
+        同じイベントへの同時更新で数え漏れが起きないよう、イベント行をロックしてから数え直す
+        (後から数えたトランザクションは、先にコミットされた変更も含めて数える)。
+        参加者の INSERT が外部キー検査でイベント行に取る KEY SHARE ロックとは競合しないよう、
+        FOR NO KEY UPDATE でロックする (FOR UPDATE だと同時参加登録がデッドロックする)。
+        """
+        db.session.flush()
+        db.session.query(Event.id).filter(Event.id == self.id).with_for_update(key_share=True).one()
+        self.attending_count, self.tentative_count = db.session.query(
+            func.count(EventParticipant.id).filter(EventParticipant.status == ParticipationStatus.ATTENDING),
+            func.count(EventParticipant.id).filter(EventParticipant.status == ParticipationStatus.TENTATIVE)
+        ).filter(EventParticipant.event_id == self.id).one()
+
     def __repr__(self):
         return f'<Event id={self.id} title="{self.title}">'
 
@@ -558,7 +713,11 @@ class EventParticipant(db.Model):
     # ユーザーとのリレーションを追加
     user = db.relationship('User', backref=db.backref('event_participations', lazy='dynamic'))
     
+    # 楽観的排他制御用のバージョン。ORM からの更新では自動で加算され、当日モードの一括更新でも照合・加算する
+    row_version = db.Column(db.Integer, nullable=False, server_default='1', comment="楽観的排他制御用のバージョン番号")
+
     __table_args__ = (db.UniqueConstraint('event_id', 'name', name='uq_event_participant_name'),)
+    __mapper_args__ = {'version_id_col': row_version}
     def set_passcode(self, passcode):
         if passcode:
             self.passcode_hash = generate_password_hash(passcode)
@@ -606,6 +765,11 @@ class TouringLog(db.Model):
     spots = db.relationship('TouringSpot', backref='touring_log', cascade="all, delete-orphan", order_by="TouringSpot.order")
     scrapbook_entries = db.relationship('TouringScrapbookEntry', backref='touring_log', cascade="all, delete-orphan")
 
+    __table_args__ = (
+        _trgm_index('ix_touring_logs_title_trgm', 'title'),
+        _trgm_index('ix_touring_logs_memo_trgm', 'memo'),
+    )
+
     def __repr__(self):
         return f'<TouringLog id={self.id} title="{self.title}">'
 
@@ -639,6 +803,22 @@ class TouringScrapbookEntry(db.Model):
     def __repr__(self):
         return f'<TouringScrapbookEntry log_id={self.touring_log_id} note_id="{self.misskey_note_id}">'
 
+# ▼▼▼ 追加: スクラップブック用の Misskey ノートキャッシュ ▼▼▼
+class MisskeyNoteCache(db.Model):
+    """
+    スクラップブックに表示する Misskey ノートの表示用データ。
+    閲覧できるノートはトークンの持ち主ごとに異なるため、ユーザー単位で保持する。
+    """
+    __tablename__ = 'misskey_note_cache'
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True)
+    misskey_note_id = db.Column(db.String(32), primary_key=True)
+    payload = db.Column(JSONB, nullable=False, comment='表示に必要な項目だけに絞ったノート')
+    fetched_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+
+    def __repr__(self):
+        return f'<MisskeyNoteCache user_id={self.user_id} note_id="{self.misskey_note_id}">'
+# ▲▲▲ 追加ここまで ▲▲▲
+
 class MaintenanceSpecSheet(db.Model):
     __tablename__ = 'maintenance_spec_sheets'
     id = db.Column(db.Integer, primary_key=True)
@@ -681,7 +861,7 @@ class UserCircuitTarget(db.Model):
 # UserとTeamの中間テーブル
 team_members = db.Table('team_members',
     db.Column('user_id', db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True),
-    db.Column('team_id', db.Integer, db.ForeignKey('teams.id', ondelete='CASCADE'), primary_key=True)
+    db.Column('team_id', db.Integer, db.ForeignKey('teams.id', ondelete='CASCADE'), primary_key=True, index=True)
 )
 
 class Team(db.Model):
@@ -700,9 +880,39 @@ class Team(db.Model):
     members = db.relationship('User', secondary=team_members, lazy='dynamic',
                               backref=db.backref('teams', lazy='dynamic'))
 
+    def has_member(self, user_id):
+        """指定ユーザーがメンバーかを、メンバー一覧を読み込まずに判定する"""
+        return db.session.query(
+            db.exists().where(team_members.c.team_id == self.id, team_members.c.user_id == user_id)
+        ).scalar()
+
     def __repr__(self):
         return f'<Team id={self.id} name="{self.name}">'
 
+
+class TeamCircuitBest(db.Model):
+    """
+    チームダッシュボードのサーキット別ランキング用の集計。
+    (チーム, メンバー, サーキット) ごとに、チームに共有された活動ログでのベストラップを保持する。
+    活動ログ・セッションの変更時とメンバーの参加・脱退時に utils/team_rankings.py が更新する。
+    """
+    __tablename__ = 'team_circuit_bests'
+
+    team_id = db.Column(db.Integer, db.ForeignKey('teams.id', ondelete='CASCADE'), primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), primary_key=True, index=True)
+    circuit_name = db.Column(db.String(150), primary_key=True)
+    best_lap_seconds = db.Column(db.Numeric(8, 3), nullable=False, comment="共有された活動ログでのベストラップ（秒）")
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+
+    user = db.relationship('User')
+
+    __table_args__ = (
+        db.Index('ix_team_circuit_bests_ranking', 'team_id', 'circuit_name', 'best_lap_seconds'),
+    )
+
+    def __repr__(self):
+        return f'<TeamCircuitBest team_id={self.team_id} user_id={self.user_id} circuit="{self.circuit_name}">'
+
 # --- ▼▼▼ 追加: 走行枠スケジュール管理用モデル ▼▼▼ ---
 class TrackSchedule(db.Model):
     """
@@ -726,6 +936,7 @@ class TrackSchedule(db.Model):
     source_url = db.Column(db.String(2048), nullable=True)
     
     created_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now())
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now(), comment="最終更新日時 (カレンダーフィードの変更検知用)")
 
     # 重複登録を防ぐためのユニーク制約（サーキット、日付、開始時間、タイトル）
     __table_args__ = (
@@ -733,4 +944,44 @@ class TrackSchedule(db.Model):
     )
 
     def __repr__(self):
-        return f'<TrackSchedule {self.circuit_name} {self.date} {self.title}>'
\ No newline at end of file
+        return f'<TrackSchedule {self.circuit_name} {self.date} {self.title}>'
+
+# --- ▼▼▼ 追加: 横断検索用の検索ドキュメント ▼▼▼ ---
+class SearchDocument(db.Model):
+    """
+    横断検索用に、ユーザーの検索対象レコードを1テーブルへ非正規化したもの。
+    検索対象レコードの登録・編集・削除時に utils/search_index.py が同期する。
+    """
+    __tablename__ = 'search_documents'
+    id = db.Column(db.Integer, primary_key=True)
+    user_id = db.Column(db.Integer, db.ForeignKey('users.id', ondelete='CASCADE'), nullable=False)
+    motorcycle_id = db.Column(db.Integer, db.ForeignKey('motorcycles.id', ondelete='CASCADE'), nullable=True, index=True, comment="関連する車両のID (車両削除時に一緒に削除)")
+    entity_type = db.Column(db.String(30), nullable=False, comment="検索対象の種類 (例: fuel, maintenance)")
+    entity_id = db.Column(db.Integer, nullable=False, comment="検索対象レコードのID")
+    title = db.Column(db.Text, nullable=False, default='', server_default='', comment="検索結果に表示するタイトル")
+    summary = db.Column(db.Text, nullable=True, comment="検索結果に表示する補足テキスト")
+    body = db.Column(db.Text, nullable=False, default='', server_default='', comment="タイトル以外の検索対象テキスト")
+    doc_date = db.Column(db.DateTime, nullable=True, comment="並び替え用の日付")
+    search_text = db.Column(
+        db.Text, db.Computed("title || E'\\n' || body", persisted=True),
+        comment="部分一致検索の対象 (タイトル + 本文)"
+    )
+    search_vector = db.Column(
+        TSVECTOR, db.Computed("to_tsvector('simple'::regconfig, title || ' ' || body)", persisted=True),
+        comment="全文検索用の tsvector"
+    )
+    updated_at = db.Column(db.DateTime, nullable=False, server_default=db.func.now(), onupdate=db.func.now())
+
+    __table_args__ = (
+        db.UniqueConstraint('entity_type', 'entity_id', name='uq_search_documents_entity'),
+        # ユーザーで絞り込みつつ部分一致検索するための複合GINインデックス (btree_gin 拡張が必要)
+        Index(
+            'ix_search_documents_user_search_text_trgm', 'user_id', 'search_text',
+            postgresql_using='gin', postgresql_ops={'search_text': 'gin_trgm_ops'}
+        ),
+        Index('ix_search_documents_search_vector', 'search_vector', postgresql_using='gin'),
+    )
+
+    def __repr__(self):
+        return f'<SearchDocument {self.entity_type}:{self.entity_id} user_id={self.user_id}>'
+# --- ▲▲▲ 追加ここまで ▲▲▲ ---
@@ -2,15 +2,16 @@
 import re
 import random
 import os
-from datetime import datetime, timezone
+from datetime import datetime
 from zoneinfo import ZoneInfo
 
 from flask import current_app
 from sqlalchemy import desc, func
-from .models import db, Motorcycle, FuelEntry, MaintenanceEntry, ActivityLog, MaintenanceReminder, SessionLog
+from .models import db, Motorcycle, FuelEntry, MaintenanceEntry, ActivityLog, SessionLog
 # ▼▼▼【ここから追記】ベストラップタイムをフォーマットする関数をインポート ▼▼▼
 from .utils.lap_time_utils import format_seconds_to_time
 # ▲▲▲【追記はここまで】▲▲▲
+from .utils.reminder_due import select_due_reminders
 
 def get_advice(user, motorcycles):
     """
@@ -376,11 +377,14 @@ def get_advice(user, motorcycles):
                     advice_pool.append(("レース用車両のセッティング、うまくいってるかにゃ？活動ログで微調整を記録するにゃ！", "blobcat_asterisk.png"))
 
             # --- リマインダー関連 ---
-            overdue_reminders_count = MaintenanceReminder.query.join(Motorcycle).filter(
+            # 期限が近い（または過ぎた）ものだけを数える
+            due_reminders = select_due_reminders().where(
                 Motorcycle.user_id == user.id,
-                MaintenanceReminder.is_dismissed == False,
-                (MaintenanceReminder.snoozed_until == None) | (MaintenanceReminder.snoozed_until <= datetime.now(timezone.utc))
-            ).count()
+                Motorcycle.is_archived == False
+            ).subquery()
+            overdue_reminders_count = db.session.scalar(
+                db.select(func.count()).select_from(due_reminders)
+            )
             if overdue_reminders_count > 0:
                 advice_pool.append((f"期限が近い（または過ぎた）リマインダーが{overdue_reminders_count}件あるにゃ。確認を忘れずににゃん！", "blobcat_aseri.png"))
 
@@ -393,8 +397,7 @@ def get_advice(user, motorcycles):
             
             for m in motorcycles:
                 if not m.is_racer:
-                    from .services import get_latest_total_distance
-                    mileage = get_latest_total_distance(m.id, m.odometer_offset)
+                    mileage = m.get_display_total_mileage()
                     if 50000 > mileage > 49500 or 100000 > mileage > 99500:
                         advice_pool.append((f"{m.name}がもうすぐ大台に乗りそうにゃ！記念すべき瞬間を見逃さないようににゃ！", "blobcat_oh.png"))
 
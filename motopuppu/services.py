@@ -1,17 +1,16 @@
 # motopuppu/services.py
 from flask import current_app, url_for
 from datetime import date, timedelta, datetime, timezone
-from dateutil.relativedelta import relativedelta
 from sqlalchemy import func, union_all, and_
 from sqlalchemy.orm import joinedload
-import jpholiday
-import json
 import math
+from itertools import groupby
 from zoneinfo import ZoneInfo
 from cryptography.fernet import Fernet
 
 from .nyanpuppu import get_advice
 from .utils.fuel_calculator import calculate_kpl_bulk
+from .utils.reminder_due import get_reminder_thresholds, select_due_reminders
 from .models import db, Motorcycle, FuelEntry, MaintenanceEntry, MaintenanceReminder, ActivityLog, GeneralNote, UserAchievement, AchievementDefinition, SessionLog, User
 from .utils.lap_time_utils import format_seconds_to_time
 
@@ -133,19 +132,6 @@ def get_announcements():
 
     return announcements_for_modal, None
 
-def get_latest_total_distance(motorcycle_id, offset_val):
-    # ODO保留中 (is_odo_pending=True) のレコードは最大距離計算から除外
-    latest_fuel_dist = db.session.query(db.func.max(FuelEntry.total_distance)).filter(
-        FuelEntry.motorcycle_id == motorcycle_id,
-        FuelEntry.is_odo_pending == False
-    ).scalar() or 0
-    latest_maint_dist = db.session.query(db.func.max(MaintenanceEntry.total_distance_at_maintenance)).filter(
-        MaintenanceEntry.motorcycle_id == motorcycle_id,
-        MaintenanceEntry.is_odo_pending == False
-    ).scalar() or 0
-    return max(latest_fuel_dist, latest_maint_dist, offset_val if offset_val is not None else 0)
-
-
 def calculate_kpl_sums(motorcycle: Motorcycle, start_date=None, end_date=None):
     """車両の平均燃費の元になる「総走行距離」「総消費燃料」を算出して返す。
 
@@ -165,10 +151,22 @@ def calculate_kpl_sums(motorcycle: Motorcycle, start_date=None, end_date=None):
     if motorcycle.is_racer:
         return 0.0, 0.0
 
-    entries = FuelEntry.query.filter(
+    entries = db.session.query(*_KPL_SUM_COLUMNS).filter(
         FuelEntry.motorcycle_id == motorcycle.id
     ).order_by(FuelEntry.total_distance.asc()).all()
 
+    return _sum_kpl_segments(entries, start_date, end_date)
+
+
+# calculate_kpl_sums / calculate_kpl_sums_bulk が必要とする列 (ORMオブジェクトは読み込まない)
+_KPL_SUM_COLUMNS = (
+    FuelEntry.motorcycle_id, FuelEntry.entry_date, FuelEntry.total_distance, FuelEntry.fuel_volume,
+    FuelEntry.is_full_tank, FuelEntry.exclude_from_average, FuelEntry.is_odo_pending
+)
+
+
+def _sum_kpl_segments(entries, start_date=None, end_date=None):
+    """1台分の給油記録 (total_distance 昇順) から、平均燃費の元になる (総走行距離, 総消費燃料) を集計する"""
     total_distance_sum = 0.0
     total_fuel_sum = 0.0
 
@@ -209,6 +207,25 @@ def calculate_kpl_sums(motorcycle: Motorcycle, start_date=None, end_date=None):
     return total_distance_sum, total_fuel_sum
 
 
+def calculate_kpl_sums_bulk(motorcycles, start_date=None, end_date=None):
+    """
+    calculate_kpl_sums の複数車両版。1回のクエリで全車両の給油記録を取得し、
+    { motorcycle_id: (total_distance_sum, total_fuel_sum) } を返す。レーサー車両は (0.0, 0.0)。
+    """
+    sums = {m.id: (0.0, 0.0) for m in motorcycles}
+    public_ids = [m.id for m in motorcycles if not m.is_racer]
+    if not public_ids:
+        return sums
+
+    entries = db.session.query(*_KPL_SUM_COLUMNS).filter(
+        FuelEntry.motorcycle_id.in_(public_ids)
+    ).order_by(FuelEntry.motorcycle_id, FuelEntry.total_distance.asc()).all()
+
+    for motorcycle_id, vehicle_entries in groupby(entries, key=lambda e: e.motorcycle_id):
+        sums[motorcycle_id] = _sum_kpl_segments(list(vehicle_entries), start_date, end_date)
+    return sums
+
+
 def calculate_average_kpl(motorcycle: Motorcycle, start_date=None, end_date=None):
     """車両の平均燃費を計算する（加重平均方式: 総走行距離÷総消費燃料）。
 
@@ -219,7 +236,19 @@ def calculate_average_kpl(motorcycle: Motorcycle, start_date=None, end_date=None
         return None
 
     total_distance_sum, total_fuel_sum = calculate_kpl_sums(motorcycle, start_date, end_date)
+    return _kpl_from_sums(total_distance_sum, total_fuel_sum)
+
+
+def calculate_average_kpl_bulk(motorcycles, start_date=None, end_date=None):
+    """calculate_average_kpl の複数車両版。{ motorcycle_id: 平均燃費 or None } を返す。"""
+    sums = calculate_kpl_sums_bulk(motorcycles, start_date, end_date)
+    return {
+        m.id: None if m.is_racer else _kpl_from_sums(*sums[m.id])
+        for m in motorcycles
+    }
+
 
+def _kpl_from_sums(total_distance_sum, total_fuel_sum):
     if total_fuel_sum > 0 and total_distance_sum > 0:
         try:
             return round(total_distance_sum / total_fuel_sum, 2)
@@ -228,6 +257,24 @@ def calculate_average_kpl(motorcycle: Motorcycle, start_date=None, end_date=None
     return None
 
 
+# --- 一覧表示用の一括読み込み (N+1対策) ---
+
+def preload_fuel_kpl(fuel_entries):
+    """
+    FuelEntry のリストについて区間燃費を一括計算し、各インスタンスに保持させる。
+    渡された記録の距離範囲 (と直前の満タン記録) だけを読み込むため、車両の全履歴は取得しない。
+    読み込み後は FuelEntry.km_per_liter がクエリを発行しなくなる。
+    """
+    if not fuel_entries:
+        return
+    # レーサー車両は燃費計算の対象外
+    target_entries = [entry for entry in fuel_entries if not entry.motorcycle.is_racer]
+    kpl_map = _calculate_kpl_in_window(target_entries)
+
+    for entry in fuel_entries:
+        entry._preloaded_kpl = kpl_map.get(entry.id)
+
+
 # --- ダッシュボード用サービス関数 ---
 
 def get_timeline_events(fuel_motorcycle_ids, maint_motorcycle_ids, start_date=None, end_date=None):
@@ -340,120 +387,79 @@ def get_timeline_events(fuel_motorcycle_ids, maint_motorcycle_ids, start_date=No
 
 def get_upcoming_reminders(user_motorcycles_all, user_id):
     """メンテナンスリマインダーを取得・計算する"""
-    upcoming_reminders = []
-    today = date.today()
-
-    KM_THRESHOLD_WARNING = current_app.config.get('REMINDER_KM_WARNING', 500)
-    DAYS_THRESHOLD_WARNING = current_app.config.get('REMINDER_DAYS_WARNING', 14)
-    KM_THRESHOLD_DANGER = current_app.config.get('REMINDER_KM_DANGER', 0)
-    DAYS_THRESHOLD_DANGER = current_app.config.get('REMINDER_DAYS_DANGER', 0)
-
     # 対象車両のIDリスト（アーカイブ済み車両は呼び出し側で除外済み）
     target_motorcycle_ids = [m.id for m in user_motorcycles_all]
 
-    current_public_distances = {}
-    for m in user_motorcycles_all:
-        if not m.is_racer:
-            current_public_distances[m.id] = get_latest_total_distance(
-                m.id, m.odometer_offset)
-
     # 対象車両がなければ計算するまでもなく空で返す
     if not target_motorcycle_ids:
         return []
 
-    # N+1対策: joinedloadで関連データを一括取得
-    all_reminders = MaintenanceReminder.query.options(
-        db.joinedload(MaintenanceReminder.motorcycle),
-        db.joinedload(MaintenanceReminder.last_maintenance_entry)
-    ).filter(
-        MaintenanceReminder.motorcycle_id.in_(target_motorcycle_ids),
-        MaintenanceReminder.is_dismissed == False,
-        (MaintenanceReminder.snoozed_until == None) | (MaintenanceReminder.snoozed_until <= datetime.now(timezone.utc))
+    # 期限の判定は現在の総走行距離との突き合わせも含めてSQL側で行う
+    thresholds = get_reminder_thresholds()
+    due_rows = db.session.execute(
+        select_due_reminders(
+            km_warning=thresholds['km_warning'],
+            days_warning=thresholds['days_warning']
+        ).where(MaintenanceReminder.motorcycle_id.in_(target_motorcycle_ids))
     ).all()
 
+    upcoming_reminders = [_build_upcoming_reminder(row, thresholds) for row in due_rows]
+    upcoming_reminders.sort(
+        key=lambda x: (x['status'] != 'danger', x['status'] != 'warning'))
+    return upcoming_reminders
 
-    for reminder in all_reminders:
-        motorcycle = reminder.motorcycle
-        status = 'ok'
-        messages = []
-        due_info_parts = []
-        is_due = False
-
-        if not motorcycle.is_racer and reminder.interval_km and reminder.last_done_km is not None:
-            current_km = current_public_distances.get(motorcycle.id, 0)
-            next_km_due = reminder.last_done_km + reminder.interval_km
-            remaining_km = next_km_due - current_km
-            due_info_parts.append(f"{next_km_due:,} km")
-
-            if remaining_km <= KM_THRESHOLD_DANGER:
-                messages.append(f"距離超過 (現在 {current_km:,} km)")
-                status = 'danger'
-                is_due = True
-            elif remaining_km <= KM_THRESHOLD_WARNING:
-                messages.append(f"あと {remaining_km:,} km")
-                status = 'warning'
-                is_due = True
-
-        if reminder.interval_months and reminder.last_done_date:
-            try:
-                next_date_due = reminder.last_done_date + \
-                    relativedelta(months=reminder.interval_months)
-                remaining_days = (next_date_due - today).days
-                due_info_parts.append(f"{next_date_due.strftime('%Y-%m-%d')}")
-                period_status = 'ok'
-                period_message = ''
-                if remaining_days <= DAYS_THRESHOLD_DANGER:
-                    period_status = 'danger'
-                    period_message = f"期限超過"
-                elif remaining_days <= DAYS_THRESHOLD_WARNING:
-                    period_status = 'warning'
-                    period_message = f"あと {remaining_days} 日"
-
-                if period_status != 'ok':
-                    is_due = True
-                    messages.append(period_message)
-                    if (period_status == 'danger') or (period_status == 'warning' and status != 'danger'):
-                        status = period_status
-            except Exception as e:
-                current_app.logger.error(
-                    f"Error calculating date reminder {reminder.id}: {e}")
-                messages.append("日付計算エラー")
+
+def _build_upcoming_reminder(row, thresholds):
+    """select_due_reminders() の1行から、ダッシュボード表示用の辞書を作る"""
+    status = 'ok'
+    messages = []
+    due_info_parts = []
+
+    if row.remaining_km is not None:
+        due_info_parts.append(f"{row.next_due_km:,} km")
+        if row.remaining_km <= thresholds['km_danger']:
+            messages.append(f"距離超過 (現在 {row.current_km:,} km)")
+            status = 'danger'
+        elif row.remaining_km <= thresholds['km_warning']:
+            messages.append(f"あと {row.remaining_km:,} km")
+            status = 'warning'
+
+    if row.remaining_days is not None:
+        due_info_parts.append(f"{row.next_due_date.strftime('%Y-%m-%d')}")
+        if row.remaining_days <= thresholds['days_danger']:
+            messages.append("期限超過")
+            status = 'danger'
+        elif row.remaining_days <= thresholds['days_warning']:
+            messages.append(f"あと {row.remaining_days} 日")
+            if status != 'danger':
                 status = 'warning'
-                is_due = True
 
-        if is_due:
-            last_done_str = "未実施"
-            last_done_odo_val = None
-            
-            # 表示するODO値を決定（連携記録を優先）
-            if reminder.last_maintenance_entry:
-                last_done_odo_val = reminder.last_maintenance_entry.odometer_reading_at_maintenance
-            elif reminder.last_done_odo is not None:
-                last_done_odo_val = reminder.last_done_odo
-
-            # 表示用の文字列を生成
-            if reminder.last_done_date:
-                last_done_str = reminder.last_done_date.strftime('%Y-%m-%d')
-                if not motorcycle.is_racer and last_done_odo_val is not None:
-                    last_done_str += f" ({last_done_odo_val:,} km)"
-            elif not motorcycle.is_racer and last_done_odo_val is not None:
-                last_done_str = f"{last_done_odo_val:,} km"
-
-            upcoming_reminders.append({
-                'reminder_id': reminder.id,
-                'motorcycle_id': motorcycle.id,
-                'motorcycle_name': motorcycle.name,
-                'task': reminder.task_description,
-                'status': status,
-                'message': ", ".join(messages) if messages else "要確認",
-                'due_info': " / ".join(due_info_parts) if due_info_parts else '未設定',
-                'last_done': last_done_str,
-                'is_racer': motorcycle.is_racer
-            })
+    # 表示するODO値を決定（連携記録を優先）
+    if row.linked_entry_id is not None:
+        last_done_odo_val = row.linked_entry_odo
+    else:
+        last_done_odo_val = row.last_done_odo
 
-    upcoming_reminders.sort(
-        key=lambda x: (x['status'] != 'danger', x['status'] != 'warning'))
-    return upcoming_reminders
+    # 表示用の文字列を生成
+    last_done_str = "未実施"
+    if row.last_done_date:
+        last_done_str = row.last_done_date.strftime('%Y-%m-%d')
+        if not row.is_racer and last_done_odo_val is not None:
+            last_done_str += f" ({last_done_odo_val:,} km)"
+    elif not row.is_racer and last_done_odo_val is not None:
+        last_done_str = f"{last_done_odo_val:,} km"
+
+    return {
+        'reminder_id': row.reminder_id,
+        'motorcycle_id': row.motorcycle_id,
+        'motorcycle_name': row.motorcycle_name,
+        'task': row.task_description,
+        'status': status,
+        'message': ", ".join(messages) if messages else "要確認",
+        'due_info': " / ".join(due_info_parts) if due_info_parts else '未設定',
+        'last_done': last_done_str,
+        'is_racer': row.is_racer
+    }
 
 
 def get_recent_logs(model, vehicle_ids, order_by_cols, selected_vehicle_id=None, start_date=None, end_date=None, extra_filters=None, limit=5):
@@ -600,61 +606,14 @@ def get_dashboard_stats(user_motorcycles_all, user_motorcycle_ids_public, target
 
 def get_latest_log_info_for_vehicles(motorcycles):
     """
-    複数の車両について、給油記録または整備記録から最新のログ情報を1クエリで取得する。
+    複数の車両について、給油記録または整備記録から最新のログ情報を返す。
+    値は記録の書き込み時に更新される Motorcycle の保持列 (current_odometer / latest_log_date) から取り出す。
     """
-    if not motorcycles:
-        return {}
-
-    motorcycle_ids = [m.id for m in motorcycles]
-
-    # 給油記録から必要な情報を選択 (ODO保留中のレコードは除外)
-    fuel_q = db.session.query(
-        FuelEntry.motorcycle_id.label('motorcycle_id'),
-        FuelEntry.odometer_reading.label('odo'),
-        FuelEntry.entry_date.label('log_date')
-    ).filter(
-        FuelEntry.motorcycle_id.in_(motorcycle_ids),
-        FuelEntry.is_odo_pending == False
-    )
-
-    # 整備記録から必要な情報を選択 (ODO保留中のレコードは除外)
-    maint_q = db.session.query(
-        MaintenanceEntry.motorcycle_id.label('motorcycle_id'),
-        MaintenanceEntry.odometer_reading_at_maintenance.label('odo'),
-        MaintenanceEntry.maintenance_date.label('log_date')
-    ).filter(
-        MaintenanceEntry.motorcycle_id.in_(motorcycle_ids),
-        MaintenanceEntry.is_odo_pending == False
-    )
-
-    # 2つのクエリをUNIONで結合
-    combined_q = union_all(fuel_q, maint_q).subquery()
-
-    # ウィンドウ関数を使い、車両ごとに日付で降順にランク付け
-    ranked_q = db.session.query(
-        combined_q.c.motorcycle_id,
-        combined_q.c.odo,
-        combined_q.c.log_date,
-        func.row_number().over(
-            partition_by=combined_q.c.motorcycle_id,
-            order_by=combined_q.c.log_date.desc()
-        ).label('rn')
-    ).subquery()
-
-    # ランクが1のもの（＝最新の記録）のみを抽出
-    latest_logs = db.session.query(
-        ranked_q.c.motorcycle_id,
-        ranked_q.c.odo,
-        ranked_q.c.log_date
-    ).filter(ranked_q.c.rn == 1).all()
-
-    # 結果を使いやすい辞書形式に変換
-    result_dict = {
-        log.motorcycle_id: {'odo': log.odo, 'date': log.log_date}
-        for log in latest_logs
+    return {
+        m.id: {'odo': m.current_odometer, 'date': m.latest_log_date}
+        for m in motorcycles
+        if m.latest_log_date is not None and m.current_odometer is not None
     }
-    
-    return result_dict
 
 
 def get_circuit_activity_for_dashboard(user_id):
@@ -765,190 +724,194 @@ def get_circuit_activity_for_dashboard(user_id):
     }
 
 
-def get_holidays_json():
-    """祝日情報を取得し、JSON文字列として返す"""
-    try:
-        today_for_holiday = date.today()
-        # カレンダー表示のパフォーマンスのため、前後1年分の祝日を取得
-        years_to_fetch = [today_for_holiday.year - 1, today_for_holiday.year, today_for_holiday.year + 1]
-        holidays_dict = {}
-        for year in years_to_fetch:
-            try:
-                holidays_raw = jpholiday.year_holidays(year)
-                for holiday_date_obj, holiday_name in holidays_raw:
-                    holidays_dict[holiday_date_obj.strftime('%Y-%m-%d')] = holiday_name
-            except Exception as e:
-                current_app.logger.error(f"Error fetching holidays for year {year}: {e}")
-        return json.dumps(holidays_dict)
-    except Exception as e:
-        current_app.logger.error(f"Error processing holidays data: {e}")
-        return '{}' # エラーが発生した場合は空のJSONを返す
+# カレンダーAPIが一度に返す期間の上限 (月表示の6週間 + 余裕)
+CALENDAR_MAX_WINDOW_DAYS = 62
+CALENDAR_EVENT_TYPES = ('fuel', 'maintenance', 'activity', 'note')
 
+# URLテンプレート生成用のダミーID (url_for の int コンバータを通すため数値にする)
+_URL_TEMPLATE_SENTINEL_ID = 987654321
 
-def get_calendar_events_for_user(user, start_date=None, end_date=None):
-    """指定されたユーザーのカレンダーイベントを取得・整形して返す。
-    start_date/end_dateが指定された場合はその期間に絞り込む。"""
-    events = []
-    user_id = user.id
-    
-    # 全車両IDを取得
-    user_motorcycles_all = Motorcycle.query.filter_by(user_id=user_id).all()
-    user_motorcycle_ids_all = [m.id for m in user_motorcycles_all]
-    
-    # 公道車のみのIDリスト
-    user_motorcycle_ids_public = [m.id for m in user_motorcycles_all if not m.is_racer]
-
-
-    # 給油記録 (公道車のみ)
-    if user_motorcycle_ids_public:
-        fuel_query = FuelEntry.query.options(db.joinedload(FuelEntry.motorcycle)).filter(
-            FuelEntry.motorcycle_id.in_(user_motorcycle_ids_public))
-        if start_date:
-            fuel_query = fuel_query.filter(FuelEntry.entry_date >= start_date)
-        if end_date:
-            fuel_query = fuel_query.filter(FuelEntry.entry_date <= end_date)
-        fuel_entries = fuel_query.all()
-
-        # 燃費計算用のIDリスト
-        fuel_entry_ids = [e.id for e in fuel_entries]
-        all_fuel_entries_for_calc = db.session.query(
-            FuelEntry.id, FuelEntry.motorcycle_id, FuelEntry.total_distance, 
-            FuelEntry.fuel_volume, FuelEntry.is_full_tank, FuelEntry.exclude_from_average
-        ).filter(
-            FuelEntry.motorcycle_id.in_(user_motorcycle_ids_public)
-        ).order_by(FuelEntry.motorcycle_id, FuelEntry.total_distance).all()
-        
-        kpl_map = calculate_kpl_bulk(all_fuel_entries_for_calc)
-            
-        for entry in fuel_entries:
-            # プロパティアクセスを回避
-            kpl = kpl_map.get(entry.id)
-            kpl_display = f"{kpl:.2f} km/L" if kpl is not None else None
-            
-            edit_url = url_for('fuel.edit_fuel', entry_id=entry.id)
-            events.append({
-                'id': f'fuel-{entry.id}', 'title': f"⛽ 給油: {entry.motorcycle.name}",
-                'start': entry.entry_date.isoformat(), 'allDay': True, 'url': edit_url,
-                'backgroundColor': '#198754', 'borderColor': '#198754', 'textColor': 'white',
-                'extendedProps': {
-                    'type': 'fuel', 'motorcycleName': entry.motorcycle.name,
-                    'odometer': entry.odometer_reading, 'fuelVolume': entry.fuel_volume, 'kmPerLiter': kpl_display,
-                    'totalCost': math.ceil(entry.total_cost) if entry.total_cost is not None else None,
-                    'stationName': entry.station_name, 'notes': entry.notes, 'editUrl': edit_url
-                }
-            })
 
+def _calendar_url_templates():
+    """クライアント側で {id} を置換して編集URLを組み立てるためのテンプレート"""
+    sentinel = str(_URL_TEMPLATE_SENTINEL_ID)
+    return {
+        'fuel': url_for('fuel.edit_fuel', entry_id=_URL_TEMPLATE_SENTINEL_ID).replace(sentinel, '{id}'),
+        'maintenance': url_for('maintenance.edit_maintenance', entry_id=_URL_TEMPLATE_SENTINEL_ID).replace(sentinel, '{id}'),
+        'activity': url_for('activity.detail_activity', activity_id=_URL_TEMPLATE_SENTINEL_ID).replace(sentinel, '{id}'),
+        'note': url_for('notes.edit_note', note_id=_URL_TEMPLATE_SENTINEL_ID).replace(sentinel, '{id}'),
+    }
 
-    # 整備記録 (全車両対象: レーサーの整備記録も含める)
-    if user_motorcycle_ids_all:
-        maint_query = MaintenanceEntry.query.options(db.joinedload(MaintenanceEntry.motorcycle)).filter(
-            MaintenanceEntry.motorcycle_id.in_(user_motorcycle_ids_all),
-            MaintenanceEntry.category != '初期設定'
-        )
-        if start_date:
-            maint_query = maint_query.filter(MaintenanceEntry.maintenance_date >= start_date)
-        if end_date:
-            maint_query = maint_query.filter(MaintenanceEntry.maintenance_date <= end_date)
-        maintenance_entries = maint_query.all()
-        for entry in maintenance_entries:
-            event_title_base = entry.category if entry.category else entry.description
-            event_title = f"🔧 整備: {event_title_base[:15]}" + ("..." if len(event_title_base) > 15 else "")
-            total_cost = entry.total_cost
-            edit_url = url_for('maintenance.edit_maintenance', entry_id=entry.id)
-            # レーサーは稼働時間(H)、公道車は総走行距離(km)を表示する
-            # operating_hours_at_maintenance は Decimal のため jsonify 用に float へ変換する
-            is_racer = bool(entry.motorcycle.is_racer)
-            if is_racer:
-                odo_value = float(entry.operating_hours_at_maintenance) if entry.operating_hours_at_maintenance is not None else None
-            else:
-                odo_value = entry.total_distance_at_maintenance
-            events.append({
-                'id': f'maint-{entry.id}', 'title': event_title,
-                'start': entry.maintenance_date.isoformat(), 'allDay': True, 'url': edit_url,
-                'backgroundColor': '#ffc107', 'borderColor': '#ffc107', 'textColor': 'black',
-                'extendedProps': {
-                    'type': 'maintenance', 'motorcycleName': entry.motorcycle.name,
-                    'isRacer': is_racer,
-                    'odometer': odo_value, 'odometerUnit': 'H' if is_racer else 'km',
-                    'description': entry.description, 'category': entry.category,
-                    'totalCost': math.ceil(total_cost) if total_cost is not None else None,
-                    'location': entry.location, 'notes': entry.notes, 'editUrl': edit_url
-                }
-            })
 
-    # 活動ログ (全車両対象)
-    if user_motorcycle_ids_all:
-        act_query = ActivityLog.query.options(db.joinedload(ActivityLog.motorcycle)).filter(
-            ActivityLog.motorcycle_id.in_(user_motorcycle_ids_all))
-        if start_date:
-            act_query = act_query.filter(ActivityLog.activity_date >= start_date)
-        if end_date:
-            act_query = act_query.filter(ActivityLog.activity_date <= end_date)
-        activity_logs = act_query.all()
-        for entry in activity_logs:
-            location_display = entry.activity_title or entry.location_name or '活動'
-            event_title = f"🏁 {location_display[:15]}" + ("..." if len(location_display) > 15 else "")
-            edit_url = url_for('activity.detail_activity', activity_id=entry.id)
-            
-            location_details = []
-            if entry.circuit_name:
-                location_details.append(entry.circuit_name)
-            if entry.custom_location:
-                location_details.append(entry.custom_location)
-            location_full_display = ", ".join(location_details) or entry.location_name or '未設定'
-
-            events.append({
-                'id': f'activity-{entry.id}', 'title': event_title,
-                'start': entry.activity_date.isoformat(), 'allDay': True, 'url': edit_url,
-                'backgroundColor': '#0dcaf0', 'borderColor': '#0dcaf0', 'textColor': 'black',
-                'extendedProps': {
-                    'type': 'activity',
-                    'motorcycleName': entry.motorcycle.name,
-                    'isRacer': entry.motorcycle.is_racer,
-                    'activityTitle': entry.activity_title or '活動ログ',
-                    'location': location_full_display,
-                    'weather': entry.weather,
-                    'temperature': f"{entry.temperature}°C" if entry.temperature is not None else None,
-                    'notes': entry.notes,
-                    'editUrl': edit_url
-                }
-            })
+def _calculate_kpl_in_window(fuel_rows):
+    """
+    期間内の給油記録の区間燃費だけを計算する。
+    車両ごとに、期間内最初の記録より手前にある直近の満タン記録 (区間の起点) まで遡って
+    燃費計算用の行を取得するため、全履歴を読み込まずに calculate_kpl_bulk と同じ結果になる。
+    """
+    distance_bounds = {}  # motorcycle_id -> (期間内の最小距離, 最大距離)
+    for row in fuel_rows:
+        if row.is_odo_pending:
+            # ODO保留中の記録は燃費を出さないので、計算範囲の決定にも使わない
+            continue
+        low, high = distance_bounds.get(row.motorcycle_id, (row.total_distance, row.total_distance))
+        distance_bounds[row.motorcycle_id] = (min(low, row.total_distance), max(high, row.total_distance))
 
-    # 一般ノート・タスク (全車両対象)
-    note_query = GeneralNote.query.options(
-        db.joinedload(GeneralNote.motorcycle)).filter_by(user_id=user_id)
-    if start_date:
-        note_query = note_query.filter(GeneralNote.note_date >= start_date)
-    if end_date:
-        note_query = note_query.filter(GeneralNote.note_date <= end_date)
-    general_notes = note_query.all()
-    for note in general_notes:
-        motorcycle_name = note.motorcycle.name if note.motorcycle else None
-        note_title_display = note.title or ('タスク' if note.category == 'task' else 'メモ')
-        icon = "✅" if note.category == 'task' else "📝"
-        title_prefix = f"{icon} {'タスク' if note.category == 'task' else 'メモ'}: "
-        event_type = note.category
-        event_title = title_prefix + note_title_display[:15] + ("..." if len(note_title_display) > 15 else "")
-        edit_url = url_for('notes.edit_note', note_id=note.id)
-        extended_props = {
-            'type': event_type, 'category': note.category, 'title': note.title, 'motorcycleName': motorcycle_name,
-            'noteDate': note.note_date.strftime('%Y-%m-%d'),
-            'createdAt': note.created_at.strftime('%Y-%m-%d %H:%M'),
-            'updatedAt': note.updated_at.strftime('%Y-%m-%d %H:%M'), 'editUrl': edit_url,
-            'isRacer': note.motorcycle.is_racer if note.motorcycle else False
-        }
-        if event_type == 'task':
-            extended_props['todos'] = note.todos if note.todos is not None else []
-        else:
-            extended_props['content'] = note.content
-        events.append({
-            'id': f'note-{note.id}', 'title': event_title,
-            'start': note.note_date.isoformat(), 'allDay': True, 'url': edit_url,
-            'backgroundColor': '#6c757d', 'borderColor': '#6c757d', 'textColor': 'white',
-            'extendedProps': extended_props
-        })
+    # 各車両の区間起点 (期間内最小距離より手前の直近の満タン記録)
+    if not distance_bounds:
+        return {}
 
-    return events
+    anchor_rows = db.session.query(
+        FuelEntry.motorcycle_id, func.max(FuelEntry.total_distance)
+    ).filter(
+        db.or_(*[
+            and_(FuelEntry.motorcycle_id == motorcycle_id, FuelEntry.total_distance < low)
+            for motorcycle_id, (low, _high) in distance_bounds.items()
+        ]),
+        FuelEntry.is_full_tank == True,
+        FuelEntry.is_odo_pending == False,
+    ).group_by(FuelEntry.motorcycle_id).all()
+    anchors = dict(anchor_rows)
+
+    calc_rows = db.session.query(
+        FuelEntry.id, FuelEntry.motorcycle_id, FuelEntry.total_distance,
+        FuelEntry.fuel_volume, FuelEntry.is_full_tank, FuelEntry.exclude_from_average, FuelEntry.is_odo_pending
+    ).filter(
+        db.or_(*[
+            and_(
+                FuelEntry.motorcycle_id == motorcycle_id,
+                FuelEntry.total_distance >= anchors.get(motorcycle_id, low),
+                FuelEntry.total_distance <= high,
+            )
+            for motorcycle_id, (low, high) in distance_bounds.items()
+        ])
+    ).order_by(FuelEntry.motorcycle_id, FuelEntry.total_distance).all()
+
+    return calculate_kpl_bulk(calc_rows)
+
+
+def get_calendar_payload_for_user(user, start_date, end_date, types=CALENDAR_EVENT_TYPES):
+    """
+    ダッシュボードのカレンダーに表示する記録を、表示中の期間 [start_date, end_date) に限って返す。
+    必要なカラムだけを取得し、車両名・編集URL・表示色などの重複する情報は送らない
+    (クライアント側で motorcycles と urls から組み立てる)。
+    """
+    payload = {
+        'start': start_date.isoformat(),
+        'end': end_date.isoformat(),
+        'urls': _calendar_url_templates(),
+        'motorcycles': {},
+    }
+
+    motorcycle_rows = db.session.query(
+        Motorcycle.id, Motorcycle.name, Motorcycle.is_racer
+    ).filter(Motorcycle.user_id == user.id).all()
+    motorcycle_ids_all = [m.id for m in motorcycle_rows]
+    # 給油記録は公道車のみ
+    motorcycle_ids_public = [m.id for m in motorcycle_rows if not m.is_racer]
+    used_motorcycle_ids = set()
+
+    if 'fuel' in types:
+        fuel_rows = []
+        if motorcycle_ids_public:
+            fuel_rows = db.session.query(
+                FuelEntry.id, FuelEntry.motorcycle_id, FuelEntry.entry_date, FuelEntry.odometer_reading,
+                FuelEntry.total_distance, FuelEntry.fuel_volume, FuelEntry.total_cost,
+                FuelEntry.station_name, FuelEntry.notes, FuelEntry.is_odo_pending
+            ).filter(
+                FuelEntry.motorcycle_id.in_(motorcycle_ids_public),
+                FuelEntry.entry_date >= start_date,
+                FuelEntry.entry_date < end_date,
+            ).all()
+        kpl_map = _calculate_kpl_in_window(fuel_rows)
+        payload['fuel'] = [{
+            'id': row.id, 'date': row.entry_date.isoformat(), 'm': row.motorcycle_id,
+            'odo': row.odometer_reading, 'vol': row.fuel_volume, 'kpl': kpl_map.get(row.id),
+            'cost': math.ceil(row.total_cost) if row.total_cost is not None else None,
+            'station': row.station_name, 'notes': row.notes,
+        } for row in fuel_rows]
+        used_motorcycle_ids.update(row.motorcycle_id for row in fuel_rows)
+
+    if 'maintenance' in types:
+        maint_rows = []
+        if motorcycle_ids_all:
+            # レーサーの整備記録も含める
+            maint_rows = db.session.query(
+                MaintenanceEntry.id, MaintenanceEntry.motorcycle_id, MaintenanceEntry.maintenance_date,
+                MaintenanceEntry.total_distance_at_maintenance, MaintenanceEntry.operating_hours_at_maintenance,
+                MaintenanceEntry.description, MaintenanceEntry.category, MaintenanceEntry.location,
+                MaintenanceEntry.notes,
+                (func.coalesce(MaintenanceEntry.parts_cost, 0) + func.coalesce(MaintenanceEntry.labor_cost, 0)).label('total_cost'),
+            ).filter(
+                MaintenanceEntry.motorcycle_id.in_(motorcycle_ids_all),
+                MaintenanceEntry.category != '初期設定',
+                MaintenanceEntry.maintenance_date >= start_date,
+                MaintenanceEntry.maintenance_date < end_date,
+            ).all()
+        racer_ids = {m.id for m in motorcycle_rows if m.is_racer}
+        payload['maintenance'] = [{
+            'id': row.id, 'date': row.maintenance_date.isoformat(), 'm': row.motorcycle_id,
+            # レーサーは稼働時間(H)、公道車は総走行距離(km)
+            'odo': (float(row.operating_hours_at_maintenance) if row.operating_hours_at_maintenance is not None else None)
+                   if row.motorcycle_id in racer_ids else row.total_distance_at_maintenance,
+            'desc': row.description, 'cat': row.category, 'loc': row.location, 'notes': row.notes,
+            'cost': math.ceil(row.total_cost) if row.total_cost is not None else None,
+        } for row in maint_rows]
+        used_motorcycle_ids.update(row.motorcycle_id for row in maint_rows)
+
+    if 'activity' in types:
+        activity_rows = []
+        if motorcycle_ids_all:
+            activity_rows = db.session.query(
+                ActivityLog.id, ActivityLog.motorcycle_id, ActivityLog.activity_date, ActivityLog.activity_title,
+                ActivityLog.location_name, ActivityLog.circuit_name, ActivityLog.custom_location,
+                ActivityLog.weather, ActivityLog.temperature, ActivityLog.notes
+            ).filter(
+                ActivityLog.motorcycle_id.in_(motorcycle_ids_all),
+                ActivityLog.activity_date >= start_date,
+                ActivityLog.activity_date < end_date,
+            ).all()
+        payload['activity'] = [{
+            'id': row.id, 'date': row.activity_date.isoformat(), 'm': row.motorcycle_id,
+            'title': row.activity_title, 'place': row.location_name,
+            'loc': ", ".join(filter(None, [row.circuit_name, row.custom_location])) or row.location_name,
+            'weather': row.weather,
+            'temp': float(row.temperature) if row.temperature is not None else None,
+            'notes': row.notes,
+        } for row in activity_rows]
+        used_motorcycle_ids.update(row.motorcycle_id for row in activity_rows)
+
+    if 'note' in types:
+        note_rows = db.session.query(
+            GeneralNote.id, GeneralNote.motorcycle_id, GeneralNote.note_date, GeneralNote.category,
+            GeneralNote.title, GeneralNote.content, GeneralNote.todos, GeneralNote.created_at, GeneralNote.updated_at
+        ).filter(
+            GeneralNote.user_id == user.id,
+            GeneralNote.note_date >= start_date,
+            GeneralNote.note_date < end_date,
+        ).all()
+        notes_payload = []
+        for row in note_rows:
+            item = {
+                'id': row.id, 'date': row.note_date.isoformat(), 'm': row.motorcycle_id,
+                'cat': row.category, 'title': row.title,
+                'created': row.created_at.strftime('%Y-%m-%d %H:%M'),
+                'updated': row.updated_at.strftime('%Y-%m-%d %H:%M'),
+            }
+            if row.category == 'task':
+                item['todos'] = row.todos if row.todos is not None else []
+            else:
+                item['content'] = row.content
+            notes_payload.append(item)
+        payload['note'] = notes_payload
+        used_motorcycle_ids.update(row.motorcycle_id for row in note_rows if row.motorcycle_id)
+
+    # 期間内の記録で参照される車両だけを送る
+    payload['motorcycles'] = {
+        m.id: {'name': m.name, 'racer': bool(m.is_racer)}
+        for m in motorcycle_rows if m.id in used_motorcycle_ids
+    }
+    return payload
 
 # --- 暗号化サービス ---
 
@@ -1001,34 +964,41 @@ def get_user_garage_data(user: User) -> dict:
     
     other_vehicles = [v for v in vehicles_in_garage if v != hero_vehicle]
 
+    # 掲載車両の統計に必要な値は、台数に関係なく固定回数のクエリでまとめて取得する
+    vehicle_ids = [v.id for v in vehicles_in_garage]
+    avg_kpl_map = calculate_average_kpl_bulk(vehicles_in_garage)
+    maint_cost_map = dict(db.session.query(
+        MaintenanceEntry.motorcycle_id,
+        func.sum(func.coalesce(MaintenanceEntry.parts_cost, 0) + func.coalesce(MaintenanceEntry.labor_cost, 0))
+    ).filter(
+        MaintenanceEntry.motorcycle_id.in_(vehicle_ids)
+    ).group_by(MaintenanceEntry.motorcycle_id).all()) if vehicle_ids else {}
+    activity_count_map = dict(db.session.query(
+        ActivityLog.motorcycle_id, func.count(ActivityLog.id)
+    ).filter(
+        ActivityLog.motorcycle_id.in_(vehicle_ids)
+    ).group_by(ActivityLog.motorcycle_id).all()) if vehicle_ids else {}
+
     # ▼▼▼ 車両の統計情報を計算するヘルパー関数 ▼▼▼
     def _calc_vehicle_stats(vehicle):
-        """1台分の車両統計情報を計算して辞書で返す"""
+        """1台分の車両統計情報を、まとめて取得した値から辞書で返す"""
         stats = {}
         if vehicle.is_racer:
             stats['primary_metric_label'] = '総稼働時間'
             stats['primary_metric_value'] = f"{vehicle.display_operating_hours or 0:.2f}"
             stats['primary_metric_unit'] = '時間'
         else:
-            total_mileage = get_latest_total_distance(vehicle.id, vehicle.odometer_offset)
-            avg_kpl = calculate_average_kpl(vehicle)
+            total_mileage = vehicle.get_display_total_mileage()
+            avg_kpl = avg_kpl_map.get(vehicle.id)
             stats['primary_metric_label'] = '総走行距離'
             stats['primary_metric_value'] = f"{total_mileage:,}"
             stats['primary_metric_unit'] = 'km'
             stats['avg_kpl'] = f"{avg_kpl:.2f} km/L" if avg_kpl else "---"
 
-        total_maint_cost = db.session.query(
-            func.sum(func.coalesce(MaintenanceEntry.parts_cost, 0) + func.coalesce(MaintenanceEntry.labor_cost, 0))
-        ).filter(
-            MaintenanceEntry.motorcycle_id == vehicle.id
-        ).scalar() or 0
+        total_maint_cost = maint_cost_map.get(vehicle.id) or 0
         stats['total_maint_cost'] = f"{total_maint_cost:,.0f} 円"
 
-        total_activities = db.session.query(
-            func.count(ActivityLog.id)
-        ).filter(
-            ActivityLog.motorcycle_id == vehicle.id
-        ).scalar() or 0
+        total_activities = activity_count_map.get(vehicle.id) or 0
         stats['total_activities'] = f"{total_activities} 回"
         return stats
     # ▲▲▲ ヘルパー関数ここまで ▲▲▲
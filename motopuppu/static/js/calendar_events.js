@@ -0,0 +1,123 @@
+// motopuppu/static/js/calendar_events.js
+// ダッシュボードのカレンダー用。/api/dashboard/events の軽量なレスポンスを FullCalendar のイベント形式に組み立てる。
+
+(function () {
+    const COLORS = {
+        fuel: { bg: '#198754', text: 'white' },
+        maintenance: { bg: '#ffc107', text: 'black' },
+        activity: { bg: '#0dcaf0', text: 'black' },
+        note: { bg: '#6c757d', text: 'white' },
+    };
+
+    const truncate = (text, length) => text.length > length ? text.slice(0, length) + '...' : text;
+
+    const buildUrl = (template, id) => template ? template.replace('{id}', id) : null;
+
+    const baseEvent = (type, item, title, url) => ({
+        id: `${type === 'maintenance' ? 'maint' : type}-${item.id}`,
+        title: title,
+        start: item.date,
+        allDay: true,
+        url: url,
+        backgroundColor: COLORS[type].bg,
+        borderColor: COLORS[type].bg,
+        textColor: COLORS[type].text,
+    });
+
+    function expandPayload(payload) {
+        const urls = payload.urls || {};
+        const motorcycles = payload.motorcycles || {};
+        const motorcycleOf = (id) => (id != null && motorcycles[id]) || null;
+        const events = [];
+
+        (payload.fuel || []).forEach(item => {
+            const motorcycle = motorcycleOf(item.m);
+            const editUrl = buildUrl(urls.fuel, item.id);
+            const event = baseEvent('fuel', item, `⛽ 給油: ${motorcycle ? motorcycle.name : ''}`, editUrl);
+            event.extendedProps = {
+                type: 'fuel', motorcycleName: motorcycle ? motorcycle.name : null,
+                odometer: item.odo, fuelVolume: item.vol,
+                kmPerLiter: item.kpl != null ? `${item.kpl.toFixed(2)} km/L` : null,
+                totalCost: item.cost, stationName: item.station, notes: item.notes, editUrl: editUrl,
+            };
+            events.push(event);
+        });
+
+        (payload.maintenance || []).forEach(item => {
+            const motorcycle = motorcycleOf(item.m);
+            const isRacer = !!(motorcycle && motorcycle.racer);
+            const editUrl = buildUrl(urls.maintenance, item.id);
+            const titleBase = item.cat || item.desc || '';
+            const event = baseEvent('maintenance', item, `🔧 整備: ${truncate(titleBase, 15)}`, editUrl);
+            event.extendedProps = {
+                type: 'maintenance', motorcycleName: motorcycle ? motorcycle.name : null, isRacer: isRacer,
+                odometer: item.odo, odometerUnit: isRacer ? 'H' : 'km',
+                description: item.desc, category: item.cat, totalCost: item.cost,
+                location: item.loc, notes: item.notes, editUrl: editUrl,
+            };
+            events.push(event);
+        });
+
+        (payload.activity || []).forEach(item => {
+            const motorcycle = motorcycleOf(item.m);
+            const editUrl = buildUrl(urls.activity, item.id);
+            const locationDisplay = item.title || item.place || '活動';
+            const event = baseEvent('activity', item, `🏁 ${truncate(locationDisplay, 15)}`, editUrl);
+            event.extendedProps = {
+                type: 'activity', motorcycleName: motorcycle ? motorcycle.name : null,
+                isRacer: !!(motorcycle && motorcycle.racer),
+                activityTitle: item.title || '活動ログ', location: item.loc || '未設定',
+                weather: item.weather, temperature: item.temp != null ? `${item.temp}°C` : null,
+                notes: item.notes, editUrl: editUrl,
+            };
+            events.push(event);
+        });
+
+        (payload.note || []).forEach(item => {
+            const motorcycle = motorcycleOf(item.m);
+            const isTask = item.cat === 'task';
+            const editUrl = buildUrl(urls.note, item.id);
+            const titleDisplay = item.title || (isTask ? 'タスク' : 'メモ');
+            const prefix = `${isTask ? '✅' : '📝'} ${isTask ? 'タスク' : 'メモ'}: `;
+            const event = baseEvent('note', item, prefix + truncate(titleDisplay, 15), editUrl);
+            event.extendedProps = {
+                type: item.cat, category: item.cat, title: item.title,
+                motorcycleName: motorcycle ? motorcycle.name : null,
+                noteDate: item.date, createdAt: item.created, updatedAt: item.updated, editUrl: editUrl,
+                isRacer: !!(motorcycle && motorcycle.racer),
+            };
+            if (isTask) {
+                event.extendedProps.todos = item.todos || [];
+            } else {
+                event.extendedProps.content = item.content;
+            }
+            events.push(event);
+        });
+
+        return events;
+    }
+
+    // FullCalendar の events に渡す関数を返す。表示中の期間だけを取得する
+    function createEventSource(apiUrl) {
+        let currentController = null;
+        return function (fetchInfo, successCallback, failureCallback) {
+            // 月送りを連打した場合、古い期間のリクエストは捨てる
+            if (currentController) currentController.abort();
+            currentController = new AbortController();
+            const params = new URLSearchParams({ start: fetchInfo.startStr.slice(0, 10), end: fetchInfo.endStr.slice(0, 10) });
+            fetch(`${apiUrl}?${params.toString()}`, { signal: currentController.signal, credentials: 'same-origin' })
+                .then(response => {
+                    if (!response.ok) throw new Error('HTTP ' + response.status);
+                    return response.json();
+                })
+                .then(payload => successCallback(expandPayload(payload)))
+                .catch(error => {
+                    if (error.name === 'AbortError') return;
+                    console.error('カレンダーの予定を取得できませんでした:', error);
+                    failureCallback(error);
+                });
+        };
+    }
+
+    window.motopuppuCalendar = { expandPayload: expandPayload, createEventSource: createEventSource };
+})();
@@ -12,24 +12,93 @@ document.addEventListener('DOMContentLoaded', () => {
 
     let debounceTimer;
     let currentRequestController = null;
+    let lastRenderedQuery = null;
+
+    // 検索結果のクライアント側キャッシュ (正規化したクエリ -> {data, expiresAt})
+    const RESULT_CACHE_TTL_MS = 30 * 1000;
+    const RESULT_CACHE_MAX_ENTRIES = 50;
+    const resultCache = new Map();
+
+    // サーバー側 (normalize_search_query) と同じ正規化
+    const normalizeQuery = (value) => value.trim().split(/\s+/).join(' ').toLowerCase();
+
+    const getCachedData = (query) => {
+        const cached = resultCache.get(query);
+        if (!cached) {
+            return null;
+        }
+        if (Date.now() >= cached.expiresAt) {
+            resultCache.delete(query);
+            return null;
+        }
+        return cached.data;
+    };
+
+    const setCachedData = (query, data) => {
+        resultCache.delete(query);
+        resultCache.set(query, { data, expiresAt: Date.now() + RESULT_CACHE_TTL_MS });
+        if (resultCache.size > RESULT_CACHE_MAX_ENTRIES) {
+            resultCache.delete(resultCache.keys().next().value);
+        }
+    };
+
+    // 入力途中のクエリで結果が0件だった場合、それで始まる長いクエリも0件なのでサーバーに問い合わせない
+    const hasEmptyPrefixResult = (query) => {
+        for (let length = query.length - 1; length > 0; length--) {
+            const data = getCachedData(query.slice(0, length));
+            if (data) {
+                return data.prefix_reusable && data.results.length === 0;
+            }
+        }
+        return false;
+    };
+
+    const cancelPendingRequest = () => {
+        if (currentRequestController) {
+            currentRequestController.abort();
+            currentRequestController = null;
+        }
+    };
 
     // --- メインの検索処理 ---
     const handleSearch = () => {
-        const query = searchInput.value.trim();
+        const query = normalizeQuery(searchInput.value);
 
         if (query.length < 1) {
+            cancelPendingRequest();
+            lastRenderedQuery = null;
             hideResults();
             return;
         }
 
-        // 既存のリクエストがあればキャンセル
-        if (currentRequestController) {
-            currentRequestController.abort();
+        // 表示中の結果と同じクエリなら再描画だけで済ませる
+        if (query === lastRenderedQuery) {
+            cancelPendingRequest();
+            showResults();
+            return;
         }
-        currentRequestController = new AbortController();
-        const signal = currentRequestController.signal;
 
-        fetch(`${window.location.origin}/search/?q=${encodeURIComponent(query)}`, { signal })
+        const cachedData = getCachedData(query);
+        if (cachedData) {
+            cancelPendingRequest();
+            lastRenderedQuery = query;
+            renderResults(cachedData.results);
+            return;
+        }
+
+        if (hasEmptyPrefixResult(query)) {
+            cancelPendingRequest();
+            lastRenderedQuery = query;
+            renderResults([]);
+            return;
+        }
+
+        // 既存のリクエストがあればキャンセル
+        cancelPendingRequest();
+        const controller = new AbortController();
+        currentRequestController = controller;
+
+        fetch(`${window.location.origin}/search/?q=${encodeURIComponent(query)}`, { signal: controller.signal })
             .then(response => {
                 if (!response.ok) {
                     throw new Error('Network response was not ok');
@@ -37,6 +106,11 @@ document.addEventListener('DOMContentLoaded', () => {
                 return response.json();
             })
             .then(data => {
+                setCachedData(query, data);
+                if (currentRequestController === controller) {
+                    currentRequestController = null;
+                }
+                lastRenderedQuery = query;
                 renderResults(data.results);
             })
             .catch(error => {
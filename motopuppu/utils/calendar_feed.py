@@ -0,0 +1,285 @@
+# motopuppu/utils/calendar_feed.py
+"""
+ユーザーごとの購読用カレンダー (ICS) フィードを生成する。
+
+カレンダーアプリは15分程度の間隔でフィードを取得し続けるため、
+1. まず軽量な集計クエリで内容の「指紋」を取り、ETag として返す (変化が無ければ 304 で終わる)
+2. 変化があった場合も、指紋が変わったセクション (イベント / リマインダー / 走行枠) だけを作り直す
+という2段構えでフィード生成のコストを抑える。
+"""
+import hashlib
+import threading
+from collections import OrderedDict
+from datetime import datetime, time, timedelta, timezone
+
+from flask import url_for
+from sqlalchemy import func, or_
+
+from ..models import (
+    db, Event, EventParticipant, MaintenanceReminder, Motorcycle, ParticipationStatus, TrackSchedule,
+    UserCircuitTarget
+)
+from .datetime_helpers import JST
+from .reminder_due import get_reminder_thresholds, select_due_reminders
+
+try:
+    from icalendar import Calendar, Event as ICalEvent
+    ICALENDAR_AVAILABLE = True
+except ImportError:
+    ICALENDAR_AVAILABLE = False
+
+# フィードに含める期間
+FEED_EVENT_DAYS_BEFORE = 90       # 過去のイベントは90日前まで
+FEED_REMINDER_DAYS_AHEAD = 180    # 期限が180日以内のリマインダー
+FEED_SCHEDULE_DAYS_AHEAD = 60     # 目標サーキットの走行枠は60日先まで
+
+# --- フィードのキャッシュ ---
+# gunicornのワーカー毎に独立する。指紋が一致する間はそのまま使い回す。
+FEED_CACHE_MAX_USERS = 2000
+_feed_cache = OrderedDict()  # user_id -> {'etag', 'payload', 'last_modified', 'sections'}
+_feed_cache_lock = threading.Lock()
+
+
+def _feed_event_filter(user_id):
+    """フィードに載せるイベント (主催 + 参加/保留で回答済み) の条件"""
+    attended_event_ids = db.select(EventParticipant.event_id).where(
+        EventParticipant.user_id == user_id,
+        EventParticipant.status.in_([ParticipationStatus.ATTENDING, ParticipationStatus.TENTATIVE]),
+    )
+    return or_(Event.user_id == user_id, Event.id.in_(attended_event_ids))
+
+
+def _feed_schedule_filter(user_id, today):
+    """目標タイムを設定しているサーキットの走行枠の条件 (サーキット名の表記揺れは部分一致で吸収する)"""
+    has_target = db.select(UserCircuitTarget.id).where(
+        UserCircuitTarget.user_id == user_id,
+        TrackSchedule.circuit_name.contains(UserCircuitTarget.circuit_name),
+    ).exists()
+    return db.and_(
+        TrackSchedule.date >= today,
+        TrackSchedule.date <= today + timedelta(days=FEED_SCHEDULE_DAYS_AHEAD),
+        has_target,
+    )
+
+
+def _select_feed_reminders(user_id, today):
+    thresholds = get_reminder_thresholds()
+    return db.session.execute(
+        select_due_reminders(today, thresholds['km_warning'], FEED_REMINDER_DAYS_AHEAD).where(
+            Motorcycle.user_id == user_id,
+            Motorcycle.is_archived == False,
+        ).order_by(MaintenanceReminder.id)
+    ).all()
+
+
+def _compute_fingerprints(user_id, today):
+    """
+    セクションごとの指紋を返す。件数と最終更新日時を1回のクエリでまとめて取り、
+    更新日時を持たないリマインダーは期限判定済みの行そのものを指紋にする。
+    """
+    event_window_start = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=FEED_EVENT_DAYS_BEFORE)
+    event_filter = db.and_(_feed_event_filter(user_id), Event.start_datetime >= event_window_start)
+    schedule_filter = _feed_schedule_filter(user_id, today)
+
+    row = db.session.query(
+        db.select(func.count(Event.id)).where(event_filter).scalar_subquery(),
+        db.select(func.max(Event.updated_at)).where(event_filter).scalar_subquery(),
+        # 出欠の変更は参加者行の row_version に現れる
+        db.select(func.coalesce(func.sum(EventParticipant.row_version), 0)).where(
+            EventParticipant.user_id == user_id
+        ).scalar_subquery(),
+        db.select(func.count(TrackSchedule.id)).where(schedule_filter).scalar_subquery(),
+        # 取り込みでの時刻・備考の変更は updated_at に現れる
+        db.select(func.max(TrackSchedule.updated_at)).where(schedule_filter).scalar_subquery(),
+        db.select(func.max(UserCircuitTarget.updated_at)).where(UserCircuitTarget.user_id == user_id).scalar_subquery(),
+    ).one()
+    event_count, event_updated, participation_version, schedule_count, schedule_updated, target_updated = row
+
+    reminder_rows = _select_feed_reminders(user_id, today)
+    return {
+        'events': (event_count, event_updated, participation_version),
+        'reminders': (today, tuple(
+            (r.reminder_id, r.task_description, r.motorcycle_name, r.next_due_date, r.remaining_km, r.remaining_days)
+            for r in reminder_rows
+        )),
+        'schedules': (today, schedule_count, schedule_updated, target_updated),
+    }, reminder_rows
+
+
+def _build_event_components(user_id, today, _reminder_rows):
+    event_window_start = datetime.now(timezone.utc).replace(tzinfo=None) - timedelta(days=FEED_EVENT_DAYS_BEFORE)
+    events = Event.query.filter(
+        _feed_event_filter(user_id),
+        Event.start_datetime >= event_window_start,
+    ).order_by(Event.start_datetime).all()
+
+    components = []
+    for event in events:
+        ical_event = ICalEvent()
+        ical_event.add('uid', f'event-{event.public_id}@motopuppu.app')
+        ical_event.add('summary', event.title)
+        ical_event.add('dtstart', event.start_datetime.replace(tzinfo=timezone.utc))
+        if event.end_datetime:
+            ical_event.add('dtend', event.end_datetime.replace(tzinfo=timezone.utc))
+        ical_event.add('dtstamp', event.updated_at.replace(tzinfo=timezone.utc))
+        ical_event.add('last-modified', event.updated_at.replace(tzinfo=timezone.utc))
+        if event.location:
+            ical_event.add('location', event.location)
+        public_url = url_for('event.public_event_view', public_id=event.public_id, _external=True)
+        description = f"{event.description}\n\n" if event.description else ""
+        description += f"イベントページ: {public_url}"
+        ical_event.add('description', description)
+        ical_event.add('url', public_url)
+        components.append(ical_event.to_ical())
+    return components
+
+
+def _build_reminder_components(user_id, today, reminder_rows):
+    stamp = datetime.combine(today, time.min, tzinfo=timezone.utc)
+    components = []
+    for row in reminder_rows:
+        # 期間で判定できるものは期限日に、距離のみのものは今日の予定として載せる
+        due_date = row.next_due_date if row.remaining_days is not None else today
+        details = []
+        if row.remaining_km is not None:
+            details.append(f"残り {row.remaining_km:,} km" if row.remaining_km > 0 else f"{abs(row.remaining_km):,} km 超過")
+        if row.remaining_days is not None:
+            details.append(f"残り {row.remaining_days} 日" if row.remaining_days > 0 else f"{abs(row.remaining_days)} 日超過")
+
+        ical_event = ICalEvent()
+        ical_event.add('uid', f'reminder-{row.reminder_id}@motopuppu.app')
+        ical_event.add('summary', f"🔧 {row.task_description} ({row.motorcycle_name})")
+        ical_event.add('dtstart', due_date)
+        ical_event.add('dtend', due_date + timedelta(days=1))
+        ical_event.add('dtstamp', stamp)
+        ical_event.add('description', " / ".join(details))
+        ical_event.add('transp', 'TRANSPARENT')
+        components.append(ical_event.to_ical())
+    return components
+
+
+def _build_schedule_components(user_id, today, _reminder_rows):
+    schedules = TrackSchedule.query.filter(
+        _feed_schedule_filter(user_id, today)
+    ).order_by(TrackSchedule.date, TrackSchedule.start_time).all()
+
+    components = []
+    for schedule in schedules:
+        ical_event = ICalEvent()
+        ical_event.add('uid', f'track-schedule-{schedule.id}@motopuppu.app')
+        ical_event.add('summary', f"🏁 {schedule.circuit_name} {schedule.title}")
+        if schedule.start_time:
+            start = datetime.combine(schedule.date, schedule.start_time, tzinfo=JST)
+            ical_event.add('dtstart', start.astimezone(timezone.utc))
+            if schedule.end_time:
+                end = datetime.combine(schedule.date, schedule.end_time, tzinfo=JST)
+                ical_event.add('dtend', end.astimezone(timezone.utc))
+        else:
+            ical_event.add('dtstart', schedule.date)
+            ical_event.add('dtend', schedule.date + timedelta(days=1))
+        ical_event.add('dtstamp', schedule.created_at.replace(tzinfo=timezone.utc))
+        ical_event.add('location', schedule.circuit_name)
+        if schedule.notes:
+            ical_event.add('description', schedule.notes)
+        ical_event.add('transp', 'TRANSPARENT')
+        components.append(ical_event.to_ical())
+    return components
+
+
+# セクション名 -> 生成関数。順番がフィード内の並び順になる
+FEED_SECTIONS = OrderedDict([
+    ('events', _build_event_components),
+    ('reminders', _build_reminder_components),
+    ('schedules', _build_schedule_components),
+])
+
+
+def _fingerprint_etag(fingerprints):
+    digest = hashlib.sha1(repr(sorted(fingerprints.items())).encode('utf-8')).hexdigest()
+    return f'feed-{digest}'
+
+
+def _assemble_calendar(user, section_components):
+    cal = Calendar()
+    cal.add('prodid', '-//もとぷっぷー Calendar Feed//motopuppu.app//')
+    cal.add('version', '2.0')
+    cal.add('calscale', 'GREGORIAN')
+    cal.add('x-wr-calname', f'もとぷっぷー ({user.display_name or user.misskey_username})')
+    cal.add('x-wr-timezone', 'Asia/Tokyo')
+    # 購読側に15分より短い間隔でのポーリングを求めない
+    cal.add('x-published-ttl', 'PT15M')
+
+    header = cal.to_ical()
+    end_marker = b'END:VCALENDAR\r\n'
+    body = b''.join(component for components in section_components for component in components)
+    return header[:-len(end_marker)] + body + end_marker
+
+
+def get_calendar_feed_etag(user, today=None):
+    """
+    フィードの ETag を、フィード本体を作らずに返す。
+    :return: (etag, fingerprints, reminder_rows) のタプル
+    """
+    if today is None:
+        today = datetime.now(JST).date()
+    fingerprints, reminder_rows = _compute_fingerprints(user.id, today)
+    return _fingerprint_etag(fingerprints), fingerprints, reminder_rows
+
+
+def get_calendar_feed(user, today=None, precomputed=None):
+    """
+    ユーザーの購読用フィードを返す。前回から変化したセクションだけを作り直す。
+
+    :param precomputed: get_calendar_feed_etag() の戻り値 (同じリクエスト内で指紋を再計算しないため)
+    :return: (ics_bytes, etag, last_modified) のタプル
+    """
+    if today is None:
+        today = datetime.now(JST).date()
+    etag, fingerprints, reminder_rows = precomputed or get_calendar_feed_etag(user, today)
+
+    with _feed_cache_lock:
+        cached = _feed_cache.get(user.id)
+        if cached is not None:
+            _feed_cache.move_to_end(user.id)
+    if cached is not None and cached['etag'] == etag:
+        return cached['payload'], etag, cached['last_modified']
+
+    previous_sections = cached['sections'] if cached is not None else {}
+    sections = {}
+    for name, builder in FEED_SECTIONS.items():
+        previous = previous_sections.get(name)
+        if previous is not None and previous[0] == fingerprints[name]:
+            sections[name] = previous
+        else:
+            sections[name] = (fingerprints[name], builder(user.id, today, reminder_rows))
+
+    payload = _assemble_calendar(user, [sections[name][1] for name in FEED_SECTIONS])
+    # Last-Modified は秒単位で比較されるため、マイクロ秒を落としておく
+    last_modified = datetime.now(timezone.utc).replace(microsecond=0)
+
+    with _feed_cache_lock:
+        _feed_cache[user.id] = {
+            'etag': etag,
+            'payload': payload,
+            'last_modified': last_modified,
+            'sections': sections,
+        }
+        _feed_cache.move_to_end(user.id)
+        while len(_feed_cache) > FEED_CACHE_MAX_USERS:
+            _feed_cache.popitem(last=False)
+    return payload, etag, last_modified
+
+
+def get_cached_feed_last_modified(user_id, etag):
+    """このワーカーで生成済みのフィードが etag と一致すれば、その Last-Modified を返す"""
+    with _feed_cache_lock:
+        cached = _feed_cache.get(user_id)
+    if cached is not None and cached['etag'] == etag:
+        return cached['last_modified']
+    return None
+
+
+def invalidate_calendar_feed(user_id):
+    """トークンの再発行時などに、ユーザーのフィードキャッシュを破棄する (このワーカー内のみ)"""
+    with _feed_cache_lock:
+        _feed_cache.pop(user_id, None)
@@ -0,0 +1,49 @@
+# motopuppu/utils/chart_downsampling.py
+
+
+def lttb_indices(xs, ys, threshold):
+    """
+    Largest-Triangle-Three-Buckets 法で、グラフの形状を保ったまま点数を間引く。
+    先頭と末尾の点は常に残し、間の点はバケットごとに
+    「前に選んだ点・次バケットの平均点」と作る三角形の面積が最大の点を1つ選ぶ。
+
+    :param xs: X座標 (数値) のリスト。昇順であること
+    :param ys: Y座標 (数値) のリスト
+    :param threshold: 間引き後の最大点数
+    :return: 残す点のインデックスのリスト (昇順)
+    """
+    n = len(xs)
+    if threshold >= n or threshold < 3:
+        return list(range(n))
+
+    selected = [0]
+    bucket_size = (n - 2) / (threshold - 2)
+    a = 0
+
+    for i in range(threshold - 2):
+        # 次のバケットの平均点 (三角形の第3頂点)
+        next_start = int((i + 1) * bucket_size) + 1
+        next_end = min(int((i + 2) * bucket_size) + 1, n)
+        next_count = max(next_end - next_start, 1)
+        avg_x = sum(xs[next_start:next_end]) / next_count
+        avg_y = sum(ys[next_start:next_end]) / next_count
+
+        # 現在のバケットから面積最大の点を選ぶ
+        start = int(i * bucket_size) + 1
+        end = int((i + 1) * bucket_size) + 1
+        max_area = -1.0
+        max_index = start
+        for j in range(start, end):
+            area = abs(
+                (xs[a] - avg_x) * (ys[j] - ys[a])
+                - (xs[a] - xs[j]) * (avg_y - ys[a])
+            )
+            if area > max_area:
+                max_area = area
+                max_index = j
+
+        selected.append(max_index)
+        a = max_index
+
+    selected.append(n - 1)
+    return selected
@@ -0,0 +1,28 @@
+# motopuppu/utils/csv_export.py
+import csv
+import io
+
+# 一度にクライアントへ送り出す行数
+CSV_EXPORT_FLUSH_ROWS = 500
+
+
+def iter_csv(header, rows, flush_rows=CSV_EXPORT_FLUSH_ROWS):
+    """
+    ヘッダーと行のイテラブルから、CSV文字列を少しずつ返すジェネレータ。
+    バッファは flush_rows 行ごとに空にするため、出力件数が増えてもメモリ使用量は一定に保たれる。
+    stream_with_context() と組み合わせてレスポンスとして返すことを想定している。
+    """
+    buffer = io.StringIO()
+    writer = csv.writer(buffer)
+    writer.writerow(header)
+
+    for count, row in enumerate(rows, start=1):
+        writer.writerow(row)
+        if count % flush_rows == 0:
+            yield buffer.getvalue()
+            buffer.seek(0)
+            buffer.truncate(0)
+
+    remaining = buffer.getvalue()
+    if remaining:
+        yield remaining
@@ -0,0 +1,119 @@
+# motopuppu/utils/csv_import.py
+import bisect
+import csv
+from itertools import islice
+
+import sqlalchemy as sa
+
+from ..models import db, OdoResetLog
+
+# 一時テーブルへ一度に投入する行数
+CSV_IMPORT_CHUNK_SIZE = 1000
+# 画面に表示するエラー・重複メッセージの上限件数
+MAX_REPORTED_MESSAGES = 100
+
+
+class ImportMessages:
+    """
+    インポート時のエラー・重複メッセージを上限付きで保持する。
+    上限を超えた分は件数のみ数え、as_list() で「ほか N 件」として末尾にまとめる。
+    """
+    def __init__(self, limit=MAX_REPORTED_MESSAGES):
+        self.limit = limit
+        self.messages = []
+        self.count = 0
+
+    def add(self, message):
+        self.count += 1
+        if len(self.messages) < self.limit:
+            self.messages.append(message)
+
+    def __bool__(self):
+        return self.count > 0
+
+    def as_list(self):
+        if self.count > len(self.messages):
+            return self.messages + [f"ほか {self.count - len(self.messages)} 件"]
+        return list(self.messages)
+
+
+def open_csv_records(text_stream, required_headers):
+    """
+    CSVを1行ずつ読み出すイテレータを返す。ファイル全体をメモリに載せない。
+    先頭の '#' で始まるコメント行を読み飛ばしてヘッダー行を特定し、以降の空行・コメント行も除外する。
+
+    :return: (records, error) のタプル。
+             records は (行番号, {ヘッダー名: 値}) を返すイテレータ。ヘッダーに問題がある場合は error にメッセージが入る。
+    """
+    reader = csv.reader(text_stream)
+
+    header = None
+    header_row_num = 0
+    for row_num, row in enumerate(reader, start=1):
+        if row and not row[0].strip().startswith('#'):
+            header = [h.strip().lower() for h in row]
+            header_row_num = row_num
+            break
+
+    if header is None:
+        return None, "CSVファイルにヘッダー行が見つかりませんでした。"
+
+    if not required_headers.issubset(set(header)):
+        missing = required_headers - set(header)
+        return None, f"CSVファイルのヘッダーに必須項目がありません: {', '.join(missing)}"
+
+    def records():
+        for row_num, row in enumerate(reader, start=header_row_num + 1):
+            if not row or row[0].strip().startswith('#'):
+                continue
+            yield row_num, dict(zip(header, row))
+
+    return records(), None
+
+
+def iter_chunks(iterable, size=CSV_IMPORT_CHUNK_SIZE):
+    """イテラブルを size 件ずつのリストに区切って返す"""
+    iterator = iter(iterable)
+    while True:
+        chunk = list(islice(iterator, size))
+        if not chunk:
+            return
+        yield chunk
+
+
+def build_odo_offset_lookup(motorcycle):
+    """
+    車両のODOリセット履歴を1回だけ読み込み、日付から累積オフセットを返す関数を作る。
+    Motorcycle.calculate_cumulative_offset_from_logs を行ごとに呼ぶ代わりに使う。
+    """
+    if motorcycle.is_racer:
+        return lambda target_date: 0
+
+    resets = db.session.query(OdoResetLog.reset_date, OdoResetLog.offset_increment).filter(
+        OdoResetLog.motorcycle_id == motorcycle.id
+    ).order_by(OdoResetLog.reset_date).all()
+
+    reset_dates = [reset.reset_date for reset in resets]
+    cumulative_offsets = [0]
+    for reset in resets:
+        cumulative_offsets.append(cumulative_offsets[-1] + reset.offset_increment)
+
+    def offset_at(target_date):
+        # reset_date <= target_date となるリセットの合計
+        return cumulative_offsets[bisect.bisect_right(reset_dates, target_date)]
+
+    return offset_at
+
+
+def create_staging_table(name, *columns):
+    """
+    インポート用の一時テーブルを現在のトランザクション上に作成する。
+    トランザクション終了時 (commit / rollback) に自動で破棄される。
+    """
+    table = sa.Table(
+        name, sa.MetaData(), *columns,
+        prefixes=['TEMPORARY'],
+        postgresql_on_commit='DROP'
+    )
+    table.create(db.session.connection())
+    return table
@@ -0,0 +1,172 @@
+# motopuppu/utils/emoji_index.py
+"""
+Misskey のカスタム絵文字一覧をプロセス内に保持し、絵文字APIと入力補完から検索する。
+
+一覧は取得時に1回だけ検索用の索引 (EmojiIndex) に組み立て、以降のリクエストでは JSON を解析し直さない。
+有効期限を過ぎた一覧は古いものを返しつつバックグラウンドで取り直す。
+gunicornのワーカー毎に独立して保持する。
+"""
+import bisect
+import hashlib
+import json
+import threading
+import time
+
+import requests
+
+# 一覧を取り直すまでの秒数
+EMOJI_CACHE_DURATION_SECONDS = 86400  # 24時間
+# 取得に失敗した後、次に取り直すまでの秒数 (Misskey 側の障害中に毎回リクエストしないため)
+EMOJI_RETRY_INTERVAL_SECONDS = 300
+EMOJI_FETCH_TIMEOUT_SECONDS = 10
+# 部分一致検索用の n-gram の最大長
+_NGRAM_MAX = 3
+
+
+class EmojiIndex:
+    """
+    絵文字一覧と検索用の索引。構築後は変更しないため、ロックなしで複数スレッドから参照できる。
+
+    - 前方一致: 名前・エイリアスを小文字にしてソートした配列を二分探索する
+    - 部分一致: 1〜3文字の n-gram から候補を絞り込み、最後に文字列で確認する
+    """
+
+    def __init__(self, emojis, fetched_at=None):
+        self.emojis = [emoji for emoji in emojis if isinstance(emoji, dict) and emoji.get('name')]
+        self.fetched_at = fetched_at if fetched_at is not None else time.time()
+        self.payload = json.dumps(self.emojis, ensure_ascii=False, separators=(',', ':'))
+        self.etag = hashlib.sha1(self.payload.encode('utf-8')).hexdigest()
+
+        # 絵文字ごとの検索キー (名前 + エイリアス、小文字)
+        self._keys = []
+        sorted_keys = []
+        self._ngrams = {}
+        for position, emoji in enumerate(self.emojis):
+            keys = {emoji['name'].lower()}
+            keys.update(alias.lower() for alias in (emoji.get('aliases') or []) if isinstance(alias, str) and alias)
+            self._keys.append(tuple(keys))
+            for key in keys:
+                sorted_keys.append((key, position))
+                for n in range(1, _NGRAM_MAX + 1):
+                    for start in range(len(key) - n + 1):
+                        self._ngrams.setdefault(key[start:start + n], set()).add(position)
+        sorted_keys.sort()
+        self._sorted_keys = [key for key, _ in sorted_keys]
+        self._sorted_positions = [position for _, position in sorted_keys]
+
+    def __len__(self):
+        return len(self.emojis)
+
+    def _prefix_positions(self, query):
+        start = bisect.bisect_left(self._sorted_keys, query)
+        positions = []
+        seen = set()
+        for index in range(start, len(self._sorted_keys)):
+            if not self._sorted_keys[index].startswith(query):
+                break
+            position = self._sorted_positions[index]
+            if position not in seen:
+                seen.add(position)
+                positions.append(position)
+        return positions
+
+    def _substring_positions(self, query):
+        if len(query) <= _NGRAM_MAX:
+            return self._ngrams.get(query, set())
+        # 長いクエリは含まれる n-gram の候補集合の共通部分をとり、実際の文字列で確認する
+        candidates = None
+        for start in range(len(query) - _NGRAM_MAX + 1):
+            positions = self._ngrams.get(query[start:start + _NGRAM_MAX])
+            if not positions:
+                return set()
+            candidates = set(positions) if candidates is None else candidates & positions
+            if not candidates:
+                return set()
+        return {position for position in candidates if any(query in key for key in self._keys[position])}
+
+    def search(self, query, limit=None):
+        """
+        名前またはエイリアスに query を含む絵文字を返す。前方一致するものを先に並べる。
+
+        :param query: 検索文字列 (大文字小文字は区別しない)
+        :param limit: 返す最大件数 (省略時は全件)
+        """
+        query = (query or '').strip().lower()
+        if not query:
+            return self.emojis[:limit] if limit else list(self.emojis)
+
+        # 前方一致 (キー順) → 残りの部分一致 (一覧の並び順)
+        positions = self._prefix_positions(query)
+        if limit is None or len(positions) < limit:
+            prefix_set = set(positions)
+            positions.extend(sorted(self._substring_positions(query) - prefix_set))
+        if limit:
+            positions = positions[:limit]
+        return [self.emojis[position] for position in positions]
+
+
+_emoji_index = EmojiIndex([], fetched_at=0)
+_emoji_lock = threading.Lock()
+_refreshing = False
+_last_failure_at = 0.0
+# 取り直しの完了を通知する (取り直し中のみクリアされる)。索引がまだ無いリクエストはこれを待つ
+_refresh_done = threading.Event()
+_refresh_done.set()
+
+
+def _fetch_emojis(instance_url):
+    response = requests.post(f"{instance_url}/api/emojis", json={}, timeout=EMOJI_FETCH_TIMEOUT_SECONDS)
+    response.raise_for_status()
+    return response.json().get("emojis", [])
+
+
+def _refresh(instance_url, logger):
+    """一覧を取り直して索引を差し替える。失敗した場合は古い索引を残す"""
+    global _emoji_index, _refreshing, _last_failure_at
+    try:
+        index = EmojiIndex(_fetch_emojis(instance_url))
+        with _emoji_lock:
+            _emoji_index = index
+    except Exception as e:
+        _last_failure_at = time.time()
+        if logger is not None:
+            logger.error(f"Failed to fetch Misskey emojis: {e}")
+    finally:
+        with _emoji_lock:
+            _refreshing = False
+        _refresh_done.set()
+
+
+def get_emoji_index(instance_url, logger=None):
+    """
+    絵文字の索引を返す。
+
+    まだ一度も取得していない場合はその場で取得する (他のリクエストが取得中ならその完了を待つ)。
+    期限切れの場合は手元の索引をそのまま返し、取り直しはバックグラウンドのスレッドで1本だけ行う。
+    取得に失敗して索引が無いままの場合は空の索引を返す。
+    """
+    global _refreshing
+    now = time.time()
+    with _emoji_lock:
+        index = _emoji_index
+        start_refresh = not (
+            _refreshing
+            or now - index.fetched_at < EMOJI_CACHE_DURATION_SECONDS
+            or now - _last_failure_at < EMOJI_RETRY_INTERVAL_SECONDS
+        )
+        if start_refresh:
+            _refreshing = True
+            _refresh_done.clear()
+
+    if not index.emojis:
+        # 初回は返せるものがないので、このリクエストで取得するか、取得中のものを待つ
+        if start_refresh:
+            _refresh(instance_url, logger)
+        else:
+            _refresh_done.wait(EMOJI_FETCH_TIMEOUT_SECONDS)
+        with _emoji_lock:
+            return _emoji_index
+
+    if start_refresh:
+        threading.Thread(target=_refresh, args=(instance_url, logger), daemon=True).start()
+    return index
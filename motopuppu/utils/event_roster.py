@@ -0,0 +1,65 @@
+# motopuppu/utils/event_roster.py
+from sqlalchemy.orm import joinedload
+
+from ..models import EventCollectionPlan, EventParticipant, ParticipationStatus
+
+
+class EventRoster:
+    """
+    イベントの参加者名簿。
+    参加者 (ユーザー・料金プランを含む) と料金プランをそれぞれ1回のクエリで取得し、
+    出欠ステータス別の振り分けはメモリ上で行う。参加者が何人いても発行するクエリ数は変わらない。
+    """
+
+    def __init__(self, event, participants, plans):
+        self.event = event
+        self.participants = participants
+        self.plans = plans
+        self.plans_by_id = {plan.id: plan for plan in plans}
+
+        self.by_status = {status: [] for status in ParticipationStatus}
+        for participant in participants:
+            self.by_status[participant.status].append(participant)
+
+    @property
+    def attending(self):
+        return self.by_status[ParticipationStatus.ATTENDING]
+
+    @property
+    def tentative(self):
+        return self.by_status[ParticipationStatus.TENTATIVE]
+
+    @property
+    def not_attending(self):
+        return self.by_status[ParticipationStatus.NOT_ATTENDING]
+
+    @property
+    def active(self):
+        """当日運用・集金の対象 (参加 + 保留) を登録順で返す"""
+        return [p for p in self.participants if p.status != ParticipationStatus.NOT_ATTENDING]
+
+
+def load_event_roster(event, include_plans=None):
+    """
+    イベントの参加者名簿を読み込む。
+
+    :param event: 対象の Event
+    :param include_plans: 料金プランも取得するか。None の場合は集金が有効なイベントのみ取得する
+    :return: EventRoster
+    """
+    participants = EventParticipant.query.filter(
+        EventParticipant.event_id == event.id
+    ).options(
+        joinedload(EventParticipant.user),
+        joinedload(EventParticipant.collection_plan),
+    ).order_by(EventParticipant.created_at, EventParticipant.id).all()
+
+    if include_plans is None:
+        include_plans = bool(event.collection_enabled)
+    plans = []
+    if include_plans:
+        plans = EventCollectionPlan.query.filter(
+            EventCollectionPlan.event_id == event.id
+        ).order_by(EventCollectionPlan.sort_order, EventCollectionPlan.id).all()
+
+    return EventRoster(event, participants, plans)
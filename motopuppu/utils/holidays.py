@@ -0,0 +1,47 @@
+# motopuppu/utils/holidays.py
+import hashlib
+import json
+from datetime import date
+from functools import lru_cache
+
+import jpholiday
+
+# カレンダーに渡す祝日の範囲 (今年を中心に前後何年分か)
+HOLIDAY_YEARS_AROUND = 1
+
+
+@lru_cache(maxsize=32)
+def _holidays_for_year(year):
+    """指定年の祝日を {'YYYY-MM-DD': 祝日名} で返す。年ごとにプロセス内で1回だけ計算する"""
+    return {
+        holiday_date.strftime('%Y-%m-%d'): holiday_name
+        for holiday_date, holiday_name in jpholiday.year_holidays(year)
+    }
+
+
+def get_holidays(start_year, end_year):
+    """start_year 〜 end_year (両端含む) の祝日を {'YYYY-MM-DD': 祝日名} で返す"""
+    holidays = {}
+    for year in range(start_year, end_year + 1):
+        holidays.update(_holidays_for_year(year))
+    return holidays
+
+
+@lru_cache(maxsize=4)
+def _holidays_payload(center_year):
+    holidays = get_holidays(center_year - HOLIDAY_YEARS_AROUND, center_year + HOLIDAY_YEARS_AROUND)
+    payload = json.dumps(holidays, ensure_ascii=False, sort_keys=True)
+    etag = hashlib.sha1(payload.encode('utf-8')).hexdigest()
+    return payload, etag
+
+
+def get_holidays_payload(today=None):
+    """
+    今年を中心とした祝日のJSON文字列と、その ETag を返す。
+    年が変わるまでは同じ文字列を使い回すため、呼び出しごとの計算は発生しない。
+
+    :return: (json_string, etag) のタプル
+    """
+    if today is None:
+        today = date.today()
+    return _holidays_payload(today.year)
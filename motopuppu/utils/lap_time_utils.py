@@ -53,11 +53,31 @@ def calculate_lap_stats(lap_times, sort_by='record_asc'):
     if not lap_times or not isinstance(lap_times, list):
         return "N/A", "N/A", []
 
+    lap_seconds = []
+    for t in lap_times:
+        sec = parse_time_to_seconds(t)
+        lap_seconds.append(sec if sec is not None and sec > 0 else None)
+
+    return calculate_lap_stats_from_seconds(lap_seconds, sort_by=sort_by)
+
+
+def calculate_lap_stats_from_seconds(lap_seconds, sort_by='record_asc'):
+    """
+    数値化済みのラップ配列 (記録順・無効ラップは None) から
+    calculate_lap_stats と同じ (ベスト, 平均, 各ラップの詳細) を返す。
+    SessionLog.lap_seconds キャッシュから文字列の再パースなしで表示用データを組み立てるために使う。
+    """
+    if not lap_seconds:
+        return "N/A", "N/A", []
+
     # 1. 元のインデックスを保持したまま、有効なラップタイム（秒）のリストを作成
+    # JSONBから読み出した float は str 経由で Decimal 化し、文字列パース時と同じ丸めにする
     lap_seconds_indexed = []
-    for i, t in enumerate(lap_times):
-        sec = parse_time_to_seconds(t)
-        if sec is not None and sec > 0:
+    for i, s in enumerate(lap_seconds):
+        if s is None:
+            continue
+        sec = s if isinstance(s, Decimal) else Decimal(str(s))
+        if sec > 0:
             lap_seconds_indexed.append({'original_index': i, 'seconds': sec})
 
     if not lap_seconds_indexed:
@@ -76,7 +96,7 @@ def calculate_lap_stats(lap_times, sort_by='record_asc'):
 
     # 4. 最終的な詳細リストを作成 (この時点では記録順)
     lap_details = []
-    for item in sorted(lap_seconds_indexed, key=lambda x: x['original_index']):
+    for item in lap_seconds_indexed:
         original_index = item['original_index']
         sec = item['seconds']
         rank = rank_map.get(original_index)
@@ -105,21 +125,79 @@ def calculate_lap_stats(lap_times, sort_by='record_asc'):
     return format_seconds_to_time(best_lap_sec), format_seconds_to_time(average_lap_sec), lap_details
 # --- ▲▲▲ 変更ここまで ▲▲▲ ---
 
-def _calculate_and_set_best_lap(session, lap_times_list):
+_LAP_STAT_QUANTUM = Decimal('0.001')
+
+
+def compute_lap_statistics(lap_times_list):
     """
-    ラップタイムのリストからベストラップを秒で計算し、
-    セッションオブジェクトにセットする
+    ラップタイム文字列のリストから、数値ラップ配列と派生統計値をまとめて計算する。
+    SessionLog のラップ統計キャッシュ列に保存する値をそのまま返す。
+
+    - lap_seconds: lap_times と同じ並び・長さの秒(float)配列。無効なラップは None
+    - consistency: (1 - 標準偏差 / 平均) * 100 。全ラップが同タイムなら 100
     """
-    if not lap_times_list:
-        session.best_lap_seconds = None
-        return
-    
-    lap_seconds = [s for s in (parse_time_to_seconds(t) for t in lap_times_list) if s is not None]
-    
-    if lap_seconds:
-        session.best_lap_seconds = min(lap_seconds)
+    stats = {
+        'lap_seconds': None,
+        'best_lap_seconds': None,
+        'average_lap_seconds': None,
+        'median_lap_seconds': None,
+        'worst_lap_seconds': None,
+        'lap_stddev_seconds': None,
+        'lap_consistency': None,
+        'valid_lap_count': 0,
+    }
+    if not lap_times_list or not isinstance(lap_times_list, list):
+        return stats
+
+    lap_seconds = []
+    valid_seconds = []
+    for t in lap_times_list:
+        sec = parse_time_to_seconds(t)
+        if sec is not None and sec > 0:
+            sec = sec.quantize(_LAP_STAT_QUANTUM)
+            lap_seconds.append(float(sec))
+            valid_seconds.append(sec)
+        else:
+            lap_seconds.append(None)
+
+    stats['lap_seconds'] = lap_seconds
+    stats['valid_lap_count'] = len(valid_seconds)
+    if not valid_seconds:
+        return stats
+
+    average = sum(valid_seconds) / len(valid_seconds)
+    stats['best_lap_seconds'] = min(valid_seconds)
+    stats['worst_lap_seconds'] = max(valid_seconds)
+    stats['average_lap_seconds'] = average.quantize(_LAP_STAT_QUANTUM)
+    stats['median_lap_seconds'] = Decimal(statistics.median(valid_seconds)).quantize(_LAP_STAT_QUANTUM)
+    if len(valid_seconds) >= 2:
+        stddev = statistics.stdev(valid_seconds)
+        stats['lap_stddev_seconds'] = stddev.quantize(_LAP_STAT_QUANTUM)
+        stats['lap_consistency'] = max(Decimal('0'), (1 - stddev / average) * 100).quantize(Decimal('0.01'))
     else:
-        session.best_lap_seconds = None
+        stats['lap_stddev_seconds'] = Decimal('0.000')
+        stats['lap_consistency'] = Decimal('100.00')
+    return stats
+
+
+def _calculate_and_set_best_lap(session, lap_times_list):
+    """
+    ラップタイムのリストからベストラップを含むラップ統計を計算し、
+    セッションオブジェクトのキャッシュ列 (lap_seconds, average_lap_seconds 等) にセットする。
+    ラップが変更される全ての書き込み経路から呼び出すこと。
+    """
+    for field, value in compute_lap_statistics(lap_times_list).items():
+        setattr(session, field, value)
+
+
+def get_session_lap_seconds(session):
+    """
+    セッションの数値ラップ配列を返す。キャッシュ列 (lap_seconds) が未計算の
+    古いレコードでは lap_times からその場で計算する (backfill-lap-stats 実行前の互換用)。
+    """
+    if session.lap_seconds is not None:
+        return session.lap_seconds
+    return compute_lap_statistics(session.lap_times)['lap_seconds'] or []
 
 def filter_outlier_laps(lap_times_list: list, threshold_multiplier: float = 2.0) -> list:
     """
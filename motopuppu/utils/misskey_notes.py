@@ -0,0 +1,115 @@
+# motopuppu/utils/misskey_notes.py
+"""
+ツーリングログのスクラップブックに表示する Misskey ノートを取得する。
+
+取得したノートは表示に必要な項目だけにして misskey_note_cache に保存し、
+キャッシュにないノートだけを Misskey API から並列に (同時接続数を制限して) 取得する。
+"""
+from concurrent.futures import ThreadPoolExecutor
+from datetime import timedelta
+
+import requests
+from requests.adapters import HTTPAdapter
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+
+from ..models import db, MisskeyNoteCache
+
+# キャッシュしたノートを取り直すまでの期間 (ノートの削除・編集の反映はこの期間だけ遅れる)
+MISSKEY_NOTE_CACHE_TTL = timedelta(days=1)
+# Misskey API への同時リクエスト数の上限
+MISSKEY_NOTE_FETCH_CONCURRENCY = 8
+MISSKEY_NOTE_FETCH_TIMEOUT_SECONDS = 5
+# 1回のリクエストで受け付けるノートIDの上限
+MAX_NOTE_IDS_PER_REQUEST = 100
+
+
+def _trim_note(note):
+    """スクラップブックの表示に使う項目だけを残す"""
+    user = note.get('user') or {}
+    return {
+        'id': note.get('id'),
+        'text': note.get('text'),
+        'createdAt': note.get('createdAt'),
+        'files': [
+            {'url': file.get('url'), 'thumbnailUrl': file.get('thumbnailUrl')}
+            for file in (note.get('files') or [])
+        ],
+        'user': {
+            'username': user.get('username'),
+            'name': user.get('name'),
+            'avatarUrl': user.get('avatarUrl'),
+        },
+    }
+
+
+def fetch_notes_concurrently(instance_url, api_token, note_ids, logger=None):
+    """
+    notes/show を最大 MISSKEY_NOTE_FETCH_CONCURRENCY 並列で呼び出す。
+
+    :return: {note_id: 表示用のノート or None (取得できなかった場合)}
+    """
+    if not note_ids:
+        return {}
+    api_url = f"{instance_url}/api/notes/show"
+    workers = min(MISSKEY_NOTE_FETCH_CONCURRENCY, len(note_ids))
+
+    with requests.Session() as session:
+        # 並列数と同じだけ接続を使い回せるようにする
+        adapter = HTTPAdapter(pool_connections=1, pool_maxsize=workers)
+        session.mount('http://', adapter)
+        session.mount('https://', adapter)
+
+        def fetch(note_id):
+            try:
+                response = session.post(
+                    api_url, json={'i': api_token, 'noteId': note_id},
+                    timeout=MISSKEY_NOTE_FETCH_TIMEOUT_SECONDS
+                )
+                if response.status_code == 200:
+                    return note_id, _trim_note(response.json())
+            except (requests.RequestException, ValueError) as e:
+                if logger is not None:
+                    logger.warning(f"Failed to fetch Misskey note {note_id}: {e}")
+            return note_id, None
+
+        with ThreadPoolExecutor(max_workers=workers) as executor:
+            return dict(executor.map(fetch, note_ids))
+
+
+def get_note_details(user_id, note_ids, instance_url, api_token, logger=None):
+    """
+    ノートIDのリストに対応する表示用ノートを返す。キャッシュにないものだけを Misskey から取得して保存する。
+    保存はセッションに積むだけなので、呼び出し側で commit すること。
+
+    :return: {note_id: 表示用のノート or None}
+    """
+    note_ids = list(dict.fromkeys(note_ids))
+    if not note_ids:
+        return {}
+
+    cached_rows = db.session.execute(
+        db.select(MisskeyNoteCache.misskey_note_id, MisskeyNoteCache.payload).where(
+            MisskeyNoteCache.user_id == user_id,
+            MisskeyNoteCache.misskey_note_id.in_(note_ids),
+            MisskeyNoteCache.fetched_at >= db.func.now() - MISSKEY_NOTE_CACHE_TTL,
+        )
+    ).all()
+    details = {note_id: payload for note_id, payload in cached_rows}
+
+    missing_ids = [note_id for note_id in note_ids if note_id not in details]
+    fetched = fetch_notes_concurrently(instance_url, api_token, missing_ids, logger=logger)
+    details.update(fetched)
+
+    rows = [
+        {'user_id': user_id, 'misskey_note_id': note_id, 'payload': payload}
+        for note_id, payload in fetched.items() if payload is not None
+    ]
+    if rows:
+        stmt = pg_insert(MisskeyNoteCache.__table__).values(rows)
+        stmt = stmt.on_conflict_do_update(
+            index_elements=['user_id', 'misskey_note_id'],
+            set_={'payload': stmt.excluded.payload, 'fetched_at': db.func.now()},
+        )
+        db.session.execute(stmt)
+
+    return {note_id: details.get(note_id) for note_id in note_ids}
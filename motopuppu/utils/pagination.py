@@ -1,5 +1,11 @@
 # motopuppu/utils/pagination.py
+import base64
+import binascii
+import json
 import math
+from datetime import date, datetime
+
+from sqlalchemy import and_, or_, asc, desc
 
 
 class SimplePagination:
@@ -44,3 +50,96 @@ class SimplePagination:
                     yield None
                 yield num
                 last = num
+
+
+class KeysetPagination(SimplePagination):
+    """
+    キーセット(シーク)方式のページネーションオブジェクト。
+    前後ページへの移動は直前ページ端の行の並び替えキーを cursor として受け渡し、
+    OFFSET を使わずに取得するため、深いページでも1ページ目と同じコストで済む。
+    ページ番号での直接ジャンプ時のみ OFFSET で取得する (SimplePagination と同じ属性を持つ)。
+    """
+    def __init__(self, page, per_page, total, items, next_cursor=None, prev_cursor=None):
+        super().__init__(page, per_page, total, items)
+        self.next_cursor = next_cursor
+        self.prev_cursor = prev_cursor
+
+
+def _encode_cursor(values):
+    payload = json.dumps([v.isoformat() if isinstance(v, (date, datetime)) else v for v in values])
+    return base64.urlsafe_b64encode(payload.encode('utf-8')).decode('ascii').rstrip('=')
+
+
+def _decode_cursor(cursor, order_keys):
+    """cursor 文字列を並び替えキーの型に合わせて復元する。不正な値の場合は None を返す"""
+    try:
+        padded = cursor + '=' * (-len(cursor) % 4)
+        raw_values = json.loads(base64.urlsafe_b64decode(padded.encode('ascii')).decode('utf-8'))
+        if not isinstance(raw_values, list) or len(raw_values) != len(order_keys):
+            return None
+        values = []
+        for raw, key in zip(raw_values, order_keys):
+            column = key[0]
+            python_type = column.type.python_type
+            if python_type is date:
+                values.append(date.fromisoformat(raw))
+            elif python_type is datetime:
+                values.append(datetime.fromisoformat(raw))
+            else:
+                values.append(python_type(raw))
+        return values
+    except (ValueError, TypeError, NotImplementedError, binascii.Error, UnicodeDecodeError):
+        return None
+
+
+def _seek_condition(order_keys, values, forward=True):
+    """
+    (c1, c2, ...) の並び順で values より後ろ (forward=False なら前) の行を表す条件式。
+    昇順・降順が混在するキーにも対応するため、行値比較ではなく OR 展開で組み立てる。
+    """
+    clauses = []
+    for i, key in enumerate(order_keys):
+        column, descending = key[0], key[1]
+        equals = [order_keys[j][0] == values[j] for j in range(i)]
+        go_lower = descending if forward else not descending
+        compare = column < values[i] if go_lower else column > values[i]
+        clauses.append(and_(*equals, compare))
+    return or_(*clauses)
+
+
+def keyset_paginate(query, order_keys, page, per_page, total, after=None, before=None, seekable=True):
+    """
+    クエリをキーセット方式でページネーションし、KeysetPagination を返す。
+
+    :param order_keys: [(ORM列属性, 降順かどうか[, 行から値を取り出す関数]), ...]
+                       最後のキーは一意な列 (id) であること。関数省略時は getattr(行, 列名)
+    :param total: フィルタ適用後の総件数 (統計用に取得済みの COUNT を再利用する)
+    :param after: 次ページ移動時の cursor (前ページ末尾の行)
+    :param before: 前ページ移動時の cursor (次ページ先頭の行)
+    :param seekable: NULLを含み得る列で並び替える場合は False にする (常に OFFSET で取得)
+    """
+    page = max(page, 1)
+    ordering = [desc(k[0]) if k[1] else asc(k[0]) for k in order_keys]
+    reverse_ordering = [asc(k[0]) if k[1] else desc(k[0]) for k in order_keys]
+
+    after_values = _decode_cursor(after, order_keys) if after and seekable else None
+    before_values = _decode_cursor(before, order_keys) if before and seekable else None
+
+    if after_values is not None:
+        items = query.filter(_seek_condition(order_keys, after_values)).order_by(*ordering).limit(per_page).all()
+    elif before_values is not None:
+        items = query.filter(_seek_condition(order_keys, before_values, forward=False)).order_by(*reverse_ordering).limit(per_page).all()
+        items.reverse()
+    else:
+        # ページ番号での直接ジャンプ (cursor が無い/不正な場合) は OFFSET で取得
+        items = query.order_by(*ordering).limit(per_page).offset((page - 1) * per_page).all()
+
+    def _cursor_for(item):
+        return _encode_cursor([
+            key[2](item) if len(key) > 2 else getattr(item, key[0].key)
+            for key in order_keys
+        ])
+
+    next_cursor = _cursor_for(items[-1]) if items and seekable else None
+    prev_cursor = _cursor_for(items[0]) if items and seekable else None
+    return KeysetPagination(page, per_page, total, items, next_cursor=next_cursor, prev_cursor=prev_cursor)
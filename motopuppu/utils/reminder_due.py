@@ -0,0 +1,77 @@
+# motopuppu/utils/reminder_due.py
+from datetime import date, datetime, timedelta, timezone
+
+from flask import current_app
+from sqlalchemy import and_, case, func, or_
+
+from ..models import db, Motorcycle, MaintenanceEntry, MaintenanceReminder
+
+
+def get_reminder_thresholds():
+    """リマインダーの警告・超過判定に使う閾値を設定から読み込む"""
+    config = current_app.config
+    return {
+        'km_warning': config.get('REMINDER_KM_WARNING', 500),
+        'km_danger': config.get('REMINDER_KM_DANGER', 0),
+        'days_warning': config.get('REMINDER_DAYS_WARNING', 14),
+        'days_danger': config.get('REMINDER_DAYS_DANGER', 0),
+    }
+
+
+def select_due_reminders(today=None, km_warning=None, days_warning=None):
+    """
+    期限が近い (または過ぎた) リマインダーを、車両の現在の総走行距離と突き合わせて1回のSQLで抽出する。
+    非表示・スヌーズ中のリマインダーは除外する (アーカイブ済み車両の除外は呼び出し側で行う)。
+    返り値は Select なので、呼び出し側でユーザーや車両の条件を追加して実行する。
+
+    各行には次回期限 (next_due_km / next_due_date) と、残り距離 (remaining_km) / 残り日数 (remaining_days) が含まれる。
+    距離・期間のどちらかが判定対象外の場合、対応する残り値は NULL になる。
+    """
+    if today is None:
+        today = date.today()
+    if km_warning is None or days_warning is None:
+        thresholds = get_reminder_thresholds()
+        km_warning = thresholds['km_warning'] if km_warning is None else km_warning
+        days_warning = thresholds['days_warning'] if days_warning is None else days_warning
+
+    # Motorcycle.get_display_total_mileage() と同じ値
+    current_km = func.greatest(Motorcycle.current_total_distance, Motorcycle.odometer_offset)
+    km_applicable = and_(
+        Motorcycle.is_racer == False,
+        MaintenanceReminder.interval_km > 0,
+        MaintenanceReminder.next_due_km.isnot(None)
+    )
+    date_applicable = and_(
+        MaintenanceReminder.interval_months > 0,
+        MaintenanceReminder.next_due_date.isnot(None)
+    )
+
+    return db.select(
+        MaintenanceReminder.id.label('reminder_id'),
+        MaintenanceReminder.task_description,
+        MaintenanceReminder.last_done_date,
+        MaintenanceReminder.last_done_odo,
+        MaintenanceReminder.next_due_km,
+        MaintenanceReminder.next_due_date,
+        Motorcycle.id.label('motorcycle_id'),
+        Motorcycle.name.label('motorcycle_name'),
+        Motorcycle.user_id,
+        Motorcycle.is_racer,
+        current_km.label('current_km'),
+        case((km_applicable, MaintenanceReminder.next_due_km - current_km), else_=None).label('remaining_km'),
+        case((date_applicable, MaintenanceReminder.next_due_date - today), else_=None).label('remaining_days'),
+        MaintenanceEntry.id.label('linked_entry_id'),
+        MaintenanceEntry.odometer_reading_at_maintenance.label('linked_entry_odo'),
+    ).join(
+        Motorcycle, Motorcycle.id == MaintenanceReminder.motorcycle_id
+    ).outerjoin(
+        MaintenanceEntry, MaintenanceEntry.id == MaintenanceReminder.last_maintenance_entry_id
+    ).where(
+        MaintenanceReminder.is_dismissed == False,
+        (MaintenanceReminder.snoozed_until == None) | (MaintenanceReminder.snoozed_until <= datetime.now(timezone.utc)),
+        # 比較は生成列側に寄せて書き、部分インデックスを使えるようにする
+        or_(
+            and_(km_applicable, MaintenanceReminder.next_due_km <= current_km + km_warning),
+            and_(date_applicable, MaintenanceReminder.next_due_date <= today + timedelta(days=days_warning))
+        )
+    )
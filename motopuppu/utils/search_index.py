@@ -0,0 +1,362 @@
+# motopuppu/utils/search_index.py
+"""
+横断検索用の search_documents テーブルを、検索対象レコードの登録・編集・削除に合わせて更新する。
+
+検索対象の種類は SEARCHABLE_TYPES に登録する。登録した種類は、セッションの flush 時に
+自動で search_documents へ反映され、検索API (views/search.py) のクエリを変更せずに検索できるようになる。
+ORMを経由しない一括INSERT (CSVインポートなど) の後は index_search_documents() を呼ぶこと。
+"""
+import threading
+import time
+from collections import OrderedDict, namedtuple
+
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..models import (
+    db, Motorcycle, MaintenanceEntry, FuelEntry, GeneralNote, ActivityLog,
+    SettingSheet, MaintenanceReminder, TouringLog, Event, MaintenanceSpecSheet, SearchDocument
+)
+from .csv_import import iter_chunks
+
+# 一括登録・再構築時に一度に処理する件数
+SEARCH_INDEX_CHUNK_SIZE = 500
+
+# --- 検索結果キャッシュ ---
+# 入力中の同じクエリ (再フォーカス・BackSpaceでの戻り等) で検索を繰り返さないよう、
+# (ユーザーID, 正規化したクエリ) ごとに検索APIの結果を短時間保持する。
+# gunicornのワーカー毎に独立するため、他ワーカーでの更新はTTL経過まで反映されない。
+SEARCH_RESULT_CACHE_TTL_SECONDS = 30
+SEARCH_RESULT_CACHE_MAX_ENTRIES = 1000
+_search_result_cache = OrderedDict()  # (user_id, query) -> (expires_at, results)
+_search_result_cache_lock = threading.Lock()
+
+SearchableType = namedtuple(
+    'SearchableType',
+    ['entity_type', 'model', 'label', 'endpoint', 'url_arg', 'build', 'show_motorcycle_name']
+)
+
+
+def _join_text(*values):
+    return '\n'.join(str(value) for value in values if value)
+
+
+def _truncate(text, length):
+    return text[:length] if text else text
+
+
+def _build_motorcycle(item):
+    return {
+        'user_id': item.user_id,
+        'motorcycle_id': item.id,
+        'title': f"{item.name} ({item.maker or 'メーカー未設定'})",
+        'summary': f"年式: {item.year or '未設定'}",
+        'body': '',
+        'doc_date': None,
+    }
+
+
+def _build_maintenance(item):
+    return {
+        'motorcycle_id': item.motorcycle_id,
+        'title': f"{item.description[:30]}...",
+        'summary': f"{item.maintenance_date.strftime('%Y-%m-%d')} | {item.category or 'カテゴリなし'}",
+        'body': _join_text(item.description, item.category, item.notes),
+        'doc_date': item.maintenance_date,
+    }
+
+
+def _build_fuel(item):
+    return {
+        'motorcycle_id': item.motorcycle_id,
+        'title': f"{item.entry_date.strftime('%Y-%m-%d')} の給油",
+        'summary': f"スタンド: {item.station_name or '未記録'}, メモ: {(item.notes[:20] + '...') if item.notes else 'なし'}",
+        'body': _join_text(item.station_name, item.fuel_type, item.notes),
+        'doc_date': item.entry_date,
+    }
+
+
+def _build_note(item):
+    return {
+        'user_id': item.user_id,
+        'motorcycle_id': item.motorcycle_id,
+        'title': item.title or "無題のノート",
+        'summary': f"{item.note_date.strftime('%Y-%m-%d')} | {_truncate(item.content, 30) or '内容なし'}...",
+        'body': item.content or '',
+        'doc_date': item.note_date,
+    }
+
+
+def _build_activity(item):
+    return {
+        'user_id': item.user_id,
+        'motorcycle_id': item.motorcycle_id,
+        'title': item.activity_title or item.location_name_display,
+        'summary': f"{item.activity_date.strftime('%Y-%m-%d')} | {_truncate(item.notes, 30) or 'メモなし'}...",
+        'body': _join_text(item.circuit_name, item.custom_location, item.notes),
+        'doc_date': item.activity_date,
+    }
+
+
+def _build_reminder(item):
+    interval_parts = []
+    if item.interval_km:
+        interval_parts.append(f"{item.interval_km}km")
+    if item.interval_months:
+        interval_parts.append(f"{item.interval_months}ヶ月")
+    return {
+        'motorcycle_id': item.motorcycle_id,
+        'title': item.task_description,
+        'summary': f"サイクル: {' / '.join(interval_parts)}",
+        'body': '',
+        'doc_date': None,
+    }
+
+
+def _build_setting(item):
+    return {
+        'user_id': item.user_id,
+        'motorcycle_id': item.motorcycle_id,
+        'title': item.sheet_name,
+        'summary': f"メモ: {_truncate(item.notes, 30) or 'なし'}...",
+        'body': item.notes or '',
+        'doc_date': None,
+    }
+
+
+def _build_touring(item):
+    return {
+        'user_id': item.user_id,
+        'motorcycle_id': item.motorcycle_id,
+        'title': item.title,
+        'summary': f"{item.touring_date.strftime('%Y-%m-%d')} | {_truncate(item.memo, 30) or 'メモなし'}...",
+        'body': item.memo or '',
+        'doc_date': item.touring_date,
+    }
+
+
+def _build_event(item):
+    return {
+        'user_id': item.user_id,
+        'motorcycle_id': item.motorcycle_id,
+        'title': item.title,
+        'summary': f"{item.start_datetime.strftime('%Y-%m-%d %H:%M')} | {item.location or '場所未設定'}",
+        'body': _join_text(item.description, item.location),
+        'doc_date': item.start_datetime,
+    }
+
+
+def _build_spec_sheet(item):
+    return {
+        'user_id': item.user_id,
+        'motorcycle_id': item.motorcycle_id,
+        'title': item.sheet_name,
+        'summary': "車両固有の整備情報を記録・閲覧します。",
+        'body': '',
+        'doc_date': None,
+    }
+
+
+# 登録順が検索結果のカテゴリ表示順になる
+SEARCHABLE_TYPES = [
+    SearchableType('motorcycle', Motorcycle, '車両', 'vehicle.edit_vehicle', 'vehicle_id', _build_motorcycle, False),
+    SearchableType('maintenance', MaintenanceEntry, '整備記録', 'maintenance.edit_maintenance', 'entry_id', _build_maintenance, True),
+    SearchableType('fuel', FuelEntry, '給油記録', 'fuel.edit_fuel', 'entry_id', _build_fuel, True),
+    SearchableType('note', GeneralNote, 'ノート', 'notes.edit_note', 'note_id', _build_note, False),
+    SearchableType('activity', ActivityLog, '活動ログ', 'activity.detail_activity', 'activity_id', _build_activity, True),
+    SearchableType('reminder', MaintenanceReminder, 'リマインダー', 'reminder.edit_reminder', 'reminder_id', _build_reminder, True),
+    SearchableType('setting', SettingSheet, 'セッティングシート', 'activity.edit_setting', 'setting_id', _build_setting, True),
+    SearchableType('touring', TouringLog, 'ツーリングログ', 'touring.detail_log', 'log_id', _build_touring, True),
+    SearchableType('event', Event, 'イベント', 'event.event_detail', 'event_id', _build_event, False),
+    SearchableType('spec_sheet', MaintenanceSpecSheet, '整備情報シート', 'spec_sheet.view_sheet', 'sheet_id', _build_spec_sheet, True),
+]
+SEARCHABLE_TYPES_BY_NAME = {searchable.entity_type: searchable for searchable in SEARCHABLE_TYPES}
+_SEARCHABLE_TYPES_BY_MODEL = {searchable.model: searchable for searchable in SEARCHABLE_TYPES}
+
+
+def normalize_search_query(query):
+    """検索クエリを正規化する (前後・連続する空白の整理と小文字化)。キャッシュのキーにも使う"""
+    return ' '.join(query.split()).lower()
+
+
+def get_cached_search_results(user_id, query):
+    """キャッシュ済みの検索結果を返す。無い・期限切れの場合は None"""
+    key = (user_id, query)
+    with _search_result_cache_lock:
+        cached = _search_result_cache.get(key)
+        if cached is None:
+            return None
+        expires_at, results = cached
+        if time.monotonic() >= expires_at:
+            del _search_result_cache[key]
+            return None
+        _search_result_cache.move_to_end(key)
+        return results
+
+
+def set_cached_search_results(user_id, query, results):
+    with _search_result_cache_lock:
+        _search_result_cache[(user_id, query)] = (time.monotonic() + SEARCH_RESULT_CACHE_TTL_SECONDS, results)
+        _search_result_cache.move_to_end((user_id, query))
+        while len(_search_result_cache) > SEARCH_RESULT_CACHE_MAX_ENTRIES:
+            _search_result_cache.popitem(last=False)
+
+
+def invalidate_cached_search_results(user_ids):
+    """指定ユーザーの検索結果キャッシュを破棄する (このワーカー内のみ)"""
+    if not user_ids:
+        return
+    with _search_result_cache_lock:
+        for key in [key for key in _search_result_cache if key[0] in user_ids]:
+            del _search_result_cache[key]
+
+
+def _build_documents(connection, items):
+    """(SearchableType, インスタンス) の組から search_documents の行を作る"""
+    documents = []
+    for searchable, item in items:
+        document = searchable.build(item)
+        document.setdefault('user_id', None)
+        document['entity_type'] = searchable.entity_type
+        document['entity_id'] = item.id
+        documents.append(document)
+
+    # 所属車両の所有者 (user_id を持たないモデル用) と車両名をまとめて引く
+    motorcycle_ids = {doc['motorcycle_id'] for doc in documents if doc['motorcycle_id'] is not None}
+    if motorcycle_ids:
+        motorcycles = {
+            row.id: row for row in connection.execute(
+                sa.select(Motorcycle.id, Motorcycle.user_id, Motorcycle.name).where(Motorcycle.id.in_(motorcycle_ids))
+            )
+        }
+        for (searchable, _item), document in zip(items, documents):
+            motorcycle = motorcycles.get(document['motorcycle_id'])
+            if motorcycle is None:
+                continue
+            if document['user_id'] is None:
+                document['user_id'] = motorcycle.user_id
+            # 車両名で絞り込めるよう、車両に紐づく記録は本文に車両名を含める
+            if searchable.show_motorcycle_name:
+                document['body'] = _join_text(motorcycle.name, document['body'])
+
+    return [document for document in documents if document['user_id'] is not None]
+
+
+def _upsert_documents(connection, documents):
+    if not documents:
+        return
+    stmt = pg_insert(SearchDocument.__table__)
+    stmt = stmt.on_conflict_do_update(
+        index_elements=['entity_type', 'entity_id'],
+        set_={
+            **{
+                column: stmt.excluded[column]
+                for column in ('user_id', 'motorcycle_id', 'title', 'summary', 'body', 'doc_date')
+            },
+            'updated_at': sa.func.now(),
+        }
+    )
+    connection.execute(stmt, documents)
+
+
+def _delete_documents(connection, keys):
+    """検索ドキュメントを削除し、削除した行の user_id の集合を返す"""
+    if not keys:
+        return set()
+    return set(connection.execute(
+        sa.delete(SearchDocument.__table__).where(
+            sa.tuple_(SearchDocument.entity_type, SearchDocument.entity_id).in_(keys)
+        ).returning(SearchDocument.user_id)
+    ).scalars())
+
+
+def _index_query(connection, searchable, query):
+    """クエリで取得したレコードを分割して search_documents に反映し、登録件数を返す"""
+    count = 0
+    for chunk in iter_chunks(query.order_by(searchable.model.id).yield_per(SEARCH_INDEX_CHUNK_SIZE), SEARCH_INDEX_CHUNK_SIZE):
+        documents = _build_documents(connection, [(searchable, item) for item in chunk])
+        _upsert_documents(connection, documents)
+        invalidate_cached_search_results({document['user_id'] for document in documents})
+        count += len(documents)
+    return count
+
+
+def _reindex_motorcycle_children(session, connection, motorcycle_ids):
+    """車両名が変わった車両に紐づく記録の検索ドキュメントを作り直す (本文に車両名を含むため)"""
+    with session.no_autoflush:
+        for searchable in SEARCHABLE_TYPES:
+            if searchable.show_motorcycle_name:
+                model = searchable.model
+                _index_query(connection, searchable, session.query(model).filter(model.motorcycle_id.in_(motorcycle_ids)))
+
+
+def _sync_search_documents(session, flush_context):
+    """flush された検索対象レコードの内容を search_documents に反映する"""
+    changed = []
+    renamed_motorcycle_ids = set()
+    for item in list(session.new) + list(session.dirty):
+        searchable = _SEARCHABLE_TYPES_BY_MODEL.get(type(item))
+        if searchable is not None and item.id is not None and session.is_modified(item, include_collections=False):
+            changed.append((searchable, item))
+            if isinstance(item, Motorcycle) and sa.inspect(item).attrs.name.history.deleted:
+                renamed_motorcycle_ids.add(item.id)
+
+    deleted = [
+        (_SEARCHABLE_TYPES_BY_MODEL[type(item)].entity_type, item.id)
+        for item in session.deleted
+        if type(item) in _SEARCHABLE_TYPES_BY_MODEL and item.id is not None
+    ]
+    if not changed and not deleted:
+        return
+
+    connection = session.connection()
+    documents = _build_documents(connection, changed)
+    _upsert_documents(connection, documents)
+    deleted_user_ids = _delete_documents(connection, deleted)
+    invalidate_cached_search_results({document['user_id'] for document in documents} | deleted_user_ids)
+    if renamed_motorcycle_ids:
+        _reindex_motorcycle_children(session, connection, renamed_motorcycle_ids)
+
+
+def register_search_index_listeners():
+    """全セッションの flush に search_documents の同期処理を登録する (アプリ初期化時に1回呼ぶ)"""
+    if not sa.event.contains(Session, 'after_flush', _sync_search_documents):
+        sa.event.listen(Session, 'after_flush', _sync_search_documents)
+
+
+def index_search_documents(model, *criteria):
+    """
+    ORMを経由せずに登録したレコードを search_documents に反映する。
+    CSVインポートのような一括INSERTの後に、登録したレコードを絞り込む条件を渡して呼び出す。
+    """
+    searchable = _SEARCHABLE_TYPES_BY_MODEL[model]
+    return _index_query(db.session.connection(), searchable, model.query.filter(*criteria))
+
+
+def rebuild_search_documents(user_id=None):
+    """
+    search_documents を検索対象テーブルの内容から作り直す。
+    user_id を指定した場合はそのユーザーの分だけを対象にする。
+
+    :return: 種類ごとの登録件数の辞書
+    """
+    connection = db.session.connection()
+    delete_stmt = sa.delete(SearchDocument.__table__)
+    if user_id:
+        delete_stmt = delete_stmt.where(SearchDocument.user_id == user_id)
+    connection.execute(delete_stmt)
+
+    counts = {}
+    for searchable in SEARCHABLE_TYPES:
+        model = searchable.model
+        criteria = []
+        if user_id:
+            if hasattr(model, 'user_id'):
+                criteria.append(model.user_id == user_id)
+            else:
+                owned_motorcycle_ids = db.select(Motorcycle.id).where(Motorcycle.user_id == user_id)
+                criteria.append(model.motorcycle_id.in_(owned_motorcycle_ids))
+        counts[searchable.entity_type] = index_search_documents(model, *criteria)
+
+    return counts
@@ -0,0 +1,133 @@
+# motopuppu/utils/team_rankings.py
+"""
+チームダッシュボードのサーキット別ランキング (team_circuit_bests) を最新に保つ。
+
+活動ログ・セッションの登録・編集・削除はセッションの flush 時に自動で反映する。
+メンバーの参加・脱退はビュー側で refresh_team_circuit_bests(team_id=..., user_ids=[...]) を呼ぶこと。
+"""
+import sqlalchemy as sa
+from sqlalchemy.dialects.postgresql import insert as pg_insert
+from sqlalchemy.orm import Session
+
+from ..models import db, ActivityLog, Motorcycle, SessionLog, TeamCircuitBest, team_members
+
+# 変更されたときにランキングへ影響する列
+_ACTIVITY_RANKING_COLUMNS = ('user_id', 'circuit_name', 'share_with_teams')
+_SESSION_RANKING_COLUMNS = ('activity_log_id', 'best_lap_seconds')
+
+
+def _select_team_circuit_bests(user_ids=None, team_id=None):
+    """(チーム, メンバー, サーキット) ごとのベストラップを活動ログから集計する SELECT"""
+    query = sa.select(
+        team_members.c.team_id,
+        ActivityLog.user_id,
+        ActivityLog.circuit_name,
+        sa.func.min(SessionLog.best_lap_seconds).label('best_lap_seconds'),
+    ).select_from(ActivityLog).join(
+        SessionLog, SessionLog.activity_log_id == ActivityLog.id
+    ).join(
+        team_members, team_members.c.user_id == ActivityLog.user_id
+    ).where(
+        ActivityLog.circuit_name.isnot(None),
+        SessionLog.best_lap_seconds.isnot(None),
+        ActivityLog.share_with_teams == True,  # 公開設定のログのみ対象
+    ).group_by(
+        team_members.c.team_id, ActivityLog.user_id, ActivityLog.circuit_name
+    )
+    if user_ids is not None:
+        query = query.where(ActivityLog.user_id.in_(user_ids))
+    if team_id is not None:
+        query = query.where(team_members.c.team_id == team_id)
+    return query
+
+
+def refresh_team_circuit_bests(user_ids=None, team_id=None, connection=None):
+    """
+    指定範囲の集計を作り直す。
+    user_ids だけを指定するとそのユーザーが所属する全チーム分、team_id も指定するとそのチーム分だけを対象にする。
+    どちらも省略すると全件を作り直す。
+    """
+    if user_ids is not None and not user_ids:
+        return
+    if connection is None:
+        connection = db.session.connection()
+
+    table = TeamCircuitBest.__table__
+    source = _select_team_circuit_bests(user_ids=user_ids, team_id=team_id).subquery()
+
+    # 同じユーザーの集計が同時に更新されても主キーが衝突しないよう、DELETE → INSERT ではなく
+    # UPSERT してから集計元に無くなった行を削除する
+    insert_stmt = pg_insert(table).from_select(
+        ['team_id', 'user_id', 'circuit_name', 'best_lap_seconds'],
+        sa.select(source.c.team_id, source.c.user_id, source.c.circuit_name, source.c.best_lap_seconds),
+    )
+    connection.execute(insert_stmt.on_conflict_do_update(
+        index_elements=['team_id', 'user_id', 'circuit_name'],
+        set_={'best_lap_seconds': insert_stmt.excluded.best_lap_seconds, 'updated_at': sa.func.now()},
+        where=table.c.best_lap_seconds != insert_stmt.excluded.best_lap_seconds,
+    ))
+
+    delete_stmt = sa.delete(table).where(
+        sa.tuple_(table.c.team_id, table.c.user_id, table.c.circuit_name).not_in(
+            sa.select(source.c.team_id, source.c.user_id, source.c.circuit_name)
+        )
+    )
+    if user_ids is not None:
+        delete_stmt = delete_stmt.where(table.c.user_id.in_(user_ids))
+    if team_id is not None:
+        delete_stmt = delete_stmt.where(table.c.team_id == team_id)
+    connection.execute(delete_stmt)
+
+
+def _ranking_columns_changed(item, columns):
+    state = sa.inspect(item)
+    return any(state.attrs[column].history.has_changes() for column in columns)
+
+
+def _sync_team_circuit_bests(session, flush_context):
+    """flush された活動ログ・セッションの持ち主の集計を作り直す"""
+    user_ids = set()
+    activity_log_ids = set()
+
+    for item in session.new:
+        if isinstance(item, ActivityLog):
+            user_ids.add(item.user_id)
+        elif isinstance(item, SessionLog):
+            activity_log_ids.add(item.activity_log_id)
+    for item in session.dirty:
+        if isinstance(item, ActivityLog) and _ranking_columns_changed(item, _ACTIVITY_RANKING_COLUMNS):
+            user_ids.add(item.user_id)
+            # 活動ログの持ち主が変わった場合は元の持ち主も対象にする
+            user_ids.update(sa.inspect(item).attrs.user_id.history.deleted)
+        elif isinstance(item, SessionLog) and _ranking_columns_changed(item, _SESSION_RANKING_COLUMNS):
+            activity_log_ids.add(item.activity_log_id)
+            activity_log_ids.update(sa.inspect(item).attrs.activity_log_id.history.deleted)
+    for item in session.deleted:
+        if isinstance(item, (ActivityLog, Motorcycle)):
+            # 車両の削除では活動ログがDB側でまとめて削除されるため、持ち主ごと作り直す
+            user_ids.add(item.user_id)
+        elif isinstance(item, SessionLog):
+            activity_log_ids.add(item.activity_log_id)
+
+    activity_log_ids.discard(None)
+    connection = session.connection()
+    if activity_log_ids:
+        user_ids.update(connection.execute(
+            sa.select(ActivityLog.user_id).where(ActivityLog.id.in_(activity_log_ids))
+        ).scalars())
+    user_ids.discard(None)
+    if not user_ids:
+        return
+
+    # チームに所属していないユーザーは集計対象外なので、何もしない
+    member_user_ids = set(connection.execute(
+        sa.select(team_members.c.user_id).where(team_members.c.user_id.in_(user_ids)).distinct()
+    ).scalars())
+    if member_user_ids:
+        refresh_team_circuit_bests(user_ids=member_user_ids, connection=connection)
+
+
+def register_team_ranking_listeners():
+    """全セッションの flush に team_circuit_bests の同期処理を登録する (アプリ初期化時に1回呼ぶ)"""
+    if not sa.event.contains(Session, 'after_flush', _sync_team_circuit_bests):
+        sa.event.listen(Session, 'after_flush', _sync_team_circuit_bests)
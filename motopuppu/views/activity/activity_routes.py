@@ -10,10 +10,13 @@ from flask import (
     flash, redirect, render_template, request, url_for, abort, current_app, jsonify
 )
 from sqlalchemy.orm import joinedload, defer
-from sqlalchemy import func
+from sqlalchemy import func, union_all, literal_column, asc, desc
 
 from . import activity_bp
-from ...utils.lap_time_utils import calculate_lap_stats, parse_time_to_seconds, _calculate_and_set_best_lap, format_seconds_to_time
+from ...utils.lap_time_utils import (
+    calculate_lap_stats_from_seconds, get_session_lap_seconds,
+    _calculate_and_set_best_lap, format_seconds_to_time
+)
 from ...constants import SETTING_KEY_MAP
 
 from flask_login import login_required, current_user
@@ -22,6 +25,7 @@ from ...forms import ActivityLogForm, SessionLogForm, LapTimeImportForm
 from ... import limiter
 from ...utils.search_helpers import escape_like
 from ...utils.view_helpers import get_motorcycle_or_404
+from ...utils.pagination import SimplePagination
 
 # session_routes.py のRDP関数を遅延インポートで使用（循環インポート回避）
 def _get_rdp_func():
@@ -54,20 +58,15 @@ def activity_log():
     log_type = request.args.get('log_type', '')
 
     # --- 1. ActivityLog (走行ログ) のクエリ構築 ---
+    # ここではフィルタ条件のみを組み立て、オブジェクトの取得はページ分の確定後に行う
     activity_query = None
     if not log_type or log_type == 'activity':
-        activity_query = db.session.query(ActivityLog).options(
-            joinedload(ActivityLog.motorcycle)
-        ).filter(ActivityLog.user_id == current_user.id)
+        activity_query = db.session.query(ActivityLog).filter(ActivityLog.user_id == current_user.id)
 
     # --- 2. TouringLog (ツーリングログ) のクエリ構築 ---
     touring_query = None
     if not log_type or log_type == 'touring':
-        touring_query = db.session.query(TouringLog).options(
-            joinedload(TouringLog.motorcycle),
-            joinedload(TouringLog.spots),
-            joinedload(TouringLog.scrapbook_entries)
-        ).filter(TouringLog.user_id == current_user.id)
+        touring_query = db.session.query(TouringLog).filter(TouringLog.user_id == current_user.id)
 
     # --- 3. フィルタリングの適用 ---
     active_filters = {k: v for k, v in request.args.items() if k not in ['page', 'sort_by', 'order']}
@@ -127,15 +126,72 @@ def activity_log():
                 )
             )
 
-    # --- 4. データ取得と統合 ---
-    activities = activity_query.all() if activity_query else []
-    tourings = touring_query.all() if touring_query else []
+    # --- 4. DB側で UNION ALL し、ソート・ページネーションまで済ませる ---
+    # 両ログの (種別, ID, 日付, 車両ID) だけを統合するため、件数が増えてもページ表示のコストは一定
+    selects = []
+    if activity_query:
+        selects.append(activity_query.with_entities(
+            literal_column("'activity'").label('log_type'),
+            ActivityLog.id.label('log_id'),
+            ActivityLog.activity_date.label('log_date'),
+            ActivityLog.motorcycle_id.label('motorcycle_id')
+        ).statement)
+    if touring_query:
+        selects.append(touring_query.with_entities(
+            literal_column("'touring'").label('log_type'),
+            TouringLog.id.label('log_id'),
+            TouringLog.touring_date.label('log_date'),
+            TouringLog.motorcycle_id.label('motorcycle_id')
+        ).statement)
+    # 不明な log_type 指定時はどちらのクエリも構築されないため、空の結果として扱う
+    if not selects:
+        selects.append(db.session.query(ActivityLog).filter(db.false()).with_entities(
+            literal_column("'activity'").label('log_type'),
+            ActivityLog.id.label('log_id'),
+            ActivityLog.activity_date.label('log_date'),
+            ActivityLog.motorcycle_id.label('motorcycle_id')
+        ).statement)
+    merged_logs = union_all(*selects).subquery('merged_logs')
+
+    # 統計情報 (種別ごとの件数) は GROUP BY の1クエリで取得
+    type_counts = dict(
+        db.session.query(merged_logs.c.log_type, func.count())
+        .group_by(merged_logs.c.log_type).all()
+    )
+    activity_count = type_counts.get('activity', 0)
+    touring_count = type_counts.get('touring', 0)
+    summary_stats = {
+        'total_count': activity_count + touring_count,
+        'activity_count': activity_count,
+        'touring_count': touring_count
+    }
 
-    combined_logs = []
-    
-    # ActivityLogのベストラップを一括で取得 (N+1対策)
-    if activities:
-        activity_ids = [act.id for act in activities]
+    # デフォルトは日付降順。同順位の並びを安定させるため日付・種別・IDを後続キーにする
+    direction = desc if order == 'desc' else asc
+    page_query = db.session.query(merged_logs.c.log_type, merged_logs.c.log_id)
+    if sort_by == 'vehicle':
+        page_query = page_query.join(Motorcycle, Motorcycle.id == merged_logs.c.motorcycle_id)
+        page_query = page_query.order_by(direction(Motorcycle.name), direction(merged_logs.c.log_date))
+    else:
+        page_query = page_query.order_by(direction(merged_logs.c.log_date))
+    page = max(page, 1)
+    page_rows = page_query.order_by(
+        merged_logs.c.log_type, direction(merged_logs.c.log_id)
+    ).limit(per_page).offset((page - 1) * per_page).all()
+
+    # --- 5. ページ分のオブジェクトと付随情報のみを取得 ---
+    activity_ids = [row.log_id for row in page_rows if row.log_type == 'activity']
+    touring_ids = [row.log_id for row in page_rows if row.log_type == 'touring']
+
+    activities_map = {}
+    best_laps_map = {}
+    if activity_ids:
+        activities_map = {
+            act.id: act for act in ActivityLog.query.options(
+                joinedload(ActivityLog.motorcycle)
+            ).filter(ActivityLog.id.in_(activity_ids)).all()
+        }
+        # ActivityLogのベストラップを一括で取得 (N+1対策)
         best_laps_query = db.session.query(
             SessionLog.activity_log_id,
             db.func.min(SessionLog.best_lap_seconds).label('best_lap')
@@ -143,70 +199,70 @@ def activity_log():
             SessionLog.activity_log_id.in_(activity_ids),
             SessionLog.best_lap_seconds.isnot(None)
         ).group_by(SessionLog.activity_log_id).all()
-        
         best_laps_map = {row.activity_log_id: row.best_lap for row in best_laps_query}
-    else:
-        best_laps_map = {}
-
-    # ActivityLogを共通形式に変換
-    for act in activities:
-        best_lap_str = None
-        best_lap_seconds = best_laps_map.get(act.id)
-        if best_lap_seconds is not None:
-            best_lap_str = format_seconds_to_time(best_lap_seconds)
-
-        combined_logs.append({
-            'type': 'activity',
-            'obj': act,
-            'date': act.activity_date,
-            'title': act.activity_title or act.location_name_display or '走行ログ',
-            'vehicle': act.motorcycle,
-            'details': {
-                'location': act.location_name_display,
-                'best_lap': best_lap_str,
-                'weather': act.weather
-            }
-        })
 
-    # TouringLogを共通形式に変換
-    for tour in tourings:
-        combined_logs.append({
-            'type': 'touring',
-            'obj': tour,
-            'date': tour.touring_date,
-            'title': tour.title,
-            'vehicle': tour.motorcycle,
-            'details': {
-                'spot_count': len(tour.spots),
-                'scrapbook_count': len(tour.scrapbook_entries)
-            }
-        })
-
-    # --- 5. ソートとページネーション (Python側で処理) ---
-    # デフォルトは日付降順
-    reverse_sort = True if order == 'desc' else False
-    
-    if sort_by == 'date':
-        combined_logs.sort(key=lambda x: x['date'], reverse=reverse_sort)
-    elif sort_by == 'vehicle':
-        combined_logs.sort(key=lambda x: x['vehicle'].name, reverse=reverse_sort)
-    
-    # 統計情報の計算
-    summary_stats = {
-        'total_count': len(combined_logs),
-        'activity_count': len(activities),
-        'touring_count': len(tourings)
-    }
-
-    # ページネーション
-    total_items = len(combined_logs)
-    start_idx = (page - 1) * per_page
-    end_idx = start_idx + per_page
-    paginated_logs = combined_logs[start_idx:end_idx]
+    tourings_map = {}
+    spot_counts = {}
+    scrapbook_counts = {}
+    if touring_ids:
+        tourings_map = {
+            tour.id: tour for tour in TouringLog.query.options(
+                joinedload(TouringLog.motorcycle)
+            ).filter(TouringLog.id.in_(touring_ids)).all()
+        }
+        # スポット数・スクラップ数は関連行をロードせず COUNT で取得
+        spot_counts = dict(
+            db.session.query(TouringSpot.touring_log_id, func.count(TouringSpot.id))
+            .filter(TouringSpot.touring_log_id.in_(touring_ids))
+            .group_by(TouringSpot.touring_log_id).all()
+        )
+        scrapbook_counts = dict(
+            db.session.query(TouringScrapbookEntry.touring_log_id, func.count(TouringScrapbookEntry.id))
+            .filter(TouringScrapbookEntry.touring_log_id.in_(touring_ids))
+            .group_by(TouringScrapbookEntry.touring_log_id).all()
+        )
 
-    # 簡易的なページネーションオブジェクトを作成（テンプレート互換用）
-    from ...utils.pagination import SimplePagination
-    pagination = SimplePagination(page, per_page, total_items, paginated_logs)
+    # UNIONの並び順どおりに共通形式へ変換
+    paginated_logs = []
+    for row in page_rows:
+        if row.log_type == 'activity':
+            act = activities_map.get(row.log_id)
+            if act is None:
+                continue
+            best_lap_str = None
+            best_lap_seconds = best_laps_map.get(act.id)
+            if best_lap_seconds is not None:
+                best_lap_str = format_seconds_to_time(best_lap_seconds)
+
+            paginated_logs.append({
+                'type': 'activity',
+                'obj': act,
+                'date': act.activity_date,
+                'title': act.activity_title or act.location_name_display or '走行ログ',
+                'vehicle': act.motorcycle,
+                'details': {
+                    'location': act.location_name_display,
+                    'best_lap': best_lap_str,
+                    'weather': act.weather
+                }
+            })
+        else:
+            tour = tourings_map.get(row.log_id)
+            if tour is None:
+                continue
+            paginated_logs.append({
+                'type': 'touring',
+                'obj': tour,
+                'date': tour.touring_date,
+                'title': tour.title,
+                'vehicle': tour.motorcycle,
+                'details': {
+                    'spot_count': spot_counts.get(tour.id, 0),
+                    'scrapbook_count': scrapbook_counts.get(tour.id, 0)
+                }
+            })
+
+    pagination = SimplePagination(page, per_page, summary_stats['total_count'], paginated_logs)
 
     is_filter_active = bool(active_filters)
 
@@ -442,46 +498,39 @@ def detail_activity(activity_id):
         abort(403)
         
     motorcycle = activity.motorcycle
-    sessions = SessionLog.query.filter_by(activity_log_id=activity.id).order_by(SessionLog.id.asc()).all()
+    # gps_tracks はモデル側で遅延ロード (テンプレートは has_gps_data のみ参照)
+    sessions = SessionLog.query.options(
+        joinedload(SessionLog.setting_sheet).undefer(SettingSheet.details)
+    ).filter_by(activity_log_id=activity.id).order_by(SessionLog.id.asc()).all()
 
     sort_order = request.args.get('sort', 'record_asc')
 
     for session in sessions:
-        # 1. 既存のラップ統計計算
-        session.best_lap, session.average_lap, session.lap_details = calculate_lap_stats(session.lap_times, sort_by=sort_order)
-        
-        lap_seconds_for_chart = []
-        if session.lap_times and isinstance(session.lap_times, list):
-            for lap_str in session.lap_times:
-                sec = parse_time_to_seconds(lap_str)
-                if sec is not None and sec > 0:
-                    lap_seconds_for_chart.append(float(sec))
-        
-        # 2. 統計情報計算とヒートマップ用クラスの付与
+        # 1. 保存時に計算済みの数値ラップ配列 (lap_seconds) から表示用の統計を組み立てる
+        lap_seconds = get_session_lap_seconds(session)
+        session.best_lap, session.average_lap, session.lap_details = calculate_lap_stats_from_seconds(lap_seconds, sort_by=sort_order)
+
+        lap_seconds_for_chart = [float(s) for s in lap_seconds if s is not None and s > 0]
+
+        # 2. 統計情報とヒートマップ用クラスの付与
+        # median/worst はキャッシュ列を優先し、backfill前の古いレコードのみその場で計算する
         if lap_seconds_for_chart:
-            median_sec = statistics.median(lap_seconds_for_chart)
+            median_sec = float(session.median_lap_seconds) if session.median_lap_seconds is not None else statistics.median(lap_seconds_for_chart)
             worst_sec = max(lap_seconds_for_chart)
-            
-            session.median_lap_seconds = median_sec
-            session.worst_lap_seconds = worst_sec
-            
+
             if session.lap_details:
                 for detail in session.lap_details:
-                    sec = parse_time_to_seconds(detail['time_str'])
-                    if sec:
-                        sec = float(sec)
-                        detail['seconds'] = sec
-                        
-                        if detail.get('is_best'):
-                            detail['row_class'] = 'table-success fw-bold' 
-                        elif sec == worst_sec:
-                            detail['row_class'] = 'table-danger'          
-                        elif sec < median_sec:
-                            detail['row_class'] = 'table-info'            
-                        else:
-                            detail['row_class'] = 'table-warning'         
+                    sec = float(detail['seconds'])
+                    detail['seconds'] = sec
+
+                    if detail.get('is_best'):
+                        detail['row_class'] = 'table-success fw-bold' 
+                    elif sec == worst_sec:
+                        detail['row_class'] = 'table-danger'          
+                    elif sec < median_sec:
+                        detail['row_class'] = 'table-info'            
                     else:
-                        detail['row_class'] = ''
+                        detail['row_class'] = 'table-warning'         
 
             best_lap_seconds = min(lap_seconds_for_chart)
             lap_percentages = [(best_lap_seconds / sec) * 100 for sec in lap_seconds_for_chart]
@@ -492,8 +541,6 @@ def detail_activity(activity_id):
             }
         else:
             session.lap_chart_dict = None
-            session.median_lap_seconds = None
-            session.worst_lap_seconds = None
     
     session_form = SessionLogForm()
     import_form = LapTimeImportForm()
@@ -622,13 +669,14 @@ def public_gps_data(token):
     """【公開】共有セッションのGPSデータをJSONで返す"""
     session = SessionLog.query.options(
         joinedload(SessionLog.activity).joinedload(ActivityLog.motorcycle),
-        joinedload(SessionLog.setting_sheet)
+        joinedload(SessionLog.setting_sheet).undefer(SettingSheet.details)
     ).filter_by(
         public_share_token=str(token), 
         is_public=True
     ).first()
 
-    if not session or not session.gps_tracks or not session.gps_tracks.get('laps'):
+    # gps_tracks は遅延ロード列のため、has_gps_data で判定してから読み込む
+    if not session or not session.has_gps_data or not session.gps_tracks or not session.gps_tracks.get('laps'):
         return jsonify({'error': 'No GPS data available'}), 404
 
     motorcycle = session.activity.motorcycle
@@ -10,20 +10,20 @@ from flask import (
     flash, redirect, render_template, request, url_for, abort, current_app, jsonify,
     Response, stream_with_context
 )
-from sqlalchemy.orm import joinedload
+from sqlalchemy.orm import joinedload, defer
 from sqlalchemy import func
 
 # 分割したBlueprintとユーティリティをインポート
 from . import activity_bp
 from ...utils.lap_time_utils import (
-    calculate_lap_stats, parse_time_to_seconds, _calculate_and_set_best_lap,
+    compute_lap_statistics, _calculate_and_set_best_lap,
     is_valid_lap_time_format, filter_outlier_laps, format_seconds_to_time
 )
 from ...constants import SETTING_KEY_MAP
 
 from ...utils.view_helpers import get_motorcycle_or_404
 from flask_login import login_required, current_user
-from ...models import db, ActivityLog, SessionLog
+from ...models import db, ActivityLog, SessionLog, SettingSheet
 from ...forms import SessionLogForm, LapTimeImportForm
 from ...parsers import get_parser, PARSERS
 from ... import limiter
@@ -125,9 +125,18 @@ def _prepare_comparison_data(sessions):
     
     session_stats_raw = []
     for i, session in enumerate(sessions):
-        best_str, avg_str, _ = calculate_lap_stats(session.lap_times)
-        best_sec = parse_time_to_seconds(best_str)
-        avg_sec = parse_time_to_seconds(avg_str)
+        # 保存時に計算済みのラップ統計キャッシュを使い、backfill前の古いレコードのみその場で計算する
+        if session.lap_seconds is not None:
+            best_sec = session.best_lap_seconds
+            avg_sec = session.average_lap_seconds
+            lap_seconds = session.lap_seconds
+        else:
+            lap_stats = compute_lap_statistics(session.lap_times)
+            best_sec = lap_stats['best_lap_seconds']
+            avg_sec = lap_stats['average_lap_seconds']
+            lap_seconds = lap_stats['lap_seconds'] or []
+        best_str = format_seconds_to_time(best_sec) if best_sec is not None else "N/A"
+        avg_str = format_seconds_to_time(avg_sec) if avg_sec is not None else "N/A"
         session_stats_raw.append({
             'id': session.id,
             'best_str': best_str,
@@ -136,7 +145,7 @@ def _prepare_comparison_data(sessions):
             'avg_sec': avg_sec
         })
         
-        lap_seconds = [s for s in (parse_time_to_seconds(t) for t in session.lap_times or []) if s]
+        lap_seconds = [s for s in lap_seconds if s]
         if lap_seconds:
             max_laps = max(max_laps, len(lap_seconds))
             lap_analysis['chart_data']['datasets'].append({
@@ -247,7 +256,7 @@ def compare_sessions():
         return redirect(url_for('activity.list_activities', vehicle_id=vehicle_id))
     
     sessions = SessionLog.query.options(
-            joinedload(SessionLog.setting_sheet),
+            joinedload(SessionLog.setting_sheet).undefer(SettingSheet.details),
             joinedload(SessionLog.activity)
         ).filter(
             SessionLog.id.in_(session_ids),
@@ -287,9 +296,13 @@ def best_settings_finder(vehicle_id):
     best_session_ids_query = db.session.query(ranked_sessions_subq.c.id)\
                                      .filter(ranked_sessions_subq.c.rn == 1)
 
+    # 表示にはキャッシュ済みの best_lap_seconds のみを使うため、重いJSONB列は読み込まない
     best_sessions = SessionLog.query.options(
         joinedload(SessionLog.activity),
-        joinedload(SessionLog.setting_sheet)
+        joinedload(SessionLog.setting_sheet).undefer(SettingSheet.details),
+        defer(SessionLog.lap_times),
+        defer(SessionLog.lap_seconds),
+        defer(SessionLog.gps_tracks)
     ).join(
         ActivityLog, SessionLog.activity_log_id == ActivityLog.id
     ).filter(
@@ -310,7 +323,7 @@ def get_gps_data(session_id):
     session = SessionLog.query.options(
         joinedload(SessionLog.activity).joinedload(ActivityLog.user),
         joinedload(SessionLog.activity).joinedload(ActivityLog.motorcycle),
-        joinedload(SessionLog.setting_sheet)
+        joinedload(SessionLog.setting_sheet).undefer(SettingSheet.details)
     ).filter_by(id=session_id).first_or_404()
 
     is_owner = (session.activity.user_id == current_user.id)
@@ -325,7 +338,8 @@ def get_gps_data(session_id):
     if not is_owner and not is_team_member:
         abort(403)
 
-    if not session.gps_tracks or not session.gps_tracks.get('laps'):
+    # gps_tracks は遅延ロード列のため、権限確認と has_gps_data の判定後に読み込む
+    if not session.has_gps_data or not session.gps_tracks or not session.gps_tracks.get('laps'):
         return jsonify({'error': 'No GPS data available'}), 404
 
     motorcycle = session.activity.motorcycle
@@ -410,7 +424,6 @@ def edit_session(session_id):
     motorcycle = session.activity.motorcycle
     form = SessionLogForm(obj=session)
     
-    from ...models import SettingSheet
     setting_sheets = SettingSheet.query.filter_by(motorcycle_id=motorcycle.id, is_archived=False).order_by(SettingSheet.sheet_name).all()
     form.setting_sheet_id.choices = [(s.id, s.sheet_name) for s in setting_sheets]
     form.setting_sheet_id.choices.insert(0, (0, '--- セッティングなし ---'))
@@ -426,7 +439,7 @@ def edit_session(session_id):
         
         # ▼▼▼ 追加: GPSデータの同期処理 ▼▼▼
         lap_indices_json = request.form.get('lap_time_indices_json')
-        if lap_indices_json and session.gps_tracks and session.gps_tracks.get('laps'):
+        if lap_indices_json and session.has_gps_data and session.gps_tracks and session.gps_tracks.get('laps'):
             try:
                 lap_indices = json.loads(lap_indices_json)
                 current_gps_laps = {lap['lap_number']: lap for lap in session.gps_tracks['laps']}
@@ -447,9 +460,9 @@ def edit_session(session_id):
                             new_gps_laps.append(new_track_data)
                 
                 if new_gps_laps:
-                    session.gps_tracks = {'laps': new_gps_laps}
+                    session.set_gps_tracks({'laps': new_gps_laps})
                 else:
-                    session.gps_tracks = None
+                    session.set_gps_tracks(None)
                     
             except (json.JSONDecodeError, ValueError) as e:
                 current_app.logger.warning(f"Failed to sync GPS tracks: {e}")
@@ -654,7 +667,7 @@ def _import_laps_generator(
                 gps_tracks_dict[lap_num] = None
             gps_tracks_dict = None
 
-            session_obj.gps_tracks = {"laps": current_laps_list + new_laps_list}
+            session_obj.set_gps_tracks({"laps": current_laps_list + new_laps_list})
             current_times = session_obj.lap_times or []
             combined_lap_times = current_times + lap_times_list
             session_obj.lap_times = combined_lap_times
@@ -678,9 +691,9 @@ def _import_laps_generator(
                     optimized_points = _optimize_track_points(simplified_points)
                     laps_data_for_db.append({"lap_number": lap_num, "track": optimized_points})
                     gps_tracks_dict[lap_num] = None
-                session_obj.gps_tracks = {"laps": laps_data_for_db} if laps_data_for_db else None
+                session_obj.set_gps_tracks({"laps": laps_data_for_db} if laps_data_for_db else None)
             else:
-                session_obj.gps_tracks = None
+                session_obj.set_gps_tracks(None)
             gps_tracks_dict = None
             success_action = "インポート"
 
@@ -1,17 +1,23 @@
 # motopuppu/views/admin_schedule.py
 import json
+import time
 from datetime import date, datetime
 from flask import Blueprint, render_template, redirect, url_for, flash, request, current_app
 from flask_login import login_required
-from sqlalchemy import asc, desc
+from sqlalchemy import and_, asc, case, delete, desc, exists, func, or_, update
+from sqlalchemy.dialects.postgresql import insert as pg_insert
 from sqlalchemy.exc import IntegrityError
 
 from .. import db
 from ..models import TrackSchedule
 from ..forms import TrackScheduleForm, ScheduleImportForm, ScheduleImportConfirmForm
 from ..constants import CIRCUIT_METADATA
+from ..utils.csv_import import create_staging_table, iter_chunks
 from .auth import admin_required
 
+# プレビューに表示する「JSONに含まれない既存枠」の上限件数
+MAX_PREVIEW_MISSING_ROWS = 100
+
 admin_schedule_bp = Blueprint(
     'admin_schedule',
     __name__,
@@ -204,6 +210,161 @@ def _normalize_schedule_rows(data):
     return rows
 
 
+def _parse_schedule_row(row):
+    """正規化済みの1行を登録用の値に変換する。登録できない行は ValueError を送出する。"""
+    try:
+        circuit = (row.get('circuit_name') or '').strip()
+        title = (row.get('title') or '').strip()
+        d = datetime.strptime(row['date'], '%Y-%m-%d').date()
+        start_str = (row.get('start_time') or '').strip()
+        end_str = (row.get('end_time') or '').strip()
+        st = datetime.strptime(start_str, '%H:%M').time() if start_str else None
+        et = datetime.strptime(end_str, '%H:%M').time() if end_str else None
+        notes = (row.get('notes') or '').strip() or None
+    except (AttributeError, KeyError, ValueError, TypeError):
+        raise ValueError('日付・時刻の形式が不正です。')
+    if not circuit or not title:
+        raise ValueError('circuit_name / title が空です。')
+    return {
+        'circuit_name': circuit,
+        'date': d,
+        'start_time': st,
+        'end_time': et,
+        'title': title[:100],
+        'notes': notes[:200] if notes else None,
+    }
+
+
+def _stage_schedule_rows(rows, source_url):
+    """
+    登録できる行を一時テーブルへ投入する。一時テーブルはトランザクション終了時に破棄される。
+    同じ走行枠 (サーキット・日付・開始時刻・走行枠名) が JSON 内で重複している場合は後の行を採用する。
+
+    :return: (staging, staged_count, error_count, duplicate_count) のタプル
+    """
+    staged_by_slot = {}
+    error_count = 0
+    for row_num, row in enumerate(rows, start=1):
+        try:
+            staged_row = _parse_schedule_row(row) if isinstance(row, dict) else None
+        except ValueError:
+            staged_row = None
+        if staged_row is None:
+            error_count += 1
+            continue
+        staged_row['row_num'] = row_num
+        staged_row['source_url'] = source_url
+        slot = (staged_row['circuit_name'], staged_row['date'], staged_row['start_time'], staged_row['title'])
+        staged_by_slot.pop(slot, None)
+        staged_by_slot[slot] = staged_row
+    duplicate_count = len(rows) - error_count - len(staged_by_slot)
+
+    staging = create_staging_table(
+        'track_schedule_import_staging',
+        db.Column('row_num', db.Integer, primary_key=True),
+        db.Column('circuit_name', db.String(150), nullable=False),
+        db.Column('date', db.Date, nullable=False),
+        db.Column('start_time', db.Time),
+        db.Column('end_time', db.Time),
+        db.Column('title', db.String(100), nullable=False),
+        db.Column('notes', db.String(200)),
+        db.Column('source_url', db.String(2048)),
+    )
+    connection = db.session.connection()
+    for chunk in iter_chunks(staged_by_slot.values()):
+        connection.execute(staging.insert(), chunk)
+    return staging, len(staged_by_slot), error_count, duplicate_count
+
+
+def _slot_matches(staging):
+    """既存の走行枠と一時テーブルの行が同じ枠か (開始時刻が未設定の枠も一致させる)"""
+    return and_(
+        TrackSchedule.circuit_name == staging.c.circuit_name,
+        TrackSchedule.date == staging.c.date,
+        TrackSchedule.start_time.is_not_distinct_from(staging.c.start_time),
+        TrackSchedule.title == staging.c.title,
+    )
+
+
+def _slot_changed(staging):
+    """同じ枠のうち、取り込みで内容が変わるものか (source_url は指定がある場合のみ上書き)"""
+    return or_(
+        TrackSchedule.end_time.is_distinct_from(staging.c.end_time),
+        TrackSchedule.notes.is_distinct_from(staging.c.notes),
+        func.coalesce(staging.c.source_url, TrackSchedule.source_url).is_distinct_from(TrackSchedule.source_url),
+    )
+
+
+def _missing_schedules_condition(staging):
+    """取り込む (サーキット, 日付) に登録済みで、JSONに含まれない走行枠"""
+    return and_(
+        exists().where(
+            staging.c.circuit_name == TrackSchedule.circuit_name,
+            staging.c.date == TrackSchedule.date,
+        ),
+        ~exists().where(_slot_matches(staging)),
+    )
+
+
+def _diff_staged_schedules(staging):
+    """
+    一時テーブルと登録済みの走行枠を比較する。
+
+    :return: (行番号ごとの状態 {'insert' | 'update' | 'unchanged'}, JSONに含まれない既存枠の件数)
+    """
+    status = case(
+        (TrackSchedule.id.is_(None), 'insert'),
+        (_slot_changed(staging), 'update'),
+        else_='unchanged',
+    )
+    statuses = dict(db.session.execute(
+        db.select(staging.c.row_num, status).select_from(staging).outerjoin(TrackSchedule, _slot_matches(staging))
+    ).all())
+    missing_count = db.session.scalar(
+        db.select(func.count(TrackSchedule.id)).where(_missing_schedules_condition(staging))
+    )
+    return statuses, missing_count
+
+
+def _apply_staged_schedules(staging, delete_missing=False):
+    """一時テーブルの内容を走行枠へ反映する (削除 → 更新 → 追加 をそれぞれ1文で実行)"""
+    if delete_missing:
+        db.session.execute(
+            delete(TrackSchedule).where(_missing_schedules_condition(staging)),
+            execution_options={'synchronize_session': False}
+        )
+
+    # 開始時刻が未設定の枠は一意制約で衝突しないため、既存枠の更新は UPDATE ... FROM で行う
+    db.session.execute(
+        update(TrackSchedule).where(_slot_matches(staging), _slot_changed(staging)).values(
+            end_time=staging.c.end_time,
+            notes=staging.c.notes,
+            source_url=func.coalesce(staging.c.source_url, TrackSchedule.source_url),
+            updated_at=func.now(),
+        ),
+        execution_options={'synchronize_session': False}
+    )
+
+    insert_columns = ['circuit_name', 'date', 'start_time', 'end_time', 'title', 'notes', 'source_url']
+    stmt = pg_insert(TrackSchedule.__table__).from_select(
+        insert_columns,
+        db.select(*(staging.c[column] for column in insert_columns)).where(
+            ~exists().where(_slot_matches(staging))
+        ).order_by(staging.c.row_num)
+    )
+    # 同時に別の取り込みで登録された枠とぶつかった場合は、後から取り込んだ内容で上書きする
+    stmt = stmt.on_conflict_do_update(
+        constraint='uq_track_schedule',
+        set_={
+            'end_time': stmt.excluded.end_time,
+            'notes': stmt.excluded.notes,
+            'source_url': func.coalesce(stmt.excluded.source_url, TrackSchedule.__table__.c.source_url),
+            'updated_at': func.now(),
+        },
+    )
+    db.session.execute(stmt)
+
+
 @admin_schedule_bp.route('/import', methods=['GET', 'POST'])
 @login_required
 @admin_required
@@ -243,10 +404,36 @@ def import_schedules():
         confirm_form.payload.data = json.dumps(rows, ensure_ascii=False)
         confirm_form.source_url.data = (form.source_url.data or '').strip()
 
+        # 登録済みの走行枠との差分を一時テーブル上で計算する (プレビューなので反映はしない)
+        diff_summary = {'insert': 0, 'update': 0, 'unchanged': 0, 'missing': 0}
+        missing_schedules = []
+        try:
+            staging, _, _, _ = _stage_schedule_rows(rows, confirm_form.source_url.data or None)
+            statuses, diff_summary['missing'] = _diff_staged_schedules(staging)
+            for row_num, row_status in statuses.items():
+                rows[row_num - 1]['_status'] = row_status
+                diff_summary[row_status] += 1
+            if diff_summary['missing']:
+                # 直後に rollback するため、ORMオブジェクトではなく値として取得する
+                missing_schedules = db.session.execute(
+                    db.select(
+                        TrackSchedule.circuit_name, TrackSchedule.date, TrackSchedule.start_time,
+                        TrackSchedule.end_time, TrackSchedule.title
+                    ).where(_missing_schedules_condition(staging)).order_by(
+                        TrackSchedule.circuit_name, TrackSchedule.date, TrackSchedule.start_time
+                    ).limit(MAX_PREVIEW_MISSING_ROWS)
+                ).all()
+        except Exception as e:
+            current_app.logger.error(f"Error computing TrackSchedule import diff: {e}")
+        finally:
+            db.session.rollback()
+
         return render_template(
             'admin/schedule_import_preview.html',
             rows=rows,
             warning_count=warning_count,
+            diff_summary=diff_summary,
+            missing_schedules=missing_schedules,
             confirm_form=confirm_form
         )
 
@@ -269,45 +456,16 @@ def import_schedules_confirm():
         return redirect(url_for('admin_schedule.import_schedules'))
 
     source_url = (confirm_form.source_url.data or '').strip() or None
+    if not isinstance(rows, list):
+        flash('プレビューデータの読み込みに失敗しました。やり直してください。', 'danger')
+        return redirect(url_for('admin_schedule.import_schedules'))
 
-    created, skipped, error_count = 0, 0, 0
-
-    for row in rows:
-        try:
-            circuit = (row.get('circuit_name') or '').strip()
-            title = (row.get('title') or '').strip()
-            d = datetime.strptime(row['date'], '%Y-%m-%d').date()
-            start_str = (row.get('start_time') or '').strip()
-            end_str = (row.get('end_time') or '').strip()
-            st = datetime.strptime(start_str, '%H:%M').time() if start_str else None
-            et = datetime.strptime(end_str, '%H:%M').time() if end_str else None
-            notes = (row.get('notes') or '').strip() or None
-            if not circuit or not title:
-                raise ValueError('circuit_name / title が空です。')
-        except (KeyError, ValueError, TypeError):
-            error_count += 1
-            continue
-
-        # 重複チェック (ユニーク制約キー: circuit_name, date, start_time, title)
-        exists = TrackSchedule.query.filter_by(
-            circuit_name=circuit, date=d, start_time=st, title=title
-        ).first()
-        if exists:
-            skipped += 1
-            continue
-
-        db.session.add(TrackSchedule(
-            circuit_name=circuit,
-            date=d,
-            start_time=st,
-            end_time=et,
-            title=title,
-            notes=notes,
-            source_url=source_url,
-        ))
-        created += 1
-
+    # 一時テーブルに投入 → 差分を集計 → 削除・更新・追加を1トランザクションで反映
+    started_at = time.perf_counter()
     try:
+        staging, staged_count, error_count, duplicate_count = _stage_schedule_rows(rows, source_url)
+        statuses, missing_count = _diff_staged_schedules(staging)
+        _apply_staged_schedules(staging, delete_missing=confirm_form.delete_missing.data)
         db.session.commit()
     except IntegrityError:
         db.session.rollback()
@@ -319,7 +477,20 @@ def import_schedules_confirm():
         flash('一括登録中にエラーが発生しました。', 'danger')
         return redirect(url_for('admin_schedule.import_schedules'))
 
-    msg = f'{created}件の走行枠を登録しました。（重複スキップ {skipped}件）'
+    status_values = list(statuses.values())
+    created = status_values.count('insert')
+    updated = status_values.count('update')
+    unchanged = status_values.count('unchanged')
+    current_app.logger.info(
+        f"Imported {staged_count} track schedules (insert={created}, update={updated}, unchanged={unchanged}, "
+        f"deleted={missing_count if confirm_form.delete_missing.data else 0}) in {time.perf_counter() - started_at:.2f}s"
+    )
+
+    msg = f'{created}件の走行枠を登録し、{updated}件を更新しました。（変更なし {unchanged}件）'
+    if confirm_form.delete_missing.data and missing_count:
+        msg += f' / JSONに含まれない {missing_count}件を削除しました。'
+    if duplicate_count:
+        msg += f' / JSON内で重複した {duplicate_count}件は後の行を採用しました。'
     if error_count:
         msg += f' / 形式エラーで {error_count}件をスキップしました。'
     flash(msg, 'success')
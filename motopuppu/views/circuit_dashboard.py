@@ -482,12 +482,16 @@ def index():
         
     # 3. 総合サマリー情報を計算 — 全セッションの再ロードを避け、SQL集約で算出 (OOM対策)
     total_sessions = base_query.count()
+    # ラップ保存時に計算済みの valid_lap_count を合計し、TOASTされたJSONB列の展開を避ける
+    # キャッシュ未計算 (lap_seconds が NULL) の古いレコードは lap_times の要素数で代用する
+    lap_count_expr = case(
+        (SessionLog.lap_seconds.isnot(None), SessionLog.valid_lap_count),
+        (func.jsonb_typeof(SessionLog.lap_times) == 'array', func.jsonb_array_length(SessionLog.lap_times)),
+        else_=0
+    )
     total_laps = base_query.with_entities(
-        func.coalesce(
-            func.sum(func.jsonb_array_length(SessionLog.lap_times)),
-            0
-        )
-    ).filter(SessionLog.lap_times.isnot(None)).scalar() or 0
+        func.coalesce(func.sum(lap_count_expr), 0)
+    ).scalar() or 0
     total_laps = int(total_laps)
 
     # ▼▼▼【追加】ストリーク情報 (A-2) ▼▼▼
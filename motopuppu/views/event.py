@@ -1,15 +1,18 @@
 # motopuppu/views/event.py
 from flask import (
-    Blueprint, flash, redirect, render_template, request, url_for, abort, Response, current_app
+    Blueprint, flash, redirect, render_template, request, url_for, abort, Response, current_app, jsonify
 )
 from sqlalchemy.exc import IntegrityError
 from datetime import datetime, timezone, date
-from sqlalchemy import func
+from sqlalchemy import case, func, tuple_, update
+from sqlalchemy.orm import undefer
 from flask_login import login_required, current_user
 from wtforms.validators import Optional
 from ..models import db, Event, EventCollectionPlan, EventParticipant, Motorcycle, ParticipationStatus, PaymentStatus, User, Team, GeneralNote
 from ..forms import EventForm, ParticipantForm, WalkinParticipantForm
 from ..utils.datetime_helpers import JST
+from ..utils.event_roster import load_event_roster
+from ..utils.calendar_feed import get_calendar_feed, get_calendar_feed_etag, get_cached_feed_last_modified
 from .. import limiter
 
 # iCalenderライブラリのインポート
@@ -36,6 +39,8 @@ def _redirect_after_participant_update(event, participant_id=None):
 MAX_COLLECTION_PLANS = 20
 MAX_PLAN_NAME_LEN = 50
 MAX_PLAN_AMOUNT = 1_000_000
+# 当日モードの一括更新で1リクエストに含められる変更の上限
+MAX_DAY_CHANGES_PER_REQUEST = 200
 
 
 def _plans_from_request(form_data):
@@ -182,82 +187,83 @@ def events_index():
     now_utc = datetime.now(timezone.utc)
     now_utc_naive = now_utc.replace(tzinfo=None)
 
-    # 参加者数サブクエリ (公開一覧の表示で使用)
-    attending_count_subquery = db.session.query(
-        func.count(EventParticipant.id)
-    ).filter(
-        EventParticipant.event_id == Event.id,
-        EventParticipant.status == ParticipationStatus.ATTENDING
-    ).correlate(Event).as_scalar()
-
-    tentative_count_subquery = db.session.query(
-        func.count(EventParticipant.id)
-    ).filter(
-        EventParticipant.event_id == Event.id,
-        EventParticipant.status == ParticipationStatus.TENTATIVE
-    ).correlate(Event).as_scalar()
-
-    def build_base_query(target_view):
-        if target_view == 'owned':
-            return Event.query.filter(Event.user_id == current_user.id)
-        if target_view == 'attended':
-            attended_ids = db.session.query(EventParticipant.event_id).filter(
-                EventParticipant.user_id == current_user.id,
-                EventParticipant.status.in_([ParticipationStatus.ATTENDING, ParticipationStatus.TENTATIVE]),
-            )
-            return Event.query.filter(Event.id.in_(attended_ids))
-        return Event.query.filter(Event.is_public == True)
-
-    base_query = build_base_query(view)
+    # 自分が参加 (参加・未定) しているイベントID
+    attended_events = db.session.query(EventParticipant.event_id).filter(
+        EventParticipant.user_id == current_user.id,
+        EventParticipant.status.in_([ParticipationStatus.ATTENDING, ParticipationStatus.TENTATIVE]),
+    ).distinct().subquery()
 
+    view_conditions = {
+        'all': Event.is_public == True,
+        'owned': Event.user_id == current_user.id,
+        'attended': attended_events.c.event_id.isnot(None),
+    }
+    search_condition = None
     if search_query:
         like_pattern = f"%{search_query}%"
-        base_query = base_query.filter(
-            db.or_(
-                Event.title.ilike(like_pattern),
-                Event.location.ilike(like_pattern),
-            )
+        search_condition = db.or_(
+            Event.title.ilike(like_pattern),
+            Event.location.ilike(like_pattern),
         )
 
+    # ▼▼▼ 変更 ▼▼▼ タブ用件数は条件付き集計で1回のクエリにまとめる
+    # view タブ: 検索クエリは反映する・時期フィルタは反映しない / 時期タブ: 現在の view・検索クエリを反映
+    current_view_condition = view_conditions[view]
+    counts_query = db.session.query(
+        func.count(Event.id).filter(view_conditions['all']).label('all'),
+        func.count(Event.id).filter(view_conditions['owned']).label('owned'),
+        func.count(Event.id).filter(view_conditions['attended']).label('attended'),
+        func.count(Event.id).filter(
+            db.and_(current_view_condition, Event.start_datetime >= now_utc_naive)
+        ).label('upcoming'),
+        func.count(Event.id).filter(
+            db.and_(current_view_condition, Event.start_datetime < now_utc_naive)
+        ).label('past'),
+    ).select_from(Event).outerjoin(
+        attended_events, attended_events.c.event_id == Event.id
+    ).filter(db.or_(*view_conditions.values()))
+    if search_condition is not None:
+        counts_query = counts_query.filter(search_condition)
+    counts = counts_query.one()
+
+    upcoming_count = counts.upcoming
+    past_count = counts.past
+    total_count = upcoming_count + past_count
+    view_counts = {
+        'all': counts.all,
+        'owned': counts.owned,
+        'attended': counts.attended,
+    }
+
+    # 一覧本体。参加者数は events テーブルに保持している件数をそのまま使う
+    if view == 'attended':
+        base_query = Event.query.filter(Event.id.in_(db.select(attended_events.c.event_id)))
+    else:
+        base_query = Event.query.filter(current_view_condition)
+    if search_condition is not None:
+        base_query = base_query.filter(search_condition)
+
     events_query = base_query.options(
         db.joinedload(Event.owner).load_only(User.display_name, User.misskey_username, User.avatar_url)
     ).add_columns(
-        attending_count_subquery.label('attending_count'),
-        tentative_count_subquery.label('tentative_count'),
+        Event.attending_count,
+        Event.tentative_count,
     )
 
     if filter_type == 'upcoming':
         events_query = events_query.filter(Event.start_datetime >= now_utc_naive).order_by(Event.start_datetime.asc())
+        filtered_count = upcoming_count
     elif filter_type == 'past':
         events_query = events_query.filter(Event.start_datetime < now_utc_naive).order_by(Event.start_datetime.desc())
+        filtered_count = past_count
     else:
         events_query = events_query.order_by(Event.start_datetime.desc())
+        filtered_count = total_count
 
-    events_pagination = events_query.paginate(page=page, per_page=50, error_out=False)
-
-    # 時期タブ用件数 (現在のview・検索クエリを反映)
-    upcoming_count = base_query.filter(Event.start_datetime >= now_utc_naive).count()
-    past_count = base_query.filter(Event.start_datetime < now_utc_naive).count()
-    total_count = upcoming_count + past_count
-
-    # viewタブ用件数 (検索クエリは反映する・時期フィルタは反映しない)
-    def build_count_query(target_view):
-        q = build_base_query(target_view)
-        if search_query:
-            like_pattern = f"%{search_query}%"
-            q = q.filter(
-                db.or_(
-                    Event.title.ilike(like_pattern),
-                    Event.location.ilike(like_pattern),
-                )
-            )
-        return q
-
-    view_counts = {
-        'all': build_count_query('all').count(),
-        'owned': build_count_query('owned').count(),
-        'attended': build_count_query('attended').count(),
-    }
+    # 件数は上の集計で分かっているので、ページネーション用の COUNT クエリは発行しない
+    events_pagination = events_query.paginate(page=page, per_page=50, error_out=False, count=False)
+    events_pagination.total = filtered_count
+    # ▲▲▲ 変更ここまで ▲▲▲
 
     # 月ごとにグループ化 (JST基準)
     events_grouped = []
@@ -316,27 +322,12 @@ def public_events_list():
     if len(search_query) > 100:
         search_query = search_query[:100]
 
-    # 参加者数をステータス別にカウントする相関サブクエリを作成
-    attending_count_subquery = db.session.query(
-        func.count(EventParticipant.id)
-    ).filter(
-        EventParticipant.event_id == Event.id,
-        EventParticipant.status == ParticipationStatus.ATTENDING
-    ).correlate(Event).as_scalar()
-
-    tentative_count_subquery = db.session.query(
-        func.count(EventParticipant.id)
-    ).filter(
-        EventParticipant.event_id == Event.id,
-        EventParticipant.status == ParticipationStatus.TENTATIVE
-    ).correlate(Event).as_scalar()
-
     # メインクエリ (公開イベントのみ)
     events_query = Event.query.options(
         db.joinedload(Event.owner).load_only(User.display_name, User.misskey_username, User.avatar_url)
     ).add_columns(
-        attending_count_subquery.label('attending_count'),
-        tentative_count_subquery.label('tentative_count')
+        Event.attending_count,
+        Event.tentative_count
     ).filter(Event.is_public == True)
 
     # 開催時期フィルタ
@@ -357,22 +348,26 @@ def public_events_list():
             )
         )
 
-    events_pagination = events_query.paginate(page=page, per_page=15, error_out=False)
-
-    # タブ用件数 (検索クエリも反映する)
-    count_base = Event.query.filter(Event.is_public == True)
+    # タブ用件数 (検索クエリも反映する)。開催予定・過去を1回の条件付き集計で数える
+    count_query = db.session.query(
+        func.count(Event.id).filter(Event.start_datetime >= now_utc).label('upcoming'),
+        func.count(Event.id).filter(Event.start_datetime < now_utc).label('past'),
+    ).filter(Event.is_public == True)
     if search_query:
         like_pattern = f"%{search_query}%"
-        count_base = count_base.filter(
+        count_query = count_query.filter(
             db.or_(
                 Event.title.ilike(like_pattern),
                 Event.location.ilike(like_pattern),
             )
         )
-    upcoming_count = count_base.filter(Event.start_datetime >= now_utc).count()
-    past_count = count_base.filter(Event.start_datetime < now_utc).count()
+    upcoming_count, past_count = count_query.one()
     total_count = upcoming_count + past_count
 
+    # 件数は集計済みなので、ページネーション用の COUNT クエリは発行しない
+    events_pagination = events_query.paginate(page=page, per_page=15, error_out=False, count=False)
+    events_pagination.total = {'upcoming': upcoming_count, 'past': past_count}.get(filter_type, total_count)
+
     return render_template(
         'event/public_list_events.html',
         events_pagination=events_pagination,
@@ -414,13 +409,16 @@ def list_events():
     else:
         events_query = base_query.order_by(Event.start_datetime.desc())
 
-    events_pagination = events_query.paginate(page=page, per_page=10, error_out=False)
-
-    # タブ用件数
-    upcoming_count = Event.query.filter_by(user_id=current_user.id).filter(Event.start_datetime >= now_utc_naive).count()
-    past_count = Event.query.filter_by(user_id=current_user.id).filter(Event.start_datetime < now_utc_naive).count()
+    # タブ用件数 (開催予定・過去を1回の条件付き集計で数える)
+    upcoming_count, past_count = db.session.query(
+        func.count(Event.id).filter(Event.start_datetime >= now_utc_naive),
+        func.count(Event.id).filter(Event.start_datetime < now_utc_naive),
+    ).filter(Event.user_id == current_user.id).one()
     total_count = upcoming_count + past_count
 
+    events_pagination = events_query.paginate(page=page, per_page=10, error_out=False, count=False)
+    events_pagination.total = {'upcoming': upcoming_count, 'past': past_count}.get(filter_type, total_count)
+
     return render_template(
         'event/list_events.html',
         events_pagination=events_pagination,
@@ -443,7 +441,7 @@ def add_event():
     if team_id:
         target_team = Team.query.get_or_404(team_id)
         # 自分がメンバーでないチームのイベントは作れない
-        if current_user not in target_team.members:
+        if not target_team.has_member(current_user.id):
             abort(403)
     # ▲▲▲【追加】▲▲▲
 
@@ -612,27 +610,27 @@ def event_detail(event_id):
         is_authorized = True
     elif event.team_id:
         # イベントが属するチームに、現在のユーザーが含まれているか確認
-        if event.team.members.filter(User.id == current_user.id).count() > 0:
+        if event.team.has_member(current_user.id):
             is_authorized = True
     
     if not is_authorized:
         abort(403) # 権限なし
     # ▲▲▲【追加】▲▲▲
     
-    participants_attending = event.participants.filter_by(status=ParticipationStatus.ATTENDING).order_by(EventParticipant.created_at).all()
-    participants_tentative = event.participants.filter_by(status=ParticipationStatus.TENTATIVE).order_by(EventParticipant.created_at).all()
-    participants_not_attending = event.participants.filter_by(status=ParticipationStatus.NOT_ATTENDING).order_by(EventParticipant.created_at).all()
+    # 参加者 (ユーザー・料金プラン込み) と料金プランをまとめて取得し、ステータス別に振り分ける
+    roster = load_event_roster(event)
+    participants_attending = roster.attending
+    participants_tentative = roster.tentative
+    participants_not_attending = roster.not_attending
 
     # イベントに紐付いた準備ノートを取得
     is_owner = (event.user_id == current_user.id)
     event_notes = []
     if is_owner:
-        event_notes = event.notes.all()
+        event_notes = event.notes.options(undefer(GeneralNote.todos)).all()
 
     # 料金プラン一覧 (集金有効時のみ意味を持つ)
-    collection_plans = []
-    if event.collection_enabled:
-        collection_plans = event.collection_plans.order_by(EventCollectionPlan.sort_order, EventCollectionPlan.id).all()
+    collection_plans = roster.plans
 
     # 集金集計（主催者のみ・集金有効時のみ意味を持つ）
     collection_summary = None
@@ -736,14 +734,11 @@ def day_view(event_id):
     event = Event.query.filter_by(id=event_id, user_id=current_user.id).first_or_404()
 
     # 表示対象: 参加 + 保留 (不参加は飛ばす)
-    participants = event.participants.filter(
-        EventParticipant.status.in_([ParticipationStatus.ATTENDING, ParticipationStatus.TENTATIVE])
-    ).order_by(EventParticipant.created_at).all()
+    roster = load_event_roster(event)
+    participants = roster.active
 
     # 料金プラン
-    collection_plans = []
-    if event.collection_enabled:
-        collection_plans = event.collection_plans.order_by(EventCollectionPlan.sort_order, EventCollectionPlan.id).all()
+    collection_plans = roster.plans
 
     # 集計
     total_count = len(participants)
@@ -789,6 +784,7 @@ def day_view(event_id):
         collection_plans=collection_plans,
         day_summary=day_summary,
         walkin_form=walkin_form,
+        max_changes_per_request=MAX_DAY_CHANGES_PER_REQUEST,
         PaymentStatus=PaymentStatus,
     )
 
@@ -874,6 +870,7 @@ def add_walkin_participant(event_id):
             collection_plan_id=selected_plan_id if event.collection_enabled else None,
         )
         db.session.add(new_participant)
+        event.refresh_participant_counts()
         db.session.commit()
         flash(f'飛び入り参加者「{name}」さんを追加・チェックインしました。', 'success')
     except IntegrityError:
@@ -962,6 +959,7 @@ def public_event_view(public_id):
                     elif target_participant.check_passcode(claim_passcode):
                         # ▼▼▼【変更】認証成功：過去のデータを削除して、新規登録フローへ流す ▼▼▼
                         db.session.delete(target_participant)
+                        event.refresh_participant_counts()
                         db.session.commit()
                         flash(f'過去のゲスト参加データ（{claim_name}）を削除し、このアカウントで紐付け登録しました。', 'success')
                         # ここでreturnせず、下の「通常のログイン参加処理」へ進むことで、
@@ -980,6 +978,7 @@ def public_event_view(public_id):
             if status == 'delete':
                 if participant:
                     db.session.delete(participant)
+                    event.refresh_participant_counts()
                     db.session.commit()
                     flash('参加登録を取り消しました。', 'info')
                 else:
@@ -1021,6 +1020,7 @@ def public_event_view(public_id):
                     if not (claim_name and claim_passcode):
                          flash('イベントに参加登録しました。', 'success')
                 
+                event.refresh_participant_counts()
                 db.session.commit()
 
         # --- B. 未ログイン(ゲスト)の処理 ---
@@ -1073,6 +1073,7 @@ def public_event_view(public_id):
                     db.session.add(new_participant)
                     flash(f'「{participant_name}」さんの出欠を登録しました。', 'success')
                 
+                event.refresh_participant_counts()
                 db.session.commit()
             except IntegrityError:
                 db.session.rollback()
@@ -1084,10 +1085,11 @@ def public_event_view(public_id):
 
         return redirect(url_for('event.public_event_view', public_id=public_id))
 
-    # 表示用データの取得
-    participants_attending = event.participants.filter_by(status=ParticipationStatus.ATTENDING).order_by(EventParticipant.created_at).all()
-    participants_tentative = event.participants.filter_by(status=ParticipationStatus.TENTATIVE).order_by(EventParticipant.created_at).all()
-    participants_not_attending = event.participants.filter_by(status=ParticipationStatus.NOT_ATTENDING).order_by(EventParticipant.created_at).all()
+    # 表示用データの取得 (料金プランは上で取得済みなので参加者のみ)
+    roster = load_event_roster(event, include_plans=False)
+    participants_attending = roster.attending
+    participants_tentative = roster.tentative
+    participants_not_attending = roster.not_attending
 
     return render_template(
         'event/public_event_view.html',
@@ -1191,17 +1193,24 @@ def bulk_update_payments(event_id):
     action = request.form.get('action')
     target_statuses = [ParticipationStatus.ATTENDING, ParticipationStatus.TENTATIVE]
 
+    if action != 'reset_unpaid':
+        flash('不正な操作です。', 'danger')
+        return _redirect_after_participant_update(event)
+
     try:
-        participants = event.participants.filter(EventParticipant.status.in_(target_statuses)).all()
-        if action == 'reset_unpaid':
-            for p in participants:
-                p.payment_status = PaymentStatus.UNPAID
-                p.paid_at = None
-            flash('支払い状況をすべて「未払い」にリセットしました。', 'info')
-        else:
-            flash('不正な操作です。', 'danger')
-            return _redirect_after_participant_update(event)
+        # 参加者を読み込まずに1回の UPDATE で反映する
+        db.session.execute(
+            update(EventParticipant).where(
+                EventParticipant.event_id == event.id,
+                EventParticipant.status.in_(target_statuses),
+            ).values(
+                payment_status=PaymentStatus.UNPAID,
+                paid_at=None,
+                row_version=EventParticipant.row_version + 1,
+            ).execution_options(synchronize_session=False)
+        )
         db.session.commit()
+        flash('支払い状況をすべて「未払い」にリセットしました。', 'info')
     except Exception as e:
         db.session.rollback()
         current_app.logger.error(f"Error bulk updating payments for event {event_id}: {e}", exc_info=True)
@@ -1210,6 +1219,118 @@ def bulk_update_payments(event_id):
     return _redirect_after_participant_update(event)
 
 
+def _day_participant_state(row):
+    """当日モードのカードを再描画するための参加者の状態を dict にする"""
+    checked_in_at = row.checked_in_at
+    return {
+        'id': row.id,
+        'version': row.row_version,
+        'checked_in': checked_in_at is not None,
+        'checked_in_time': checked_in_at.replace(tzinfo=timezone.utc).astimezone(JST).strftime('%H:%M') if checked_in_at else None,
+        'payment_status': row.payment_status.value,
+    }
+
+
+@event_bp.route('/<int:event_id>/day/changes', methods=['POST'])
+@limiter.limit("1200 per hour")
+@login_required
+def apply_day_changes(event_id):
+    """
+    当日モードのチェックイン・支払い変更をまとめて反映する (JSON API)。
+
+    リクエスト: {"changes": [{"id": 参加者ID, "version": 画面表示時のバージョン,
+                              "checked_in": true/false (任意), "payment_status": "paid" など (任意)}, ...]}
+    すべての変更を1回の UPDATE で適用し、バージョンが一致しない参加者は更新せず conflicts として現在の状態を返す。
+    """
+    event = Event.query.filter_by(id=event_id, user_id=current_user.id).first_or_404()
+
+    data = request.get_json(silent=True)
+    changes = data.get('changes') if isinstance(data, dict) else None
+    if not isinstance(changes, list) or not changes:
+        return jsonify({'status': 'error', 'message': '変更内容がありません。'}), 400
+    if len(changes) > MAX_DAY_CHANGES_PER_REQUEST:
+        return jsonify({'status': 'error', 'message': f'一度に送信できる変更は{MAX_DAY_CHANGES_PER_REQUEST}件までです。'}), 400
+
+    # 同じ参加者への変更が複数あれば後のものを優先してまとめる
+    merged = {}
+    try:
+        for change in changes:
+            participant_id = int(change['id'])
+            version = int(change['version'])
+            entry = merged.setdefault(participant_id, {'version': version})
+            if 'checked_in' in change:
+                entry['checked_in'] = bool(change['checked_in'])
+            if 'payment_status' in change:
+                if not event.collection_enabled:
+                    return jsonify({'status': 'error', 'message': 'このイベントは集金が有効ではありません。'}), 400
+                entry['payment_status'] = PaymentStatus(change['payment_status'])
+    except (KeyError, TypeError, ValueError):
+        return jsonify({'status': 'error', 'message': '不正な変更内容です。'}), 400
+
+    now_naive = datetime.now(timezone.utc).replace(tzinfo=None)
+    checkin_whens = []
+    payment_whens = []
+    paid_at_whens = []
+    for participant_id, entry in merged.items():
+        is_target = EventParticipant.id == participant_id
+        if 'checked_in' in entry:
+            checkin_whens.append((is_target, db.literal(now_naive, db.DateTime) if entry['checked_in'] else db.null()))
+        if 'payment_status' in entry:
+            new_status = entry['payment_status']
+            payment_whens.append((is_target, db.literal(new_status, EventParticipant.payment_status.type)))
+            paid_at_whens.append((is_target, db.literal(now_naive, db.DateTime) if new_status == PaymentStatus.PAID else db.null()))
+
+    values = {'row_version': EventParticipant.row_version + 1}
+    if checkin_whens:
+        values['checked_in_at'] = case(*checkin_whens, else_=EventParticipant.checked_in_at)
+    if payment_whens:
+        values['payment_status'] = case(*payment_whens, else_=EventParticipant.payment_status)
+        values['paid_at'] = case(*paid_at_whens, else_=EventParticipant.paid_at)
+
+    state_columns = (
+        EventParticipant.id,
+        EventParticipant.row_version,
+        EventParticipant.checked_in_at,
+        EventParticipant.payment_status,
+    )
+
+    try:
+        # バージョンが一致する行だけを1回の UPDATE で更新し、更新後の状態を RETURNING で受け取る
+        updated_rows = db.session.execute(
+            update(EventParticipant).where(
+                EventParticipant.event_id == event.id,
+                tuple_(EventParticipant.id, EventParticipant.row_version).in_(
+                    [(participant_id, entry['version']) for participant_id, entry in merged.items()]
+                ),
+            ).values(**values).returning(*state_columns).execution_options(synchronize_session=False)
+        ).all()
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error applying day changes for event {event_id}: {e}", exc_info=True)
+        return jsonify({'status': 'error', 'message': '更新中にエラーが発生しました。'}), 500
+
+    updated_ids = {row.id for row in updated_rows}
+    conflict_ids = [participant_id for participant_id in merged if participant_id not in updated_ids]
+    conflict_rows = []
+    if conflict_ids:
+        # 他の端末で先に更新された参加者は、現在の状態を返して画面側で上書きさせる
+        conflict_rows = db.session.execute(
+            db.select(*state_columns).where(
+                EventParticipant.event_id == event.id,
+                EventParticipant.id.in_(conflict_ids),
+            )
+        ).all()
+    found_ids = {row.id for row in conflict_rows}
+
+    return jsonify({
+        'status': 'success',
+        'updated': [_day_participant_state(row) for row in updated_rows],
+        'conflicts': [_day_participant_state(row) for row in conflict_rows],
+        'missing': [participant_id for participant_id in conflict_ids if participant_id not in found_ids],
+    })
+
+
 @event_bp.route('/participant/<int:participant_id>/delete', methods=['POST'])
 @limiter.limit("30 per hour")
 @login_required
@@ -1223,6 +1344,7 @@ def delete_participant(participant_id):
         
     try:
         db.session.delete(participant)
+        event.refresh_participant_counts()
         db.session.commit()
         flash(f'参加者「{participant.name}」を削除しました。', 'info')
     except Exception as e:
@@ -1275,3 +1397,40 @@ def export_ics(event_id):
         headers={'Content-Disposition': f'attachment; filename="{filename}"'}
     )
 
+
+@event_bp.route('/feed/<token>.ics')
+# カレンダーサービスは少数のIPから多数のユーザー分を取得するため、IPではなくトークン単位で制限する
+@limiter.limit("30 per minute", key_func=lambda: request.view_args.get('token', ''))
+def calendar_feed(token):
+    """
+    ユーザーごとの購読用カレンダーフィード (ログイン不要・URLのトークンで本人を識別)。
+    内容の指紋を ETag にしているので、変化が無ければフィードを作らずに 304 を返す。
+    """
+    if not ICALENDAR_AVAILABLE:
+        abort(404)
+    user = User.query.filter_by(calendar_feed_token=token).first_or_404()
+
+    precomputed = get_calendar_feed_etag(user)
+    etag = precomputed[0]
+    last_modified = get_cached_feed_last_modified(user.id, etag)
+
+    if request.if_none_match:
+        not_modified = etag in request.if_none_match
+    else:
+        not_modified = (
+            last_modified is not None
+            and request.if_modified_since is not None
+            and request.if_modified_since >= last_modified
+        )
+
+    if not_modified:
+        response = Response(status=304)
+    else:
+        payload, etag, last_modified = get_calendar_feed(user, precomputed=precomputed)
+        response = Response(payload, mimetype='text/calendar')
+        response.headers['Content-Disposition'] = 'inline; filename="motopuppu.ics"'
+    response.set_etag(etag)
+    if last_modified is not None:
+        response.last_modified = last_modified
+    response.headers['Cache-Control'] = 'private, max-age=900'
+    return response
@@ -1,12 +1,16 @@
 # motopuppu/views/fuel.py
 import csv
+import hashlib
 import io
+import math
 from datetime import date, datetime
 import os
+import time
 import requests
 
 from flask import (
-    Blueprint, flash, redirect, render_template, request, url_for, abort, current_app, Response, jsonify
+    Blueprint, flash, redirect, render_template, request, url_for, abort, current_app, Response, jsonify,
+    stream_with_context
 )
 from sqlalchemy import or_, asc, desc, func, and_, case
 from sqlalchemy.orm import joinedload
@@ -19,15 +23,65 @@ from ..achievement_evaluator import check_achievements_for_event, EVENT_ADD_FUEL
 from .. import limiter
 from ..utils.receipt_parser import parse_receipt_image
 from ..utils.search_helpers import escape_like
+from ..utils.pagination import keyset_paginate
+from ..utils.chart_downsampling import lttb_indices
+from ..utils.csv_export import CSV_EXPORT_FLUSH_ROWS, iter_csv
+from ..utils.csv_import import (
+    CSV_IMPORT_CHUNK_SIZE, ImportMessages, open_csv_records, iter_chunks,
+    build_odo_offset_lookup, create_staging_table
+)
 from ..utils.image_security import strip_exif
+from ..utils.search_index import index_search_documents
 
 
 fuel_bp = Blueprint('fuel', __name__, url_prefix='/fuel')
 
+_TRUE_STRINGS = ['true', '1', 'yes', 'はい', 't']
+
+
+def _parse_fuel_csv_row(row_data, offset_at):
+    """CSVの1行を検証し、一時テーブルへ投入する辞書に変換する。不正な値は ValueError を送出する。"""
+    try:
+        entry_date = date.fromisoformat(row_data.get('entry_date', '').strip())
+        odometer_reading = int(row_data.get('odometer_reading', '').strip())
+    except (ValueError, TypeError):
+        raise ValueError("日付またはODOメーターの形式が正しくありません。")
+
+    try:
+        fuel_volume = float(row_data.get('fuel_volume', '').strip())
+        price_per_liter = float(row_data.get('price_per_liter', '').strip()) if row_data.get('price_per_liter', '').strip() else None
+        total_cost = int(row_data.get('total_cost', '').strip()) if row_data.get('total_cost', '').strip() else None
+    except (ValueError, TypeError):
+        raise ValueError("給油量・単価・合計金額の形式が正しくありません。")
+
+    if total_cost is None and price_per_liter is not None:
+        total_cost = round(price_per_liter * fuel_volume)
+
+    is_full_tank = row_data.get('is_full_tank', 'true').strip().lower() in _TRUE_STRINGS
+    # 平均除外は満タン記録にのみ意味を持つため、非満タンでは強制Falseにする
+    exclude_from_average = is_full_tank and (row_data.get('exclude_from_average', 'false').strip().lower() in _TRUE_STRINGS)
+
+    return {
+        'entry_date': entry_date,
+        'odometer_reading': odometer_reading,
+        'total_distance': odometer_reading + offset_at(entry_date),
+        'fuel_volume': fuel_volume,
+        'price_per_liter': price_per_liter,
+        'total_cost': total_cost,
+        'station_name': row_data.get('station_name', '').strip() or None,
+        'fuel_type': row_data.get('fuel_type', '').strip() or None,
+        'notes': row_data.get('notes', '').strip() or None,
+        'is_full_tank': is_full_tank,
+        'exclude_from_average': exclude_from_average,
+    }
+
+
 def _process_fuel_csv_import(file_stream, motorcycle: Motorcycle):
     """
     アップロードされたCSVファイルを解析し、給油記録をデータベースに登録する。
-    重複チェック（ドライラン）と本実行の2段階で行う。
+    ファイルは一定行数ずつ読み出して一時テーブルへ投入し、
+    重複チェック（既存記録との結合）と本登録（INSERT ... SELECT）をそれぞれ1回のSQLで行う。
+    エラーや重複が1件でもあれば何も登録しない。
 
     Args:
         file_stream: アップロードされたCSVファイルのストリーム。
@@ -37,120 +91,105 @@ def _process_fuel_csv_import(file_stream, motorcycle: Motorcycle):
         (int, list, list): (成功した件数, エラーメッセージのリスト, 重複データのリスト) のタプル。
     """
     required_headers = {'entry_date', 'odometer_reading', 'fuel_volume'}
-    errors = []
-    duplicates = []
-    
+    errors = ImportMessages()
+    started_at = time.perf_counter()
+
     try:
         wrapper = io.TextIOWrapper(file_stream, encoding='utf-8-sig')
-        # 全ての行を一度に読み込む
-        all_rows = list(csv.reader(wrapper))
-
-        # --- ヘッダーの特定と検証 ---
-        header_row_index = -1
-        for i, row in enumerate(all_rows):
-            if row and not row[0].strip().startswith('#'):
-                header_row_index = i
-                break
-        
-        if header_row_index == -1:
-            errors.append("CSVファイルにヘッダー行が見つかりませんでした。")
-            return 0, errors, []
-
-        header = [h.strip().lower() for h in all_rows[header_row_index]]
-        if not required_headers.issubset(set(header)):
-            missing = required_headers - set(header)
-            errors.append(f"CSVファイルのヘッダーに必須項目がありません: {', '.join(missing)}")
-            return 0, errors, []
-
-        # --- 1. ドライラン（事前チェック）ステージ ---
-        valid_rows_to_check = []
-        for row_num, row in enumerate(all_rows[header_row_index + 1:], start=header_row_index + 2):
-            if not row or (row and row[0].strip().startswith('#')):
-                continue
-            
-            try:
-                row_data = dict(zip(header, row))
-                entry_date = date.fromisoformat(row_data.get('entry_date', '').strip())
-                odometer_reading = int(row_data.get('odometer_reading', '').strip())
-                valid_rows_to_check.append({'date': entry_date, 'odo': odometer_reading, 'row_num': row_num})
-            except (ValueError, TypeError):
-                errors.append(f"{row_num}行目: 日付またはODOメーターの形式が正しくありません。")
-
-        if errors:
-            return 0, errors, []
-
-        # --- データベースで既存レコードを一括クエリ ---
-        if valid_rows_to_check:
-            conditions = [
-                and_(FuelEntry.motorcycle_id == motorcycle.id, FuelEntry.entry_date == item['date'], FuelEntry.odometer_reading == item['odo'])
-                for item in valid_rows_to_check
-            ]
-            existing_records_query = FuelEntry.query.filter(or_(*conditions)).with_entities(FuelEntry.entry_date, FuelEntry.odometer_reading)
-            existing_keys = {(rec.entry_date, rec.odometer_reading) for rec in existing_records_query.all()}
-            
-            for item in valid_rows_to_check:
-                if (item['date'], item['odo']) in existing_keys:
-                    duplicates.append(f"{item['row_num']}行目 (日付: {item['date']}, ODO: {item['odo']}km)")
+        records, header_error = open_csv_records(wrapper, required_headers)
+        if header_error:
+            return 0, [header_error], []
+
+        offset_at = build_odo_offset_lookup(motorcycle)
+        staging = create_staging_table(
+            'fuel_import_staging',
+            db.Column('row_num', db.Integer, primary_key=True),
+            db.Column('entry_date', db.Date, nullable=False),
+            db.Column('odometer_reading', db.Integer, nullable=False),
+            db.Column('total_distance', db.Integer, nullable=False),
+            db.Column('fuel_volume', db.Float, nullable=False),
+            db.Column('price_per_liter', db.Float),
+            db.Column('total_cost', db.Float),
+            db.Column('station_name', db.String(100)),
+            db.Column('fuel_type', db.String(20)),
+            db.Column('notes', db.Text),
+            db.Column('is_full_tank', db.Boolean, nullable=False),
+            db.Column('exclude_from_average', db.Boolean, nullable=False),
+        )
+        connection = db.session.connection()
+
+        # --- 1. 検証しながら一時テーブルへ投入 ---
+        staged_count = 0
+        for chunk in iter_chunks(records):
+            staged_rows = []
+            for row_num, row_data in chunk:
+                try:
+                    staged_row = _parse_fuel_csv_row(row_data, offset_at)
+                except ValueError as e:
+                    errors.add(f"{row_num}行目: {e}")
+                    continue
+                staged_row['row_num'] = row_num
+                staged_rows.append(staged_row)
+            # エラーが見つかった後は検証だけを続け、投入は行わない
+            if staged_rows and not errors:
+                connection.execute(staging.insert(), staged_rows)
+                staged_count += len(staged_rows)
+
+        if errors or not staged_count:
+            db.session.rollback()
+            return 0, errors.as_list(), []
+
+        # --- 2. 既存レコードとの重複を結合で一括チェック ---
+        duplicates = ImportMessages()
+        duplicate_rows = db.session.query(
+            staging.c.row_num, staging.c.entry_date, staging.c.odometer_reading
+        ).join(FuelEntry, and_(
+            FuelEntry.motorcycle_id == motorcycle.id,
+            FuelEntry.entry_date == staging.c.entry_date,
+            FuelEntry.odometer_reading == staging.c.odometer_reading
+        )).distinct().order_by(staging.c.row_num)
+        for item in duplicate_rows.yield_per(CSV_IMPORT_CHUNK_SIZE):
+            duplicates.add(f"{item.row_num}行目 (日付: {item.entry_date}, ODO: {item.odometer_reading}km)")
 
         # 重複が見つかった場合は、ここで処理を中断して警告
         if duplicates:
-            return 0, [], duplicates
-
-        # --- 2. 本実行ステージ ---
-        entries_to_add = []
-        for row_num, row in enumerate(all_rows[header_row_index + 1:], start=header_row_index + 2):
-            if not row or (row and row[0].strip().startswith('#')):
-                continue
-
-            try:
-                # バリデーションは済んでいるが、再度データを整形
-                row_data = dict(zip(header, row))
-                entry_date = date.fromisoformat(row_data.get('entry_date', '').strip())
-                odometer_reading = int(row_data.get('odometer_reading', '').strip())
-                fuel_volume = float(row_data.get('fuel_volume', '').strip())
-                
-                price_per_liter = float(row_data.get('price_per_liter', '').strip()) if row_data.get('price_per_liter', '').strip() else None
-                total_cost = int(row_data.get('total_cost', '').strip()) if row_data.get('total_cost', '').strip() else None
-                
-                if total_cost is None and price_per_liter is not None:
-                    total_cost = round(price_per_liter * fuel_volume)
-
-                is_full_tank_str = row_data.get('is_full_tank', 'true').strip().lower()
-                is_full_tank = is_full_tank_str in ['true', '1', 'yes', 'はい', 't']
-                exclude_str = row_data.get('exclude_from_average', 'false').strip().lower()
-                # 平均除外は満タン記録にのみ意味を持つため、非満タンでは強制Falseにする
-                exclude_from_average = is_full_tank and (exclude_str in ['true', '1', 'yes', 'はい', 't'])
-
-                offset_at_entry_date = motorcycle.calculate_cumulative_offset_from_logs(target_date=entry_date)
-                total_distance = odometer_reading + offset_at_entry_date
-
-                new_entry = FuelEntry(
-                    motorcycle_id=motorcycle.id, entry_date=entry_date, odometer_reading=odometer_reading,
-                    total_distance=total_distance, fuel_volume=fuel_volume, price_per_liter=price_per_liter,
-                    total_cost=total_cost, station_name=row_data.get('station_name', '').strip() or None,
-                    fuel_type=row_data.get('fuel_type', '').strip() or None, notes=row_data.get('notes', '').strip() or None,
-                    is_full_tank=is_full_tank, exclude_from_average=exclude_from_average
-                )
-                entries_to_add.append(new_entry)
-            except Exception as e:
-                # 基本的にここまで来ないはずだが念のため
-                errors.append(f"{row_num}行目: 予期せぬエラーが発生しました。({e})")
-
-        if not errors and entries_to_add:
-            db.session.add_all(entries_to_add)
-            db.session.commit()
-            for entry in entries_to_add:
-                event_data_for_ach = {'new_fuel_log_id': entry.id, 'motorcycle_id': motorcycle.id}
-                check_achievements_for_event(current_user, EVENT_ADD_FUEL_LOG, event_data=event_data_for_ach)
-            return len(entries_to_add), [], []
-        else:
             db.session.rollback()
-            return 0, errors, []
+            return 0, [], duplicates.as_list()
+
+        # --- 3. 本登録 ---
+        insert_columns = [
+            'motorcycle_id', 'entry_date', 'odometer_reading', 'total_distance', 'fuel_volume',
+            'price_per_liter', 'total_cost', 'station_name', 'fuel_type', 'notes',
+            'is_full_tank', 'exclude_from_average', 'is_odo_pending'
+        ]
+        select_staged = db.select(
+            db.literal(motorcycle.id), staging.c.entry_date, staging.c.odometer_reading,
+            staging.c.total_distance, staging.c.fuel_volume, staging.c.price_per_liter,
+            staging.c.total_cost, staging.c.station_name, staging.c.fuel_type, staging.c.notes,
+            staging.c.is_full_tank, staging.c.exclude_from_average, db.false()
+        ).order_by(staging.c.row_num)
+        last_entry_id = db.session.scalar(
+            db.select(func.max(FuelEntry.id)).where(FuelEntry.motorcycle_id == motorcycle.id)
+        ) or 0
+        connection.execute(FuelEntry.__table__.insert().from_select(insert_columns, select_staged))
+        # 一括INSERTは flush を経由しないため、検索ドキュメントはここで登録する
+        index_search_documents(FuelEntry, FuelEntry.motorcycle_id == motorcycle.id, FuelEntry.id > last_entry_id)
+        motorcycle.touch_fuel_data()
+        motorcycle.refresh_mileage_cache()
+        db.session.commit()
+        current_app.logger.info(
+            f"Imported {staged_count} fuel entries for motorcycle {motorcycle.id} "
+            f"in {time.perf_counter() - started_at:.2f}s"
+        )
+
+        # 実績は件数ベースで判定されるため、全件登録後に1回だけ評価する
+        event_data_for_ach = {'motorcycle_id': motorcycle.id, 'added_count': staged_count}
+        check_achievements_for_event(current_user, EVENT_ADD_FUEL_LOG, event_data=event_data_for_ach)
+        return staged_count, [], []
 
     except Exception as e:
         db.session.rollback()
-        errors.append(f"ファイル処理中に致命的なエラーが発生しました: {e}")
-        return 0, errors, []
+        return 0, [f"ファイル処理中に致命的なエラーが発生しました: {e}"], []
 
 
 def get_previous_fuel_entry(motorcycle_id, current_entry_date, current_entry_id=None):
@@ -169,7 +208,7 @@ def get_previous_fuel_entry(motorcycle_id, current_entry_date, current_entry_id=
 
 
 from ..utils.fuel_calculator import calculate_kpl_bulk
-from ..services import calculate_kpl_sums
+from ..services import calculate_kpl_sums_bulk, preload_fuel_kpl
 
 @fuel_bp.route('/search_gas_station')
 @limiter.limit("30 per minute")
@@ -257,49 +296,21 @@ def parse_receipt():
         return jsonify({'error': 'Internal server error processing receipt'}), 500
 
 
-@fuel_bp.route('/')
-@login_required
-def fuel_log():
-    start_date_str = request.args.get('start_date')
-    end_date_str = request.args.get('end_date')
-    vehicle_id_str = request.args.get('vehicle_id')
-    keyword = request.args.get('q', '').strip()
-    sort_by = request.args.get('sort_by', 'date')
-    order = request.args.get('order', 'desc')
-    page = request.args.get('page', 1, type=int)
-    per_page = current_app.config.get('FUEL_ENTRIES_PER_PAGE', 20)
-
-    user_motorcycles_all = Motorcycle.query.filter_by(user_id=current_user.id).order_by(Motorcycle.is_default.desc(), Motorcycle.name).all()
-    user_motorcycles_for_fuel = [m for m in user_motorcycles_all if not m.is_racer]
-
-    if not user_motorcycles_all:
-        flash('給油記録を閲覧・追加するには、まず車両を登録してください。', 'info')
-        return redirect(url_for('vehicle.add_vehicle'))
-    if not user_motorcycles_for_fuel and user_motorcycles_all:
-        flash('登録されている車両はすべてレーサー仕様のため、給油記録の対象外です。公道走行可能な車両を登録してください。', 'info')
-
-    user_motorcycle_ids_for_fuel = [m.id for m in user_motorcycles_for_fuel]
-    active_motorcycle_ids_for_fuel = [m.id for m in user_motorcycles_for_fuel if not m.is_archived]
-
-    # --- 1. ベースクエリの構築 (N+1対策済み) ---
-    base_query = db.session.query(FuelEntry).options(joinedload(FuelEntry.motorcycle)).join(Motorcycle)
-
-    # --- 燃費の一括計算 (N+1対策) ---
-    # フィルタリングに関わらず、対象車両の全記録を取得して燃費を計算しておく
-    # これにより、FuelEntry.km_per_liter プロパティへのアクセス(個別クエリ)を回避する
-    all_entries_for_calc = db.session.query(
-        FuelEntry.id, FuelEntry.motorcycle_id, FuelEntry.total_distance, 
-        FuelEntry.fuel_volume, FuelEntry.is_full_tank, FuelEntry.exclude_from_average
-    ).filter(
-        FuelEntry.motorcycle_id.in_(user_motorcycle_ids_for_fuel),
-        FuelEntry.is_odo_pending == False  # ODO保留中の記録は燃費計算から除外
-    ).order_by(FuelEntry.motorcycle_id, FuelEntry.total_distance).all()
+def _apply_fuel_log_filters(base_query, args, user_motorcycle_ids_for_fuel, active_motorcycle_ids_for_fuel, notify=True):
+    """
+    給油記録一覧の絞り込み条件 (期間・車両・キーワード) をクエリに適用する。
+    一覧画面とチャートデータAPIで同じ条件を共有するためのヘルパー。
+    notify=False の場合は flash を出さない (JSON API 用)。
 
-    kpl_map = calculate_kpl_bulk(all_entries_for_calc)
+    :return: (base_query, active_filters, start_date, end_date, avg_scope_ids)
+    """
+    start_date_str = args.get('start_date')
+    end_date_str = args.get('end_date')
+    vehicle_id_str = args.get('vehicle_id')
+    keyword = args.get('q', '').strip()
 
-    active_filters = {k: v for k, v in request.args.items() if k not in ['page', 'sort_by', 'order']}
+    active_filters = {k: v for k, v in args.items() if k not in ['page', 'sort_by', 'order', 'after', 'before']}
 
-    # --- 2. フィルタリングの適用 ---
     start_date = None
     end_date = None
     try:
@@ -312,7 +323,8 @@ def fuel_log():
     except ValueError:
         start_date = None
         end_date = None
-        flash('日付の形式が無効です。YYYY-MM-DD形式で入力してください。', 'warning')
+        if notify:
+            flash('日付の形式が無効です。YYYY-MM-DD形式で入力してください。', 'warning')
         active_filters.pop('start_date', None)
         active_filters.pop('end_date', None)
 
@@ -325,7 +337,8 @@ def fuel_log():
                 base_query = base_query.filter(FuelEntry.motorcycle_id == vehicle_id)
                 avg_scope_ids = [vehicle_id]
             else:
-                flash('選択された車両は給油記録の対象外か、有効ではありません。', 'warning')
+                if notify:
+                    flash('選択された車両は給油記録の対象外か、有効ではありません。', 'warning')
                 active_filters.pop('vehicle_id', None)
                 base_query = base_query.filter(FuelEntry.motorcycle_id.in_(active_motorcycle_ids_for_fuel))
         except ValueError:
@@ -342,6 +355,37 @@ def fuel_log():
         search_term = escape_like(keyword)
         base_query = base_query.filter(or_(FuelEntry.notes.ilike(search_term), FuelEntry.station_name.ilike(search_term)))
 
+    return base_query, active_filters, start_date, end_date, avg_scope_ids
+
+
+@fuel_bp.route('/')
+@login_required
+def fuel_log():
+    sort_by = request.args.get('sort_by', 'date')
+    order = request.args.get('order', 'desc')
+    page = request.args.get('page', 1, type=int)
+    per_page = current_app.config.get('FUEL_ENTRIES_PER_PAGE', 20)
+
+    user_motorcycles_all = Motorcycle.query.filter_by(user_id=current_user.id).order_by(Motorcycle.is_default.desc(), Motorcycle.name).all()
+    user_motorcycles_for_fuel = [m for m in user_motorcycles_all if not m.is_racer]
+
+    if not user_motorcycles_all:
+        flash('給油記録を閲覧・追加するには、まず車両を登録してください。', 'info')
+        return redirect(url_for('vehicle.add_vehicle'))
+    if not user_motorcycles_for_fuel and user_motorcycles_all:
+        flash('登録されている車両はすべてレーサー仕様のため、給油記録の対象外です。公道走行可能な車両を登録してください。', 'info')
+
+    user_motorcycle_ids_for_fuel = [m.id for m in user_motorcycles_for_fuel]
+    active_motorcycle_ids_for_fuel = [m.id for m in user_motorcycles_for_fuel if not m.is_archived]
+
+    # --- 1. ベースクエリの構築 (N+1対策済み) ---
+    base_query = db.session.query(FuelEntry).options(joinedload(FuelEntry.motorcycle)).join(Motorcycle)
+
+    # --- 2. フィルタリングの適用 ---
+    base_query, active_filters, start_date, end_date, avg_scope_ids = _apply_fuel_log_filters(
+        base_query, request.args, user_motorcycle_ids_for_fuel, active_motorcycle_ids_for_fuel
+    )
+
     # --- 3. 統計情報の集計 (SQLで実行可能な項目のみ) ---
     # Pythonのpropertyである km_per_liter はSQLクエリに含められないため削除
     stats_data = base_query.with_entities(
@@ -364,36 +408,16 @@ def fuel_log():
         if vd.max_dist is not None and vd.min_dist is not None and vd.max_dist != vd.min_dist:
             total_distance_interval += vd.max_dist - vd.min_dist
 
-    # --- 4. チャート用データ & 平均燃費の作成 (Pythonで処理) ---
-    # すべての対象データを取得し、Python側で燃費プロパティにアクセスしてリスト化
-    all_filtered_entries = base_query.order_by(asc(FuelEntry.entry_date)).all()
-    
-    chart_labels = []
-    chart_values = []
-
-    for e in all_filtered_entries:
-        # km_per_literはモデルプロパティではなく、一括計算結果を使用
-        kpl = kpl_map.get(e.id)
-        # 推移チャートには平均除外記録は載せない（異常値でトレンドを歪めないため）
-        if kpl is not None and not e.exclude_from_average:
-            chart_labels.append(e.entry_date.strftime('%Y/%m/%d'))
-            chart_values.append(round(kpl, 2))
-
-    chart_data = {
-        'labels': chart_labels,
-        'data': chart_values
-    }
-
+    # --- 4. 平均燃費の作成 ---
+    # チャート用の推移データは fuel_chart_data API がSQLで集約して返すため、ここでは全件取得しない
     # 平均燃費の計算 (加重平均方式: 区間の総走行距離 ÷ 総消費燃料)
-    # services.calculate_kpl_sums() を対象車両ごとに呼び、合計値を加重平均する。
+    # services.calculate_kpl_sums_bulk() で対象車両の合計値を1クエリで求め、加重平均する。
     # これにより calculate_average_kpl() と完全に同じ区間・期間判定になる
     # （日付フィルタは「区間終了日が期間内か」で判定され、境界区間が欠落しない）。
     total_distance_for_avg = 0.0
     total_fuel_for_avg = 0.0
-    for m in user_motorcycles_for_fuel:
-        if m.id not in avg_scope_ids:
-            continue
-        dist_sum, fuel_sum = calculate_kpl_sums(m, start_date, end_date)
+    avg_scope_motorcycles = [m for m in user_motorcycles_for_fuel if m.id in avg_scope_ids]
+    for dist_sum, fuel_sum in calculate_kpl_sums_bulk(avg_scope_motorcycles, start_date, end_date).values():
         total_distance_for_avg += dist_sum
         total_fuel_for_avg += fuel_sum
 
@@ -408,34 +432,38 @@ def fuel_log():
         'average_efficiency': calculated_efficiency
     }
 
-    # --- 5. リスト表示用のソートとページネーション ---
-    query = base_query # base_queryをそのまま利用
-
-    sort_column_map = {
-        'date': FuelEntry.entry_date, 'vehicle': Motorcycle.name,
-        'odo_reading': FuelEntry.odometer_reading, 'actual_distance': FuelEntry.total_distance,
-        'volume': FuelEntry.fuel_volume, 'price': FuelEntry.price_per_liter,
-        'cost': FuelEntry.total_cost, 'station': FuelEntry.station_name,
+    # --- 5. リスト表示用のソートとページネーション (キーセット方式) ---
+    # 並び替えキーは常に一意な id で終わらせ、前後ページ移動は cursor によるシークで取得する
+    # NULLを含み得る列 (単価・金額・スタンド名) での並び替え時のみ OFFSET で取得する
+    sort_keys_map = {
+        'date': (FuelEntry.entry_date, True),
+        'vehicle': (Motorcycle.name, True, lambda e: e.motorcycle.name),
+        'odo_reading': (FuelEntry.odometer_reading, True),
+        'actual_distance': (FuelEntry.total_distance, True),
+        'volume': (FuelEntry.fuel_volume, True),
+        'price': (FuelEntry.price_per_liter, False),
+        'cost': (FuelEntry.total_cost, False),
+        'station': (FuelEntry.station_name, False),
     }
-    current_sort_by = sort_by if sort_by in sort_column_map else 'date'
-    sort_column = sort_column_map.get(current_sort_by, FuelEntry.entry_date)
+    current_sort_by = sort_by if sort_by in sort_keys_map else 'date'
     current_order = 'desc' if order == 'desc' else 'asc'
-    
-    # 修正: 'asc' 文字列ではなく、SQLAlchemyの関数 asc を使用
-    sort_modifier = desc if current_order == 'desc' else asc
+    sort_key = sort_keys_map[current_sort_by]
+    primary_key = (sort_key[0], current_order == 'desc') + sort_key[2:]
 
     # 常に日付を第2ソートキーにして並び順を安定させる
-    if sort_column == FuelEntry.entry_date:
-        query = query.order_by(sort_modifier(FuelEntry.entry_date), desc(FuelEntry.total_distance), FuelEntry.id.desc())
-    elif sort_column == FuelEntry.odometer_reading:
-        query = query.order_by(sort_modifier(FuelEntry.odometer_reading), desc(FuelEntry.entry_date), FuelEntry.id.desc())
-    elif sort_column == FuelEntry.total_distance:
-        query = query.order_by(sort_modifier(FuelEntry.total_distance), desc(FuelEntry.entry_date), FuelEntry.id.desc())
+    if current_sort_by == 'date':
+        order_keys = [primary_key, (FuelEntry.total_distance, True), (FuelEntry.id, True)]
     else:
-        query = query.order_by(sort_modifier(sort_column), desc(FuelEntry.entry_date), FuelEntry.id.desc())
+        order_keys = [primary_key, (FuelEntry.entry_date, True), (FuelEntry.id, True)]
 
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    pagination = keyset_paginate(
+        base_query, order_keys, page, per_page, stats_data.count,
+        after=request.args.get('after'), before=request.args.get('before'),
+        seekable=sort_key[1]
+    )
     fuel_entries = pagination.items
+    # 表示中のページの記録だけ燃費を一括計算する (N+1対策、全履歴は読み込まない)
+    preload_fuel_kpl(fuel_entries)
 
     is_filter_active = bool(active_filters)
     upload_form = FuelCsvUploadForm()
@@ -448,9 +476,169 @@ def fuel_log():
                            current_sort_by=current_sort_by, current_order=current_order,
                            is_filter_active=is_filter_active,
                            upload_form=upload_form,
-                           summary_stats=summary_stats,
-                           chart_data=chart_data,
-                           kpl_map=kpl_map)
+                           summary_stats=summary_stats)
+
+
+def _rolling_kpl(distances, fuels, window):
+    """直近 window 点の走行距離・給油量の合計から移動平均燃費 (加重平均) を算出する"""
+    rolling = []
+    sum_distance = sum_fuel = 0.0
+    for i, (distance, fuel) in enumerate(zip(distances, fuels)):
+        sum_distance += distance
+        sum_fuel += fuel
+        if i >= window:
+            sum_distance -= distances[i - window]
+            sum_fuel -= fuels[i - window]
+        rolling.append(round(sum_distance / sum_fuel, 2) if sum_fuel > 0 else None)
+    return rolling
+
+
+def _fuel_chart_etag(motorcycles, scope_ids):
+    """対象車両の給油記録の最終更新日時とクエリ条件から、チャートデータのETagを生成する"""
+    last_updated = max(
+        (m.fuel_data_updated_at for m in motorcycles if m.id in scope_ids and m.fuel_data_updated_at),
+        default=None
+    )
+    source = '|'.join([
+        str(current_user.id),
+        ','.join(str(mid) for mid in sorted(scope_ids)),
+        last_updated.isoformat() if last_updated else '-',
+        request.query_string.decode('utf-8', 'replace'),
+    ])
+    return hashlib.sha1(source.encode('utf-8')).hexdigest()
+
+
+@fuel_bp.route('/chart_data')
+@login_required
+def fuel_chart_data():
+    """
+    燃費推移チャート用のデータをJSONで返す。
+    区間燃費はウィンドウ関数でSQL側で算出・集約し、返却点数は FUEL_CHART_MAX_POINTS 以下に抑える。
+    レスポンスには車両の給油記録の最終更新日時から算出したETagを付与し、
+    If-None-Match が一致する場合は集計を行わずに 304 を返す。
+
+    クエリパラメータ:
+    - 一覧画面と同じ絞り込み条件 (start_date, end_date, vehicle_id, q)
+    - resolution: 'auto' (既定: 点数が多い場合はN件ごとに集約) / 'month' (月ごとに集約)
+                  / 'lttb' (区間ごとの値をLTTB法で間引く)
+    - window: 移動平均燃費の算出に使う点数 (既定: 5)
+
+    返却値:
+    - labels, data: ラベルと燃費 (km/L)
+    - rolling: 移動平均燃費 (km/L)
+    - litres, cost: 各点の給油量 (L) と給油金額 (円)
+    - cost_per_km: 走行1kmあたりの燃料費 (円)。金額未入力の点は null
+    """
+    resolution = request.args.get('resolution', 'auto')
+    max_points = current_app.config.get('FUEL_CHART_MAX_POINTS', 200)
+    window = min(max(request.args.get('window', 5, type=int), 1), 50)
+
+    user_motorcycles_for_fuel = Motorcycle.query.filter_by(user_id=current_user.id, is_racer=False).all()
+    user_motorcycle_ids_for_fuel = [m.id for m in user_motorcycles_for_fuel]
+    active_motorcycle_ids_for_fuel = [m.id for m in user_motorcycles_for_fuel if not m.is_archived]
+
+    filtered_query, _, _, _, avg_scope_ids = _apply_fuel_log_filters(
+        db.session.query(FuelEntry.id), request.args,
+        user_motorcycle_ids_for_fuel, active_motorcycle_ids_for_fuel, notify=False
+    )
+
+    etag = _fuel_chart_etag(user_motorcycles_for_fuel, set(avg_scope_ids))
+    if etag in request.if_none_match:
+        not_modified = Response(status=304)
+        not_modified.set_etag(etag)
+        not_modified.headers['Cache-Control'] = 'private, no-cache'
+        return not_modified
+
+    # 区間 (前回満タン → 今回満タン) の走行距離と給油量・金額を算出する。
+    # 前回満タンを探すため、区間計算は絞り込み前の対象車両の全記録に対して行い、
+    # 絞り込み条件は区間の終端 (今回満タン) の記録に対して適用する。
+    # calculate_kpl_bulk と同じく、平均除外記録は区間境界としてのみ扱う。
+    window_order = (FuelEntry.total_distance, FuelEntry.id)
+    ordered = db.session.query(
+        FuelEntry.id, FuelEntry.motorcycle_id, FuelEntry.entry_date, FuelEntry.total_distance,
+        FuelEntry.is_full_tank, FuelEntry.exclude_from_average,
+        func.sum(FuelEntry.fuel_volume).over(
+            partition_by=FuelEntry.motorcycle_id, order_by=window_order
+        ).label('cumulative_fuel'),
+        func.sum(func.coalesce(FuelEntry.total_cost, 0)).over(
+            partition_by=FuelEntry.motorcycle_id, order_by=window_order
+        ).label('cumulative_cost')
+    ).filter(
+        FuelEntry.motorcycle_id.in_(avg_scope_ids),
+        FuelEntry.is_odo_pending == False
+    ).subquery()
+
+    segment_window = {'partition_by': ordered.c.motorcycle_id, 'order_by': (ordered.c.total_distance, ordered.c.id)}
+    segments = db.session.query(
+        ordered.c.id, ordered.c.entry_date, ordered.c.exclude_from_average,
+        (ordered.c.total_distance - func.lag(ordered.c.total_distance).over(**segment_window)).label('distance'),
+        (ordered.c.cumulative_fuel - func.lag(ordered.c.cumulative_fuel).over(**segment_window)).label('fuel'),
+        (ordered.c.cumulative_cost - func.lag(ordered.c.cumulative_cost).over(**segment_window)).label('cost')
+    ).filter(ordered.c.is_full_tank == True).subquery()
+
+    valid_segments = db.session.query(
+        segments.c.id, segments.c.entry_date, segments.c.distance, segments.c.fuel, segments.c.cost
+    ).filter(
+        segments.c.exclude_from_average == False,
+        segments.c.distance > 0,
+        segments.c.fuel > 0,
+        segments.c.id.in_(filtered_query.subquery())
+    )
+
+    if resolution == 'month':
+        month = func.date_trunc('month', segments.c.entry_date)
+        rows = valid_segments.with_entities(
+            month.label('bucket_date'),
+            func.sum(segments.c.distance).label('distance'),
+            func.sum(segments.c.fuel).label('fuel'),
+            func.sum(segments.c.cost).label('cost')
+        ).group_by(month).order_by(month).all()
+        label_format = '%Y/%m'
+    elif resolution == 'lttb':
+        # 区間ごとの値を取得し、移動平均を算出してからグラフ形状を保つ点だけを残す
+        rows = valid_segments.with_entities(
+            segments.c.entry_date.label('bucket_date'),
+            segments.c.distance, segments.c.fuel, segments.c.cost
+        ).order_by(segments.c.entry_date, segments.c.id).all()
+        label_format = '%Y/%m/%d'
+    else:
+        # 'auto': 点数が上限を超える場合のみ、N件ごとのバケットに加重平均で集約する
+        point_count = valid_segments.count()
+        bucket_size = max(1, math.ceil(point_count / max_points)) if max_points else 1
+        numbered = valid_segments.add_columns(
+            func.row_number().over(order_by=(segments.c.entry_date, segments.c.id)).label('rn')
+        ).subquery()
+        bucket = func.floor((numbered.c.rn - 1) / bucket_size)
+        rows = db.session.query(
+            func.max(numbered.c.entry_date).label('bucket_date'),
+            func.sum(numbered.c.distance).label('distance'),
+            func.sum(numbered.c.fuel).label('fuel'),
+            func.sum(numbered.c.cost).label('cost')
+        ).group_by(bucket).order_by(bucket).all()
+        label_format = '%Y/%m/%d'
+
+    distances = [float(row.distance) for row in rows]
+    fuels = [float(row.fuel) for row in rows]
+    costs = [float(row.cost or 0) for row in rows]
+    labels = [row.bucket_date.strftime(label_format) for row in rows]
+    kpl = [round(d / f, 2) for d, f in zip(distances, fuels)]
+    rolling = _rolling_kpl(distances, fuels, window)
+
+    keep = range(len(rows))
+    if resolution == 'lttb' and max_points:
+        keep = lttb_indices(list(range(len(rows))), kpl, max_points)
+
+    response = jsonify({
+        'labels': [labels[i] for i in keep],
+        'data': [kpl[i] for i in keep],
+        'rolling': [rolling[i] for i in keep],
+        'litres': [round(fuels[i], 2) for i in keep],
+        'cost': [round(costs[i]) for i in keep],
+        'cost_per_km': [round(costs[i] / distances[i], 2) if costs[i] > 0 else None for i in keep],
+    })
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'private, no-cache'
+    return response
 
 
 @fuel_bp.route('/add', methods=['GET', 'POST'])
@@ -537,6 +725,8 @@ def add_fuel():
 
         try:
             db.session.add(new_entry)
+            motorcycle.touch_fuel_data()
+            motorcycle.refresh_mileage_cache()
             db.session.commit()
             flash('給油記録を追加しました。', 'success')
 
@@ -643,6 +833,10 @@ def edit_fuel(entry_id):
             except TypeError: total_cost_val = None
         elif total_cost_val is not None: total_cost_val = int(round(float(total_cost_val)))
 
+        # 車両を付け替える場合は、移動元・移動先の両方のチャートキャッシュを無効化する
+        old_motorcycle = entry.motorcycle
+        old_motorcycle.touch_fuel_data()
+        new_motorcycle.touch_fuel_data()
         entry.motorcycle_id = new_motorcycle.id
         entry.entry_date = form.entry_date.data
         entry.odometer_reading = form.odometer_reading.data
@@ -659,6 +853,8 @@ def edit_fuel(entry_id):
         entry.is_odo_pending = form.is_odo_pending.data
 
         try:
+            for affected_motorcycle in {old_motorcycle, new_motorcycle}:
+                affected_motorcycle.refresh_mileage_cache()
             db.session.commit()
             flash('給油記録を更新しました。', 'success')
             return redirect(url_for('fuel.fuel_log'))
@@ -701,7 +897,10 @@ def delete_fuel(entry_id):
         Motorcycle.is_racer == False
     ).first_or_404()
     try:
+        motorcycle = entry.motorcycle
+        motorcycle.touch_fuel_data()
         db.session.delete(entry)
+        motorcycle.refresh_mileage_cache()
         db.session.commit()
         flash('給油記録を削除しました。', 'success')
     except Exception as e:
@@ -803,20 +1002,41 @@ def import_fuel_records_csv(vehicle_id):
 
 
 # --- CSV エクスポート共通ヘルパー ---
-def _build_fuel_csv(fuel_records):
-    """給油記録のリストからCSV文字列を生成する共通ヘルパー関数"""
-    output = io.StringIO()
-    writer = csv.writer(output)
-    header = [
-        'id', 'motorcycle_id', 'motorcycle_name', 'entry_date', 'odometer_reading',
-        'total_distance', 'fuel_volume', 'price_per_liter', 'total_cost',
-        'station_name', 'is_full_tank', 'km_per_liter', 'exclude_from_average', 'notes', 'fuel_type'
-    ]
-    writer.writerow(header)
-    for record in fuel_records:
-        km_per_liter_val = record.km_per_liter
-        row = [
-            record.id, record.motorcycle_id, record.motorcycle.name,
+_FUEL_CSV_HEADER = [
+    'id', 'motorcycle_id', 'motorcycle_name', 'entry_date', 'odometer_reading',
+    'total_distance', 'fuel_volume', 'price_per_liter', 'total_cost',
+    'station_name', 'is_full_tank', 'km_per_liter', 'exclude_from_average', 'notes', 'fuel_type'
+]
+
+
+def _iter_fuel_csv_rows(motorcycle_ids):
+    """
+    給油記録をCSVの行として1件ずつ返すジェネレータ。
+    燃費は列のみの取得結果から calculate_kpl_bulk で一括計算し、
+    本体の記録はサーバーサイドカーソル (yield_per) で少しずつ読み出す。
+    """
+    kpl_source = db.session.query(
+        FuelEntry.id, FuelEntry.motorcycle_id, FuelEntry.total_distance, FuelEntry.fuel_volume,
+        FuelEntry.is_full_tank, FuelEntry.exclude_from_average, FuelEntry.is_odo_pending
+    ).filter(
+        FuelEntry.motorcycle_id.in_(motorcycle_ids)
+    ).order_by(FuelEntry.motorcycle_id, FuelEntry.total_distance, FuelEntry.id)
+    kpl_map = calculate_kpl_bulk(kpl_source.yield_per(CSV_EXPORT_FLUSH_ROWS))
+
+    records = db.session.query(
+        FuelEntry.id, FuelEntry.motorcycle_id, Motorcycle.name.label('motorcycle_name'),
+        FuelEntry.entry_date, FuelEntry.odometer_reading, FuelEntry.total_distance,
+        FuelEntry.fuel_volume, FuelEntry.price_per_liter, FuelEntry.total_cost,
+        FuelEntry.station_name, FuelEntry.is_full_tank, FuelEntry.exclude_from_average,
+        FuelEntry.notes, FuelEntry.fuel_type
+    ).join(Motorcycle, Motorcycle.id == FuelEntry.motorcycle_id).filter(
+        FuelEntry.motorcycle_id.in_(motorcycle_ids)
+    ).order_by(FuelEntry.motorcycle_id, FuelEntry.entry_date.asc(), FuelEntry.total_distance.asc())
+
+    for record in records.yield_per(CSV_EXPORT_FLUSH_ROWS):
+        km_per_liter_val = kpl_map.get(record.id)
+        yield [
+            record.id, record.motorcycle_id, record.motorcycle_name,
             record.entry_date.strftime('%Y-%m-%d') if record.entry_date else '',
             record.odometer_reading, record.total_distance,
             f"{record.fuel_volume:.2f}" if record.fuel_volume is not None else '',
@@ -827,54 +1047,50 @@ def _build_fuel_csv(fuel_records):
             str(record.exclude_from_average),
             record.notes if record.notes else '', record.fuel_type if record.fuel_type else ''
         ]
-        writer.writerow(row)
-    output.seek(0)
-    return output.getvalue()
+
+
+def _fuel_csv_response(motorcycle_ids, filename):
+    """給油記録のCSVを、全件をメモリに載せずにストリーミングで返す"""
+    return Response(
+        stream_with_context(iter_csv(_FUEL_CSV_HEADER, _iter_fuel_csv_rows(motorcycle_ids))),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment;filename=\"{filename}\"", "Content-Type": "text/csv; charset=utf-8-sig"}
+    )
 
 
 @fuel_bp.route('/motorcycle/<int:motorcycle_id>/export_csv')
 @login_required
 def export_fuel_records_csv(motorcycle_id):
     motorcycle = Motorcycle.query.filter_by(id=motorcycle_id, user_id=current_user.id, is_racer=False).first_or_404()
-    fuel_records = FuelEntry.query.filter_by(motorcycle_id=motorcycle.id)\
-                                  .options(db.joinedload(FuelEntry.motorcycle))\
-                                  .order_by(FuelEntry.entry_date.asc(), FuelEntry.total_distance.asc()).all()
-    if not fuel_records:
+    has_records = db.session.query(FuelEntry.id).filter_by(motorcycle_id=motorcycle.id).first() is not None
+    if not has_records:
         flash(f'{motorcycle.name}にはエクスポート対象の燃費記録がありません。', 'info')
         return redirect(url_for('fuel.fuel_log', vehicle_id=motorcycle.id))
-    
-    csv_content = _build_fuel_csv(fuel_records)
+
     safe_vehicle_name = "".join(c for c in motorcycle.name if c.isalnum() or c in ['_', '-']).strip()
     if not safe_vehicle_name: safe_vehicle_name = "vehicle"
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     filename = f"motopuppu_fuel_records_{safe_vehicle_name}_{motorcycle.id}_{timestamp}.csv"
-    return Response(csv_content, mimetype="text/csv", headers={"Content-Disposition": f"attachment;filename=\"{filename}\"", "Content-Type": "text/csv; charset=utf-8-sig"})
+    return _fuel_csv_response([motorcycle.id], filename)
 
 @fuel_bp.route('/export_all_csv')
 @login_required
 def export_all_fuel_records_csv():
-    user_motorcycles_for_fuel = Motorcycle.query.filter_by(user_id=current_user.id, is_racer=False).all()
-    if not user_motorcycles_for_fuel:
+    user_motorcycle_ids_for_fuel = [
+        m.id for m in db.session.query(Motorcycle.id).filter_by(user_id=current_user.id, is_racer=False)
+    ]
+    if not user_motorcycle_ids_for_fuel:
         flash('エクスポート対象の車両（公道車）が登録されていません。', 'info')
         return redirect(url_for('fuel.fuel_log'))
 
-    user_motorcycle_ids_for_fuel = [m.id for m in user_motorcycles_for_fuel]
-
-    all_fuel_records = FuelEntry.query.filter(FuelEntry.motorcycle_id.in_(user_motorcycle_ids_for_fuel))\
-                                         .options(db.joinedload(FuelEntry.motorcycle))\
-                                         .order_by(FuelEntry.motorcycle_id, FuelEntry.entry_date.asc(), FuelEntry.total_distance.asc()).all()
-
-    if not all_fuel_records:
+    has_records = db.session.query(FuelEntry.id).filter(FuelEntry.motorcycle_id.in_(user_motorcycle_ids_for_fuel)).first() is not None
+    if not has_records:
         flash('エクスポート対象の燃費記録がありません。', 'info')
         return redirect(url_for('fuel.fuel_log'))
 
-    csv_content = _build_fuel_csv(all_fuel_records)
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     filename = f"motopuppu_fuel_records_all_vehicles_{timestamp}.csv"
-    return Response(
-        csv_content, mimetype="text/csv",
-        headers={"Content-Disposition": f"attachment;filename=\"{filename}\"", "Content-Type": "text/csv; charset=utf-8-sig"}
-    )
+    return _fuel_csv_response(user_motorcycle_ids_for_fuel, filename)
 
 @fuel_bp.route('/get-previous-entry', methods=['GET'])
 @login_required
@@ -1,7 +1,7 @@
 # motopuppu/views/main.py
 from flask import (
     Blueprint, render_template, redirect, url_for, g, flash,
-    current_app, jsonify, request
+    current_app, jsonify, request, Response
 )
 from datetime import date, timedelta, datetime, timezone
 from dateutil.relativedelta import relativedelta
@@ -16,6 +16,7 @@ import json
 from .. import services
 from flask_login import login_required, current_user
 from ..utils.lap_time_utils import format_seconds_to_time
+from ..utils.holidays import get_holidays_payload
 
 
 main_bp = Blueprint('main', __name__)
@@ -122,9 +123,8 @@ def dashboard():
 
     show_dashboard_tour = request.args.get('tutorial_completed') == '1' and not current_user.completed_tutorials.get('dashboard_tour')
 
-    # 軽いデータのみ取得 (祝日)
+    # 祝日は /api/holidays からブラウザキャッシュ付きで取得する
     # リマインダー、サーキットサマリー、にゃんぷっぷー、イベントはHTMXで取得するため除外
-    holidays_json = services.get_holidays_json()
 
     # --- レイアウト設定 ---
     dashboard_layout = current_user.dashboard_layout
@@ -156,7 +156,6 @@ def dashboard():
         # dashboard_events=[],   # HTMX化
         selected_timeline_vehicle_id=request.args.get('timeline_vehicle_id', 'all'),
         selected_stats_vehicle_id=request.args.get('stats_vehicle_id', type=int),
-        holidays_json=holidays_json,
         period=period,
         start_date_str=start_date_str,
         end_date_str=end_date_str,
@@ -347,22 +346,43 @@ def dashboard_vehicles_widget():
 @main_bp.route('/api/dashboard/events')
 @login_required
 def dashboard_events_api():
+    """
+    カレンダーの表示期間 (start 以上 end 未満) の記録を返すAPI。
+    期間の指定は必須で、CALENDAR_MAX_WINDOW_DAYS を超える範囲は受け付けない。
+    types=fuel,maintenance のように種類を絞ることもできる。
+    """
     from datetime import date
-    start_date_str = request.args.get('start')
-    end_date_str = request.args.get('end')
-    start_date = None
-    end_date = None
     try:
-        if start_date_str:
-            start_date = date.fromisoformat(start_date_str[:10])
-        if end_date_str:
-            end_date = date.fromisoformat(end_date_str[:10])
+        start_date = date.fromisoformat((request.args.get('start') or '')[:10])
+        end_date = date.fromisoformat((request.args.get('end') or '')[:10])
     except (ValueError, TypeError):
-        pass  # パラメータが不正な場合は全件取得にフォールバック
+        return jsonify({'error': 'start と end を YYYY-MM-DD 形式で指定してください。'}), 400
+    if end_date <= start_date or (end_date - start_date).days > services.CALENDAR_MAX_WINDOW_DAYS:
+        return jsonify({'error': f'表示期間は{services.CALENDAR_MAX_WINDOW_DAYS}日以内で指定してください。'}), 400
 
-    calendar_events = services.get_calendar_events_for_user(current_user, start_date=start_date, end_date=end_date)
-    
-    return jsonify(calendar_events)
+    types = services.CALENDAR_EVENT_TYPES
+    types_param = request.args.get('types')
+    if types_param:
+        types = tuple(t for t in types_param.split(',') if t in services.CALENDAR_EVENT_TYPES)
+
+    payload = services.get_calendar_payload_for_user(current_user, start_date, end_date, types=types)
+    return jsonify(payload)
+
+
+@main_bp.route('/api/holidays')
+def holidays_api():
+    """
+    カレンダー表示用の祝日 (今年を中心に前後1年分) を返すAPI。
+    内容は年が変わるまで同じなので、ETag と Cache-Control でブラウザにキャッシュさせる。
+    """
+    payload, etag = get_holidays_payload()
+    if etag in request.if_none_match:
+        response = Response(status=304)
+    else:
+        response = Response(payload, mimetype='application/json')
+    response.set_etag(etag)
+    response.headers['Cache-Control'] = 'public, max-age=86400'
+    return response
 
 
 @main_bp.route('/terms_of_service')
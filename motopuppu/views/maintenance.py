@@ -1,13 +1,15 @@
 # motopuppu/views/maintenance.py
 import csv
 import io
+import time
 from datetime import date, datetime, timezone
 
 from flask import (
-    Blueprint, flash, redirect, render_template, request, url_for, abort, current_app, Response, jsonify
+    Blueprint, flash, redirect, render_template, request, url_for, abort, current_app, Response, jsonify,
+    stream_with_context
 )
 from sqlalchemy import or_, asc, desc, func, and_
-from sqlalchemy.orm import joinedload # N+1対策のためにインポート
+from sqlalchemy.orm import joinedload, lazyload # N+1対策のためにインポート
 
 from flask_login import login_required, current_user
 from ..models import db, Motorcycle, MaintenanceEntry, MaintenanceReminder, Attachment
@@ -16,7 +18,14 @@ from ..constants import MAINTENANCE_CATEGORIES
 from ..achievement_evaluator import check_achievements_for_event, EVENT_ADD_MAINTENANCE_LOG
 from .. import limiter
 from ..utils.search_helpers import escape_like
+from ..utils.pagination import keyset_paginate
+from ..utils.csv_export import CSV_EXPORT_FLUSH_ROWS, iter_csv
+from ..utils.csv_import import (
+    CSV_IMPORT_CHUNK_SIZE, ImportMessages, open_csv_records, iter_chunks,
+    build_odo_offset_lookup, create_staging_table
+)
 from ..utils.image_security import process_and_upload_image, delete_gcs_image
+from ..utils.search_index import index_search_documents
 
 
 maintenance_bp = Blueprint('maintenance', __name__, url_prefix='/maintenance')
@@ -142,130 +151,170 @@ def _save_maintenance_photos(entry, uploaded_files, user_id, delete_ids, order_i
         ))
         order_idx += 1
 
+def _parse_maintenance_csv_row(row_data, offset_at):
+    """CSVの1行を検証し、一時テーブルへ投入する辞書に変換する。不正な値は ValueError を送出する。"""
+    try:
+        maintenance_date = date.fromisoformat(row_data.get('maintenance_date', '').strip())
+        odometer_reading = int(row_data.get('odometer_reading_at_maintenance', '').strip())
+    except (ValueError, TypeError):
+        raise ValueError("日付, ODO, 整備内容の形式が正しくありません。")
+
+    description = row_data.get('description', '').strip()
+    if not description:
+        raise ValueError("日付, ODO, 整備内容の形式が正しくありません。")
+
+    try:
+        parts_cost = float(row_data.get('parts_cost', '0').strip() or '0')
+        labor_cost = float(row_data.get('labor_cost', '0').strip() or '0')
+    except (ValueError, TypeError):
+        raise ValueError("部品代・工賃の形式が正しくありません。")
+
+    return {
+        'maintenance_date': maintenance_date,
+        'odometer_reading_at_maintenance': odometer_reading,
+        'total_distance_at_maintenance': odometer_reading + offset_at(maintenance_date),
+        'description': description,
+        'location': row_data.get('location', '').strip() or None,
+        'category': row_data.get('category', '').strip() or None,
+        'parts_cost': parts_cost,
+        'labor_cost': labor_cost,
+        'notes': row_data.get('notes', '').strip() or None,
+    }
+
+
 def _process_maintenance_csv_import(file_stream, motorcycle: Motorcycle):
     """
     アップロードされた整備記録CSVを解析し、DBに登録する。
-    重複チェック（ドライラン）と本実行の2段階で行う。
+    給油記録と同様に一定行数ずつ一時テーブルへ投入し、重複チェックと本登録をそれぞれ1回のSQLで行う。
+    リマインダーは登録した記録からリマインダーごとの最新記録をまとめて求め、1回だけ更新する。
     """
     required_headers = {'maintenance_date', 'odometer_reading_at_maintenance', 'description'}
-    errors = []
-    duplicates = []
-    
+    errors = ImportMessages()
+    started_at = time.perf_counter()
+
     try:
         wrapper = io.TextIOWrapper(file_stream, encoding='utf-8-sig')
-        all_rows = list(csv.reader(wrapper))
-
-        header_row_index = -1
-        for i, row in enumerate(all_rows):
-            if row and not row[0].strip().startswith('#'):
-                header_row_index = i
-                break
-        
-        if header_row_index == -1:
-            errors.append("CSVファイルにヘッダー行が見つかりませんでした。")
-            return 0, errors, []
-
-        header = [h.strip().lower() for h in all_rows[header_row_index]]
-        if not required_headers.issubset(set(header)):
-            missing = required_headers - set(header)
-            errors.append(f"CSVヘッダーに必須項目がありません: {', '.join(missing)}")
-            return 0, errors, []
-
-        # --- 1. ドライラン（事前チェック）ステージ ---
-        valid_rows_to_check = []
-        for row_num, row in enumerate(all_rows[header_row_index + 1:], start=header_row_index + 2):
-            if not row or (row and row[0].strip().startswith('#')):
-                continue
-            
-            try:
-                row_data = dict(zip(header, row))
-                entry_date = date.fromisoformat(row_data.get('maintenance_date', '').strip())
-                odometer_reading = int(row_data.get('odometer_reading_at_maintenance', '').strip())
-                description = row_data.get('description', '').strip()
-                if not description:
-                    raise ValueError("description is empty")
-
-                valid_rows_to_check.append({'date': entry_date, 'odo': odometer_reading, 'desc': description, 'row_num': row_num})
-            except (ValueError, TypeError):
-                errors.append(f"{row_num}行目: 日付, ODO, 整備内容の形式が正しくありません。")
-
-        if errors:
-            return 0, errors, []
-
-        # --- データベースで既存レコードを一括クエリ ---
-        if valid_rows_to_check:
-            conditions = [
-                and_(
-                    MaintenanceEntry.motorcycle_id == motorcycle.id, 
-                    MaintenanceEntry.maintenance_date == item['date'], 
-                    MaintenanceEntry.odometer_reading_at_maintenance == item['odo'],
-                    MaintenanceEntry.description == item['desc']
-                )
-                for item in valid_rows_to_check
-            ]
-            existing_records_query = MaintenanceEntry.query.filter(or_(*conditions)).with_entities(
-                MaintenanceEntry.maintenance_date, MaintenanceEntry.odometer_reading_at_maintenance, MaintenanceEntry.description
-            )
-            existing_keys = {(rec.maintenance_date, rec.odometer_reading_at_maintenance, rec.description) for rec in existing_records_query.all()}
-            
-            for item in valid_rows_to_check:
-                if (item['date'], item['odo'], item['desc']) in existing_keys:
-                    duplicates.append(f"{item['row_num']}行目 (日付: {item['date']}, ODO: {item['odo']}km, 内容: {item['desc'][:20]}...)")
+        records, header_error = open_csv_records(wrapper, required_headers)
+        if header_error:
+            return 0, [header_error], []
+
+        offset_at = build_odo_offset_lookup(motorcycle)
+        staging = create_staging_table(
+            'maintenance_import_staging',
+            db.Column('row_num', db.Integer, primary_key=True),
+            db.Column('maintenance_date', db.Date, nullable=False),
+            db.Column('odometer_reading_at_maintenance', db.Integer, nullable=False),
+            db.Column('total_distance_at_maintenance', db.Integer, nullable=False),
+            db.Column('description', db.Text, nullable=False),
+            db.Column('location', db.String(100)),
+            db.Column('category', db.String(50)),
+            db.Column('parts_cost', db.Float),
+            db.Column('labor_cost', db.Float),
+            db.Column('notes', db.Text),
+        )
+        connection = db.session.connection()
+
+        # --- 1. 検証しながら一時テーブルへ投入 ---
+        staged_count = 0
+        for chunk in iter_chunks(records):
+            staged_rows = []
+            for row_num, row_data in chunk:
+                try:
+                    staged_row = _parse_maintenance_csv_row(row_data, offset_at)
+                except ValueError as e:
+                    errors.add(f"{row_num}行目: {e}")
+                    continue
+                staged_row['row_num'] = row_num
+                staged_rows.append(staged_row)
+            if staged_rows and not errors:
+                connection.execute(staging.insert(), staged_rows)
+                staged_count += len(staged_rows)
+
+        if errors or not staged_count:
+            db.session.rollback()
+            return 0, errors.as_list(), []
+
+        # --- 2. 既存レコードとの重複を結合で一括チェック ---
+        duplicates = ImportMessages()
+        duplicate_rows = db.session.query(
+            staging.c.row_num, staging.c.maintenance_date,
+            staging.c.odometer_reading_at_maintenance, staging.c.description
+        ).join(MaintenanceEntry, and_(
+            MaintenanceEntry.motorcycle_id == motorcycle.id,
+            MaintenanceEntry.maintenance_date == staging.c.maintenance_date,
+            MaintenanceEntry.odometer_reading_at_maintenance == staging.c.odometer_reading_at_maintenance,
+            MaintenanceEntry.description == staging.c.description
+        )).distinct().order_by(staging.c.row_num)
+        for item in duplicate_rows.yield_per(CSV_IMPORT_CHUNK_SIZE):
+            duplicates.add(f"{item.row_num}行目 (日付: {item.maintenance_date}, ODO: {item.odometer_reading_at_maintenance}km, 内容: {item.description[:20]}...)")
 
         if duplicates:
-            return 0, [], duplicates
+            db.session.rollback()
+            return 0, [], duplicates.as_list()
+
+        # --- 3. 本登録とリマインダー連携 ---
+        # INSERT ... RETURNING をCTEとして使い、登録した記録の中から
+        # リマインダーごとにカテゴリが一致する最新の記録を同じSQLで求める。
+        insert_columns = [
+            'motorcycle_id', 'maintenance_date', 'odometer_reading_at_maintenance',
+            'total_distance_at_maintenance', 'description', 'location', 'category',
+            'parts_cost', 'labor_cost', 'notes', 'is_odo_pending'
+        ]
+        select_staged = db.select(
+            db.literal(motorcycle.id), staging.c.maintenance_date, staging.c.odometer_reading_at_maintenance,
+            staging.c.total_distance_at_maintenance, staging.c.description, staging.c.location,
+            staging.c.category, staging.c.parts_cost, staging.c.labor_cost, staging.c.notes, db.false()
+        ).order_by(staging.c.row_num)
+        last_entry_id = db.session.scalar(
+            db.select(func.max(MaintenanceEntry.id)).where(MaintenanceEntry.motorcycle_id == motorcycle.id)
+        ) or 0
+        inserted = MaintenanceEntry.__table__.insert().from_select(insert_columns, select_staged).returning(
+            MaintenanceEntry.id, MaintenanceEntry.maintenance_date, MaintenanceEntry.category,
+            MaintenanceEntry.total_distance_at_maintenance, MaintenanceEntry.odometer_reading_at_maintenance
+        ).cte('inserted_entries')
+
+        latest_per_reminder = db.select(
+            MaintenanceReminder, inserted.c.id, inserted.c.maintenance_date,
+            inserted.c.total_distance_at_maintenance, inserted.c.odometer_reading_at_maintenance
+        ).join(
+            inserted,
+            func.lower(func.trim(inserted.c.category)) == func.lower(func.trim(MaintenanceReminder.task_description))
+        ).where(
+            MaintenanceReminder.motorcycle_id == motorcycle.id,
+            MaintenanceReminder.auto_update_from_category == True,
+            func.trim(inserted.c.category) != ''
+        ).options(
+            lazyload(MaintenanceReminder.last_maintenance_entry)
+        ).distinct(MaintenanceReminder.id).order_by(
+            MaintenanceReminder.id,
+            inserted.c.maintenance_date.desc(),
+            inserted.c.total_distance_at_maintenance.desc(),
+            inserted.c.id.desc()
+        )
 
-        # --- 2. 本実行ステージ ---
-        entries_to_add = []
-        for row_num, row in enumerate(all_rows[header_row_index + 1:], start=header_row_index + 2):
-            if not row or (row and row[0].strip().startswith('#')):
-                continue
-            
-            try:
-                row_data = dict(zip(header, row))
-                maintenance_date = date.fromisoformat(row_data.get('maintenance_date').strip())
-                odometer_reading = int(row_data.get('odometer_reading_at_maintenance').strip())
-                description = row_data.get('description').strip()
+        for reminder, entry_id, entry_date, entry_total_distance, entry_odo in db.session.execute(latest_per_reminder).all():
+            if _apply_reminder_update(reminder, motorcycle, entry_id, entry_date, entry_total_distance, entry_odo):
+                flash(f"整備記録に基づき、リマインダー「{reminder.task_description}」を新しい記録に自動連携しました。", 'info')
 
-                offset_at_date = motorcycle.calculate_cumulative_offset_from_logs(target_date=maintenance_date)
-                total_distance = odometer_reading + offset_at_date
-                
-                parts_cost = float(row_data.get('parts_cost', '0').strip() or '0')
-                labor_cost = float(row_data.get('labor_cost', '0').strip() or '0')
-
-                new_entry = MaintenanceEntry(
-                    motorcycle_id=motorcycle.id,
-                    maintenance_date=maintenance_date,
-                    odometer_reading_at_maintenance=odometer_reading,
-                    total_distance_at_maintenance=total_distance,
-                    description=description,
-                    location=row_data.get('location', '').strip() or None,
-                    category=row_data.get('category', '').strip() or None,
-                    parts_cost=parts_cost,
-                    labor_cost=labor_cost,
-                    notes=row_data.get('notes', '').strip() or None
-                )
-                entries_to_add.append(new_entry)
-            except Exception as e:
-                errors.append(f"{row_num}行目: 予期せぬエラーが発生しました。({e})")
+        # 一括INSERTは flush を経由しないため、検索ドキュメントはここで登録する
+        index_search_documents(
+            MaintenanceEntry, MaintenanceEntry.motorcycle_id == motorcycle.id, MaintenanceEntry.id > last_entry_id
+        )
+        motorcycle.refresh_mileage_cache()
+        db.session.commit()
+        current_app.logger.info(
+            f"Imported {staged_count} maintenance entries for motorcycle {motorcycle.id} "
+            f"in {time.perf_counter() - started_at:.2f}s"
+        )
 
-        if not errors and entries_to_add:
-            db.session.add_all(entries_to_add)
-            db.session.flush()
-            for entry in entries_to_add:
-                _update_reminder_if_applicable(entry)
-                event_data_for_ach = {'new_maintenance_log_id': entry.id, 'motorcycle_id': motorcycle.id, 'category': entry.category}
-                check_achievements_for_event(current_user, EVENT_ADD_MAINTENANCE_LOG, event_data=event_data_for_ach)
-            db.session.commit()
-            return len(entries_to_add), [], []
-        else:
-            db.session.rollback()
-            return 0, errors, []
+        # 実績は件数ベースで判定されるため、全件登録後に1回だけ評価する
+        event_data_for_ach = {'motorcycle_id': motorcycle.id, 'added_count': staged_count}
+        check_achievements_for_event(current_user, EVENT_ADD_MAINTENANCE_LOG, event_data=event_data_for_ach)
+        return staged_count, [], []
 
     except Exception as e:
         db.session.rollback()
-        errors.append(f"ファイル処理中に致命的なエラーが発生しました: {e}")
-        return 0, errors, []
+        return 0, [f"ファイル処理中に致命的なエラーが発生しました: {e}"], []
 
 def get_previous_maintenance_entry(motorcycle_id, current_maintenance_date, current_entry_id=None):
     """指定された車両・日付に基づき、直前の整備記録を取得する"""
@@ -289,6 +338,30 @@ def get_previous_maintenance_entry(motorcycle_id, current_maintenance_date, curr
     return previous_entry
 
 
+def _apply_reminder_update(reminder, motorcycle, entry_id, entry_date, entry_total_distance, entry_odo):
+    """
+    整備記録がリマインダーの最終実施より新しければ、リマインダーをその記録に連携する。
+    連携した場合は True を返す。
+    """
+    is_newer = False
+    if reminder.last_done_date is None:
+        is_newer = True
+    elif entry_date > reminder.last_done_date:
+        is_newer = True
+    elif (entry_date == reminder.last_done_date and
+            not motorcycle.is_racer and
+            (entry_total_distance or 0) >= (reminder.last_done_km or 0)):
+        is_newer = True
+
+    if is_newer:
+        reminder.last_maintenance_entry_id = entry_id
+        reminder.last_done_date = entry_date
+        reminder.last_done_km = entry_total_distance
+        reminder.last_done_odo = entry_odo
+        current_app.logger.info(f"Reminder '{reminder.task_description}' (ID:{reminder.id}) was auto-linked to new MaintenanceEntry ID:{entry_id}")
+    return is_newer
+
+
 def _update_reminder_if_applicable(maintenance_entry: MaintenanceEntry):
     """
     条件付きでリマインダーを自動更新する関数。
@@ -310,23 +383,11 @@ def _update_reminder_if_applicable(maintenance_entry: MaintenanceEntry):
                 current_app.logger.debug(f"Reminder '{reminder.task_description}' (ID:{reminder.id}) has auto-update disabled. Skipping.")
                 continue
 
-            is_newer = False
-            if reminder.last_done_date is None:
-                is_newer = True
-            elif maintenance_entry.maintenance_date > reminder.last_done_date:
-                is_newer = True
-            elif (maintenance_entry.maintenance_date == reminder.last_done_date and
-                    not reminder.motorcycle.is_racer and
-                    (maintenance_entry.total_distance_at_maintenance or 0) >= (reminder.last_done_km or 0)):
-                is_newer = True
-
-            if is_newer:
-                reminder.last_maintenance_entry_id = maintenance_entry.id
-                reminder.last_done_date = maintenance_entry.maintenance_date
-                reminder.last_done_km = maintenance_entry.total_distance_at_maintenance
-                reminder.last_done_odo = maintenance_entry.odometer_reading_at_maintenance
+            if _apply_reminder_update(
+                reminder, reminder.motorcycle, maintenance_entry.id, maintenance_entry.maintenance_date,
+                maintenance_entry.total_distance_at_maintenance, maintenance_entry.odometer_reading_at_maintenance
+            ):
                 flash(f"整備記録に基づき、リマインダー「{reminder.task_description}」を新しい記録に自動連携しました。", 'info')
-                current_app.logger.info(f"Reminder '{reminder.task_description}' (ID:{reminder.id}) was auto-linked to new MaintenanceEntry ID:{maintenance_entry.id}")
                 break
 
 
@@ -356,7 +417,7 @@ def maintenance_log():
     ).join(Motorcycle)
     # ▲▲▲ 改善ここまで ▲▲▲
 
-    active_filters = {k: v for k, v in request.args.items() if k not in ['page', 'sort_by', 'order']}
+    active_filters = {k: v for k, v in request.args.items() if k not in ['page', 'sort_by', 'order', 'after', 'before']}
 
     try:
         if start_date_str: query = query.filter(MaintenanceEntry.maintenance_date >= date.fromisoformat(start_date_str))
@@ -403,27 +464,30 @@ def maintenance_log():
         current_app.logger.error(f"Error calculating maintenance summary: {e}")
     # ▲▲▲ 計算ここまで ▲▲▲
 
-    sort_column_map = {
-        'date': MaintenanceEntry.maintenance_date, 'vehicle': Motorcycle.name,
-        'odo_reading': MaintenanceEntry.odometer_reading_at_maintenance,
-        'actual_distance': MaintenanceEntry.total_distance_at_maintenance,
-        'category': MaintenanceEntry.category
+    # 並び替えキー: (列, NULLを含まずシーク可能か[, 行から値を取り出す関数])
+    # 前後ページ移動は cursor によるキーセット方式、NULLを含み得る列での並び替え時のみ OFFSET
+    sort_keys_map = {
+        'date': (MaintenanceEntry.maintenance_date, True),
+        'vehicle': (Motorcycle.name, True, lambda e: e.motorcycle.name),
+        'odo_reading': (MaintenanceEntry.odometer_reading_at_maintenance, False),
+        'actual_distance': (MaintenanceEntry.total_distance_at_maintenance, True),
+        'category': (MaintenanceEntry.category, False)
     }
-    current_sort_by = sort_by if sort_by in sort_column_map else 'date'
-    sort_column = sort_column_map.get(current_sort_by, MaintenanceEntry.maintenance_date)
+    current_sort_by = sort_by if sort_by in sort_keys_map else 'date'
     current_order = 'desc' if order == 'desc' else 'asc'
-    sort_modifier = desc if current_order == 'desc' else asc
-
-    if sort_column == MaintenanceEntry.maintenance_date:
-        query = query.order_by(sort_modifier(MaintenanceEntry.maintenance_date), desc(MaintenanceEntry.total_distance_at_maintenance), MaintenanceEntry.id.desc())
-    elif sort_column == MaintenanceEntry.odometer_reading_at_maintenance:
-        query = query.order_by(sort_modifier(MaintenanceEntry.odometer_reading_at_maintenance), desc(MaintenanceEntry.maintenance_date), MaintenanceEntry.id.desc())
-    elif sort_column == MaintenanceEntry.total_distance_at_maintenance:
-        query = query.order_by(sort_modifier(MaintenanceEntry.total_distance_at_maintenance), desc(MaintenanceEntry.maintenance_date), MaintenanceEntry.id.desc())
+    sort_key = sort_keys_map[current_sort_by]
+    primary_key = (sort_key[0], current_order == 'desc') + sort_key[2:]
+
+    if current_sort_by == 'date':
+        order_keys = [primary_key, (MaintenanceEntry.total_distance_at_maintenance, True), (MaintenanceEntry.id, True)]
     else:
-        query = query.order_by(sort_modifier(sort_column), desc(MaintenanceEntry.maintenance_date), MaintenanceEntry.id.desc())
+        order_keys = [primary_key, (MaintenanceEntry.maintenance_date, True), (MaintenanceEntry.id, True)]
 
-    pagination = query.paginate(page=page, per_page=per_page, error_out=False)
+    pagination = keyset_paginate(
+        query, order_keys, page, per_page, summary_stats['total_count'],
+        after=request.args.get('after'), before=request.args.get('before'),
+        seekable=sort_key[1]
+    )
     entries = pagination.items
     
     is_filter_active = bool(active_filters)
@@ -544,6 +608,7 @@ def add_maintenance():
                 template_name = 'beta/maintenance_form_beta.html' if current_user.use_beta_ui else 'maintenance_form.html'
                 return render_template(template_name, form_action='add', form=form, category_options=MAINTENANCE_CATEGORIES)
             _update_reminder_if_applicable(new_entry)
+            motorcycle.refresh_mileage_cache()
             db.session.commit()
             flash('整備記録を追加しました。', 'success')
 
@@ -631,6 +696,7 @@ def edit_maintenance(entry_id):
             template_name = 'beta/maintenance_form_beta.html' if current_user.use_beta_ui else 'maintenance_form.html'
             return render_template(template_name, form_action='edit', form=form, entry_id=entry.id, entry=entry, category_options=MAINTENANCE_CATEGORIES)
 
+        old_motorcycle = entry.motorcycle
         entry.motorcycle_id = motorcycle.id
         entry.maintenance_date = form.maintenance_date.data
         entry.odometer_reading_at_maintenance = form.odometer_reading_at_maintenance.data
@@ -664,6 +730,8 @@ def edit_maintenance(entry_id):
 
         try:
             _update_reminder_if_applicable(entry)
+            for affected_motorcycle in {old_motorcycle, motorcycle}:
+                affected_motorcycle.refresh_mileage_cache()
             db.session.commit()
             flash('整備記録を更新しました。', 'success')
             return redirect(url_for('maintenance.maintenance_log'))
@@ -694,7 +762,9 @@ def delete_maintenance(entry_id):
                 delete_gcs_image(att.filepath)
             except Exception as e:
                 current_app.logger.warning(f"GCS deletion failed for attachment {att.id}: {e}")
+        motorcycle = entry.motorcycle
         db.session.delete(entry)
+        motorcycle.refresh_mileage_cache()
         db.session.commit()
         flash('整備記録を削除しました。', 'success')
     except Exception as e:
@@ -808,75 +878,87 @@ def import_maintenance_logs_csv(vehicle_id):
     return redirect(url_for('maintenance.maintenance_log', vehicle_id=vehicle_id))
 
 # --- CSV エクスポート共通ヘルパー ---
-def _build_maintenance_csv(maintenance_logs):
-    """整備記録のリストからCSV文字列を生成する共通ヘルパー関数"""
-    output = io.StringIO()
-    writer = csv.writer(output)
-    header = [
-        'id', 'motorcycle_id', 'motorcycle_name', 'maintenance_date',
-        'odometer_reading_at_maintenance', 'operating_hours_at_maintenance', 'total_distance_at_maintenance',
-        'category', 'description', 'parts_cost', 'labor_cost', 'total_cost',
-        'location', 'notes'
-    ]
-    writer.writerow(header)
-    for record in maintenance_logs:
-        total_cost_val = record.total_cost
-        row = [
-            record.id, record.motorcycle_id, record.motorcycle.name,
+_MAINTENANCE_CSV_HEADER = [
+    'id', 'motorcycle_id', 'motorcycle_name', 'maintenance_date',
+    'odometer_reading_at_maintenance', 'operating_hours_at_maintenance', 'total_distance_at_maintenance',
+    'category', 'description', 'parts_cost', 'labor_cost', 'total_cost',
+    'location', 'notes'
+]
+
+
+def _iter_maintenance_csv_rows(motorcycle_ids):
+    """整備記録をCSVの行として1件ずつ返すジェネレータ。必要な列だけをサーバーサイドカーソルで読み出す。"""
+    records = db.session.query(
+        MaintenanceEntry.id, MaintenanceEntry.motorcycle_id, Motorcycle.name.label('motorcycle_name'),
+        MaintenanceEntry.maintenance_date, MaintenanceEntry.odometer_reading_at_maintenance,
+        MaintenanceEntry.operating_hours_at_maintenance, MaintenanceEntry.total_distance_at_maintenance,
+        MaintenanceEntry.category, MaintenanceEntry.description, MaintenanceEntry.parts_cost,
+        MaintenanceEntry.labor_cost, MaintenanceEntry.location, MaintenanceEntry.notes
+    ).join(Motorcycle, Motorcycle.id == MaintenanceEntry.motorcycle_id).filter(
+        MaintenanceEntry.motorcycle_id.in_(motorcycle_ids)
+    ).order_by(
+        MaintenanceEntry.motorcycle_id, MaintenanceEntry.maintenance_date.asc(), MaintenanceEntry.total_distance_at_maintenance.asc()
+    )
+
+    for record in records.yield_per(CSV_EXPORT_FLUSH_ROWS):
+        # MaintenanceEntry.total_cost と同じく、未入力の費用は 0 として合計する
+        total_cost_val = (record.parts_cost or 0.0) + (record.labor_cost or 0.0)
+        yield [
+            record.id, record.motorcycle_id, record.motorcycle_name,
             record.maintenance_date.strftime('%Y-%m-%d') if record.maintenance_date else '',
             record.odometer_reading_at_maintenance, record.operating_hours_at_maintenance, record.total_distance_at_maintenance,
             record.category if record.category else '', record.description if record.description else '',
             f"{record.parts_cost:.2f}" if record.parts_cost is not None else '',
             f"{record.labor_cost:.2f}" if record.labor_cost is not None else '',
-            f"{total_cost_val:.2f}" if total_cost_val is not None else '',
+            f"{total_cost_val:.2f}",
             record.location if record.location else '', record.notes if record.notes else ''
         ]
-        writer.writerow(row)
-    output.seek(0)
-    return output.getvalue()
+
+
+def _maintenance_csv_response(motorcycle_ids, filename):
+    """整備記録のCSVを、全件をメモリに載せずにストリーミングで返す"""
+    return Response(
+        stream_with_context(iter_csv(_MAINTENANCE_CSV_HEADER, _iter_maintenance_csv_rows(motorcycle_ids))),
+        mimetype="text/csv",
+        headers={"Content-Disposition": f"attachment;filename=\"{filename}\"", "Content-Type": "text/csv; charset=utf-8-sig"}
+    )
 
 
 @maintenance_bp.route('/motorcycle/<int:motorcycle_id>/export_csv')
 @login_required
 def export_maintenance_logs_csv(motorcycle_id):
     motorcycle = Motorcycle.query.filter_by(id=motorcycle_id, user_id=current_user.id).first_or_404()
-    maintenance_logs = MaintenanceEntry.query.filter_by(motorcycle_id=motorcycle.id)\
-                                              .options(db.joinedload(MaintenanceEntry.motorcycle))\
-                                              .order_by(MaintenanceEntry.maintenance_date.asc(), MaintenanceEntry.total_distance_at_maintenance.asc()).all()
-    if not maintenance_logs:
+    has_records = db.session.query(MaintenanceEntry.id).filter_by(motorcycle_id=motorcycle.id).first() is not None
+    if not has_records:
         flash(f'{motorcycle.name}にはエクスポート対象の整備記録がありません。', 'info')
         return redirect(url_for('maintenance.maintenance_log', vehicle_id=motorcycle.id))
-    
-    csv_content = _build_maintenance_csv(maintenance_logs)
+
     safe_vehicle_name = "".join(c for c in motorcycle.name if c.isalnum() or c in ['_', '-']).strip()
     if not safe_vehicle_name: safe_vehicle_name = "vehicle"
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     filename = f"motopuppu_maintenance_logs_{safe_vehicle_name}_{motorcycle.id}_{timestamp}.csv"
-    return Response(csv_content, mimetype="text/csv", headers={"Content-Disposition": f"attachment;filename=\"{filename}\"", "Content-Type": "text/csv; charset=utf-8-sig"})
+    return _maintenance_csv_response([motorcycle.id], filename)
 
 @maintenance_bp.route('/export_all_csv')
 @login_required
 def export_all_maintenance_logs_csv():
-    user_motorcycles_for_maintenance = Motorcycle.query.filter_by(user_id=current_user.id).all()
-    if not user_motorcycles_for_maintenance:
+    user_motorcycle_ids_for_maintenance = [
+        m.id for m in db.session.query(Motorcycle.id).filter_by(user_id=current_user.id)
+    ]
+    if not user_motorcycle_ids_for_maintenance:
         flash('エクスポート対象の車両（公道車）が登録されていません。', 'info')
         return redirect(url_for('maintenance.maintenance_log'))
 
-    user_motorcycle_ids_for_maintenance = [m.id for m in user_motorcycles_for_maintenance]
-    all_maintenance_logs = MaintenanceEntry.query.filter(MaintenanceEntry.motorcycle_id.in_(user_motorcycle_ids_for_maintenance))\
-                                                 .options(db.joinedload(MaintenanceEntry.motorcycle))\
-                                                 .order_by(MaintenanceEntry.motorcycle_id, MaintenanceEntry.maintenance_date.asc(), MaintenanceEntry.total_distance_at_maintenance.asc()).all()
-    if not all_maintenance_logs:
+    has_records = db.session.query(MaintenanceEntry.id).filter(
+        MaintenanceEntry.motorcycle_id.in_(user_motorcycle_ids_for_maintenance)
+    ).first() is not None
+    if not has_records:
         flash('エクスポート対象の整備記録がありません。', 'info')
         return redirect(url_for('maintenance.maintenance_log'))
-    
-    csv_content = _build_maintenance_csv(all_maintenance_logs)
+
     timestamp = datetime.now().strftime('%Y%m%d%H%M%S')
     filename = f"motopuppu_maintenance_logs_all_vehicles_{timestamp}.csv"
-    return Response(
-        csv_content, mimetype="text/csv",
-        headers={"Content-Disposition": f"attachment;filename=\"{filename}\"", "Content-Type": "text/csv; charset=utf-8-sig"}
-    )
+    return _maintenance_csv_response(user_motorcycle_ids_for_maintenance, filename)
 
 @maintenance_bp.route('/get-previous-entry', methods=['GET'])
 @limiter.limit("120 per minute")
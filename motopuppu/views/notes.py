@@ -4,6 +4,7 @@ from flask import (
 )
 from datetime import date, timezone, datetime 
 from sqlalchemy import or_, func
+from sqlalchemy.orm import undefer
 import json
 
 from flask_login import login_required, current_user
@@ -28,7 +29,8 @@ def notes_log():
     active_motorcycle_ids = [m.id for m in user_motorcycles if not m.is_archived]
 
     request_args_dict = {k: v for k, v in request.args.items() if k != 'page'}
-    query = GeneralNote.query.filter_by(user_id=current_user.id)
+    # 一覧でTODOのプレビューを表示するため、遅延ロード列の todos を同時に取得する
+    query = GeneralNote.query.options(undefer(GeneralNote.todos)).filter_by(user_id=current_user.id)
 
     start_date_str = request.args.get('start_date')
     end_date_str = request.args.get('end_date')
@@ -66,28 +68,37 @@ def notes_log():
     elif category_filter:
         flash('無効なカテゴリフィルターが指定されました。', 'warning'); request_args_dict.pop('category', None)
 
-    # --- 統計情報の計算 (ページネーション前) ---
-    summary_stats = {
-        'total_count': 0,
-        'note_count': 0,
-        'task_count': 0
-    }
-    try:
-        # カテゴリごとの件数を取得
-        stats_query = query.with_entities(GeneralNote.category, func.count(GeneralNote.id)).group_by(GeneralNote.category).all()
-        for cat, count in stats_query:
-            if cat == 'note':
-                summary_stats['note_count'] = count
-            elif cat == 'task':
-                summary_stats['task_count'] = count
-        summary_stats['total_count'] = sum(count for _, count in stats_query)
-    except Exception as e:
-        current_app.logger.error(f"Error calculating notes summary: {e}")
-
     # --- クエリ実行 ---
     # ピン留めされたノートを優先し、日付順、作成日順でソート
-    pagination = query.order_by(GeneralNote.is_pinned.desc(), GeneralNote.note_date.desc(), GeneralNote.created_at.desc()).paginate(page=page, per_page=per_page, error_out=False)
-    entries = pagination.items
+    # カテゴリごとの件数はウィンドウ関数で同じクエリから取得し、集計用・COUNT用のクエリは発行しない
+    page_query = query.add_columns(
+        func.count().over().label('total_count'),
+        func.count().filter(GeneralNote.category == 'note').over().label('note_count'),
+        func.count().filter(GeneralNote.category == 'task').over().label('task_count'),
+    ).order_by(GeneralNote.is_pinned.desc(), GeneralNote.note_date.desc(), GeneralNote.created_at.desc())
+    pagination = page_query.paginate(page=page, per_page=per_page, error_out=False, count=False)
+    rows = pagination.items
+
+    # --- 統計情報 (ページネーション前の件数) ---
+    if rows:
+        summary_stats = {
+            'total_count': rows[0].total_count,
+            'note_count': rows[0].note_count,
+            'task_count': rows[0].task_count
+        }
+    else:
+        # 範囲外のページでは行が返らないため、件数だけを集計し直す
+        summary_stats = {'total_count': 0, 'note_count': 0, 'task_count': 0}
+        if page > 1:
+            for cat, count in query.with_entities(GeneralNote.category, func.count(GeneralNote.id)).group_by(GeneralNote.category).all():
+                if cat == 'note':
+                    summary_stats['note_count'] = count
+                elif cat == 'task':
+                    summary_stats['task_count'] = count
+                summary_stats['total_count'] += count
+    pagination.total = summary_stats['total_count']
+    entries = [row[0] for row in rows]
+    pagination.items = entries
     
     is_filter_active = bool(request_args_dict)
 
@@ -167,6 +178,7 @@ def add_note():
                         'checked': item_form.checked.data
                     })
             new_note.todos = todos_data if todos_data else None 
+        new_note.refresh_todo_progress()
 
         new_note.created_at = datetime.now(timezone.utc) 
         new_note.updated_at = datetime.now(timezone.utc) 
@@ -270,6 +282,7 @@ def edit_note(note_id):
                         'checked': item_data_from_form.get('checked', False)
                     })
             note.todos = todos_data if todos_data else None 
+        note.refresh_todo_progress()
         
         note.updated_at = datetime.now(timezone.utc) 
         
@@ -1,4 +1,5 @@
 # motopuppu/views/profile.py
+import secrets
 import uuid
 from flask import (
     Blueprint, render_template, redirect, url_for, flash, request, current_app, session
@@ -9,6 +10,7 @@ from flask_login import login_required, current_user, logout_user
 # ▲▲▲ 変更ここまで ▲▲▲
 from ..forms import ProfileForm, DeleteAccountForm
 from ..models import User
+from ..utils.calendar_feed import invalidate_calendar_feed
 
 # プロフィール管理用のBlueprintを作成
 profile_bp = Blueprint('profile', __name__, url_prefix='/profile')
@@ -88,4 +90,31 @@ def settings():
     return render_template(template_name,
                            title='プロフィール設定',
                            profile_form=profile_form,
-                           delete_form=delete_form)
\ No newline at end of file
+                           delete_form=delete_form)
+
+
+@profile_bp.route('/calendar-feed', methods=['POST'])
+@login_required
+def update_calendar_feed():
+    """購読用カレンダーフィードのURLを発行 (再発行) または停止する"""
+    action = request.form.get('action')
+    if action == 'issue':
+        # 再発行すると古いURLは使えなくなる
+        current_user.calendar_feed_token = secrets.token_urlsafe(32)
+        message = 'カレンダー購読用のURLを発行しました。'
+    elif action == 'revoke':
+        current_user.calendar_feed_token = None
+        message = 'カレンダー購読用のURLを無効にしました。'
+    else:
+        flash('不正な操作です。', 'danger')
+        return redirect(url_for('profile.settings'))
+
+    try:
+        db.session.commit()
+        invalidate_calendar_feed(current_user.id)
+        flash(message, 'success')
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Error updating calendar feed token for user {current_user.id}: {e}")
+        flash('カレンダー購読設定の更新中にエラーが発生しました。', 'danger')
+    return redirect(url_for('profile.settings'))
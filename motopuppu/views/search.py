@@ -4,21 +4,75 @@
 from flask import Blueprint, request, jsonify, url_for, g
 # ▲▲▲【変更はここまで】▲▲▲
 from flask_login import login_required, current_user
-from sqlalchemy import or_
+from sqlalchemy import or_, func
+from sqlalchemy.orm import joinedload
 
-from ..models import (
-    Motorcycle, MaintenanceEntry, FuelEntry, GeneralNote, 
-    ActivityLog, SessionLog, SettingSheet, MaintenanceReminder,
-    TouringLog, Event, Team, MaintenanceSpecSheet
-)
+from ..models import db, Motorcycle, Team, SearchDocument
 from ..constants import JAPANESE_CIRCUITS
 from ..utils.search_helpers import escape_like
+from ..utils.search_index import (
+    SEARCHABLE_TYPES, SEARCHABLE_TYPES_BY_NAME, normalize_search_query,
+    get_cached_search_results, set_cached_search_results
+)
 
 
 search_bp = Blueprint('search', __name__, url_prefix='/search')
 
 MAX_RESULTS_PER_CATEGORY = 5
-MIN_QUERY_LENGTH = 1 # 1文字から検索可能
+MIN_QUERY_LENGTH = 1 # 1文字から検索可能 (機能ショートカット・リーダーボード)
+# データ検索はトライグラムインデックスが効きにくい1文字では行わない
+MIN_DB_QUERY_LENGTH = 2
+
+
+def _build_document_query(user_id, query):
+    """
+    search_documents からユーザーの検索対象を1回のクエリで検索する。
+    部分一致 (トライグラム) または全文検索に一致した行を、種類ごとに一致度順で上位 MAX_RESULTS_PER_CATEGORY 件返す。
+    """
+    ts_query = func.plainto_tsquery('simple', query)
+    score = func.word_similarity(query, SearchDocument.search_text) + func.ts_rank(SearchDocument.search_vector, ts_query)
+
+    ranked = db.select(
+        SearchDocument.entity_type,
+        SearchDocument.entity_id,
+        SearchDocument.title,
+        SearchDocument.summary,
+        Motorcycle.name.label('motorcycle_name'),
+        score.label('score'),
+        func.row_number().over(
+            partition_by=SearchDocument.entity_type,
+            order_by=(score.desc(), SearchDocument.doc_date.desc().nulls_last(), SearchDocument.entity_id.desc())
+        ).label('rank_in_type'),
+    ).outerjoin(
+        Motorcycle, Motorcycle.id == SearchDocument.motorcycle_id
+    ).where(
+        SearchDocument.user_id == user_id,
+        or_(
+            SearchDocument.search_text.ilike(escape_like(query)),
+            SearchDocument.search_vector.op('@@')(ts_query)
+        )
+    ).subquery()
+
+    return db.select(ranked).where(ranked.c.rank_in_type <= MAX_RESULTS_PER_CATEGORY)
+
+
+def _format_document_row(row):
+    """search_documents の検索結果1行を、フロントエンドに返す形式に変換する"""
+    searchable = SEARCHABLE_TYPES_BY_NAME[row.entity_type]
+    title = row.title
+    if searchable.show_motorcycle_name and row.motorcycle_name:
+        title = f"[{row.motorcycle_name}] {title}"
+    return {
+        'category': searchable.label,
+        'title': title,
+        'url': url_for(searchable.endpoint, **{searchable.url_arg: row.entity_id}),
+        'text': row.summary or ''
+    }
+
+
+# 検索結果のカテゴリ表示順
+_TYPE_ORDER = {searchable.entity_type: index for index, searchable in enumerate(SEARCHABLE_TYPES)}
+
 
 @search_bp.route('/')
 @login_required
@@ -27,195 +81,39 @@ def global_search():
     アプリケーション全体から横断的にデータを検索し、
     JSON形式で結果を返すAPIエンドポイント。
     """
-    query = request.args.get('q', '').strip()
-    query_lower = query.lower()
+    # 大文字小文字・空白の違いは検索結果に影響しないため、正規化してからキャッシュのキーにも使う
+    query = normalize_search_query(request.args.get('q', ''))
+    query_lower = query
 
     if len(query) < MIN_QUERY_LENGTH:
         return jsonify({'results': []})
 
-    search_term = escape_like(query)
-    results = []
-
-    # --- データ検索 --- (このセクションは変更ありません)
-
-    # 1. 車両 (Motorcycle)
-    motorcycles = Motorcycle.query.filter(
-        Motorcycle.user_id == current_user.id,
-        or_(
-            Motorcycle.name.ilike(search_term),
-            Motorcycle.maker.ilike(search_term)
-        )
-    ).limit(MAX_RESULTS_PER_CATEGORY).all()
-    for item in motorcycles:
-        results.append({
-            'category': '車両',
-            'title': f"{item.name} ({item.maker or 'メーカー未設定'})",
-            'url': url_for('vehicle.edit_vehicle', vehicle_id=item.id),
-            'text': f"年式: {item.year or '未設定'}"
-        })
-
-    # 2. 整備記録 (MaintenanceEntry)
-    maintenance_entries = MaintenanceEntry.query.join(Motorcycle).filter(
-        Motorcycle.user_id == current_user.id,
-        or_(
-            MaintenanceEntry.description.ilike(search_term),
-            MaintenanceEntry.category.ilike(search_term),
-            MaintenanceEntry.notes.ilike(search_term)
-        )
-    ).order_by(MaintenanceEntry.maintenance_date.desc()).limit(MAX_RESULTS_PER_CATEGORY).all()
-    for item in maintenance_entries:
-        results.append({
-            'category': '整備記録',
-            'title': f"[{item.motorcycle.name}] {item.description[:30]}...",
-            'url': url_for('maintenance.edit_maintenance', entry_id=item.id),
-            'text': f"{item.maintenance_date.strftime('%Y-%m-%d')} | {item.category or 'カテゴリなし'}"
-        })
+    cached = get_cached_search_results(current_user.id, query)
+    if cached is not None:
+        return jsonify(cached)
 
-    # 3. 給油記録 (FuelEntry)
-    fuel_entries = FuelEntry.query.join(Motorcycle).filter(
-        Motorcycle.user_id == current_user.id,
-        or_(
-            FuelEntry.notes.ilike(search_term),
-            FuelEntry.station_name.ilike(search_term),
-            FuelEntry.fuel_type.ilike(search_term),
-            Motorcycle.name.ilike(search_term) 
-        )
-    ).order_by(FuelEntry.entry_date.desc()).limit(MAX_RESULTS_PER_CATEGORY).all()
-    for item in fuel_entries:
-        results.append({
-            'category': '給油記録',
-            'title': f"[{item.motorcycle.name}] {item.entry_date.strftime('%Y-%m-%d')} の給油",
-            'url': url_for('fuel.edit_fuel', entry_id=item.id),
-            'text': f"スタンド: {item.station_name or '未記録'}, メモ: {(item.notes[:20] + '...') if item.notes else 'なし'}"
-        })
-
-    # 4. ノート (GeneralNote)
-    notes = GeneralNote.query.filter(
-        GeneralNote.user_id == current_user.id,
-        or_(
-            GeneralNote.title.ilike(search_term),
-            GeneralNote.content.ilike(search_term)
-        )
-    ).order_by(GeneralNote.note_date.desc()).limit(MAX_RESULTS_PER_CATEGORY).all()
-    for item in notes:
-        results.append({
-            'category': 'ノート',
-            'title': item.title or "無題のノート",
-            'url': url_for('notes.edit_note', note_id=item.id),
-            'text': f"{item.note_date.strftime('%Y-%m-%d')} | {item.content[:30] if item.content else '内容なし'}..."
-        })
-    
-    # 5. 活動ログ (ActivityLog)
-    activities = ActivityLog.query.join(Motorcycle).filter(
-        Motorcycle.user_id == current_user.id,
-        or_(
-            ActivityLog.activity_title.ilike(search_term),
-            ActivityLog.circuit_name.ilike(search_term),
-            ActivityLog.custom_location.ilike(search_term),
-            ActivityLog.notes.ilike(search_term)
-        )
-    ).order_by(ActivityLog.activity_date.desc()).limit(MAX_RESULTS_PER_CATEGORY).all()
-    for item in activities:
-        results.append({
-            'category': '活動ログ',
-            'title': f"[{item.motorcycle.name}] {item.activity_title or item.location_name_display}",
-            'url': url_for('activity.detail_activity', activity_id=item.id),
-            'text': f"{item.activity_date.strftime('%Y-%m-%d')} | {item.notes[:30] if item.notes else 'メモなし'}..."
-        })
-
-    # 6. リマインダー (MaintenanceReminder)
-    reminders = MaintenanceReminder.query.join(Motorcycle).filter(
-        Motorcycle.user_id == current_user.id,
-        MaintenanceReminder.task_description.ilike(search_term)
-    ).limit(MAX_RESULTS_PER_CATEGORY).all()
-    for item in reminders:
-        interval_parts = []
-        if item.interval_km:
-            interval_parts.append(f"{item.interval_km}km")
-        if item.interval_months:
-            interval_parts.append(f"{item.interval_months}ヶ月")
-        interval_display = " / ".join(interval_parts)
-
-        results.append({
-            'category': 'リマインダー',
-            'title': f"[{item.motorcycle.name}] {item.task_description}",
-            'url': url_for('reminder.edit_reminder', reminder_id=item.id),
-            'text': f"サイクル: {interval_display}"
-        })
-
-    # 7. セッティングシート (SettingSheet)
-    setting_sheets = SettingSheet.query.join(Motorcycle).filter(
-        Motorcycle.user_id == current_user.id,
-        or_(
-            SettingSheet.sheet_name.ilike(search_term),
-            SettingSheet.notes.ilike(search_term)
-        )
-    ).limit(MAX_RESULTS_PER_CATEGORY).all()
-    for item in setting_sheets:
-        results.append({
-            'category': 'セッティングシート',
-            'title': f"[{item.motorcycle.name}] {item.sheet_name}",
-            'url': url_for('activity.edit_setting', setting_id=item.id),
-            'text': f"メモ: {item.notes[:30] if item.notes else 'なし'}..."
-        })
-
-    # 8. ツーリングログ (TouringLog)
-    touring_logs = TouringLog.query.join(Motorcycle).filter(
-        Motorcycle.user_id == current_user.id,
-        or_(
-            TouringLog.title.ilike(search_term),
-            TouringLog.memo.ilike(search_term)
-        )
-    ).order_by(TouringLog.touring_date.desc()).limit(MAX_RESULTS_PER_CATEGORY).all()
-    for item in touring_logs:
-        results.append({
-            'category': 'ツーリングログ',
-            'title': f"[{item.motorcycle.name}] {item.title}",
-            'url': url_for('touring.detail_log', log_id=item.id),
-            'text': f"{item.touring_date.strftime('%Y-%m-%d')} | {item.memo[:30] if item.memo else 'メモなし'}..."
-        })
+    results = []
 
-    # 9. イベント (Event)
-    events = Event.query.filter(
-        Event.user_id == current_user.id,
-        or_(
-            Event.title.ilike(search_term),
-            Event.description.ilike(search_term),
-            Event.location.ilike(search_term)
+    # --- データ検索 ---
+    if len(query) >= MIN_DB_QUERY_LENGTH:
+        rows = db.session.execute(_build_document_query(current_user.id, query)).all()
+        rows.sort(key=lambda row: (_TYPE_ORDER.get(row.entity_type, len(_TYPE_ORDER)), row.rank_in_type))
+        results.extend(
+            _format_document_row(row) for row in rows if row.entity_type in SEARCHABLE_TYPES_BY_NAME
         )
-    ).order_by(Event.start_datetime.desc()).limit(MAX_RESULTS_PER_CATEGORY).all()
-    for item in events:
-        results.append({
-            'category': 'イベント',
-            'title': item.title,
-            'url': url_for('event.event_detail', event_id=item.id),
-            'text': f"{item.start_datetime.strftime('%Y-%m-%d %H:%M')} | {item.location or '場所未設定'}"
-        })
-
-    # 10. チーム (Team) - 自分が所属するチーム
-    teams = Team.query.filter(Team.members.any(id=current_user.id)).filter(
-        Team.name.ilike(search_term)
-    ).limit(MAX_RESULTS_PER_CATEGORY).all()
-    for item in teams:
-        results.append({
-            'category': 'チーム',
-            'title': item.name,
-            'url': url_for('team.dashboard', team_id=item.id),
-            'text': f"オーナー: {item.owner.display_name or item.owner.misskey_username}"
-        })
 
-    # 11. 整備情報シート (MaintenanceSpecSheet)
-    spec_sheets = MaintenanceSpecSheet.query.join(Motorcycle).filter(
-        Motorcycle.user_id == current_user.id,
-        MaintenanceSpecSheet.sheet_name.ilike(search_term)
-    ).limit(MAX_RESULTS_PER_CATEGORY).all()
-    for item in spec_sheets:
-        results.append({
-            'category': '整備情報シート',
-            'title': f"[{item.motorcycle.name}] {item.sheet_name}",
-            'url': url_for('spec_sheet.view_sheet', sheet_id=item.id),
-            'text': f"車両固有の整備情報を記録・閲覧します。"
-        })
+        # チーム (Team) - 所有者ではなく所属メンバーで絞り込むため、search_documents とは別に検索する
+        teams = Team.query.options(joinedload(Team.owner)).filter(
+            Team.members.any(id=current_user.id),
+            Team.name.ilike(escape_like(query))
+        ).limit(MAX_RESULTS_PER_CATEGORY).all()
+        for item in teams:
+            results.append({
+                'category': 'チーム',
+                'title': item.name,
+                'url': url_for('team.dashboard', team_id=item.id),
+                'text': f"オーナー: {item.owner.display_name or item.owner.misskey_username}"
+            })
 
     # リーダーボード検索
     leaderboard_results = []
@@ -270,4 +168,13 @@ def global_search():
                         'text': info['text']
                     })
 
-    return jsonify({'results': results})
\ No newline at end of file
+    # prefix_reusable: データ検索まで行った結果であり、これが空ならこのクエリで始まる
+    # より長いクエリも空になる (クライアント側で再検索を省略してよい) ことを示す。
+    # 複数語のクエリは全文検索で語順を問わず一致するため ("oil fil" は空でも "oil filter" は一致しうる)、
+    # 1語のクエリに限る
+    response_data = {
+        'results': results,
+        'prefix_reusable': len(query) >= MIN_DB_QUERY_LENGTH and ' ' not in query,
+    }
+    set_cached_search_results(current_user.id, query, response_data)
+    return jsonify(response_data)
\ No newline at end of file
@@ -4,14 +4,14 @@ from flask import (
 )
 from flask_login import login_required, current_user
 from sqlalchemy.orm import load_only, selectinload
-from sqlalchemy import func
 import uuid
 from datetime import datetime, timezone
 
 from .. import db, limiter
-from ..models import Team, User, ActivityLog, SessionLog, Motorcycle, Event
+from ..models import Team, TeamCircuitBest, User, ActivityLog, Motorcycle, Event, team_members
 from ..forms import TeamForm
 from ..utils.lap_time_utils import format_seconds_to_time
+from ..utils.team_rankings import refresh_team_circuit_bests
 
 team_bp = Blueprint(
     'team',
@@ -43,6 +43,8 @@ def create_team():
         new_team.members.append(current_user)
         db.session.add(new_team)
         try:
+            db.session.flush()
+            refresh_team_circuit_bests(user_ids=[current_user.id], team_id=new_team.id)
             db.session.commit()
             flash(f'チーム「{new_team.name}」を作成しました。', 'success')
             return redirect(url_for('team.manage_team', team_id=new_team.id))
@@ -99,13 +101,15 @@ def join_team(token):
     """招待トークンを使ってチームに参加する"""
     team = Team.query.filter_by(invite_token=token).first_or_404()
 
-    if current_user in team.members:
+    if team.has_member(current_user.id):
         flash('すでにこのチームのメンバーです。', 'info')
         return redirect(url_for('team.dashboard', team_id=team.id))
 
     if request.method == 'POST':
         team.members.append(current_user)
         try:
+            db.session.flush()
+            refresh_team_circuit_bests(user_ids=[current_user.id], team_id=team.id)
             db.session.commit()
             flash(f'チーム「{team.name}」に参加しました！', 'success')
             return redirect(url_for('team.dashboard', team_id=team.id))
@@ -123,40 +127,27 @@ def join_team(token):
 def dashboard(team_id):
     """チームのダッシュボードを表示する"""
     team = Team.query.get_or_404(team_id)
-    if current_user not in team.members:
+    if not team.has_member(current_user.id):
         abort(403)
 
-    member_ids = [member.id for member in team.members]
+    member_ids = db.select(team_members.c.user_id).where(team_members.c.team_id == team.id)
 
     # 1. サーキット別ランキングデータの取得
-    best_lap_subquery = db.session.query(
-        ActivityLog.user_id,
-        ActivityLog.circuit_name,
-        func.min(SessionLog.best_lap_seconds).label('personal_best')
-    ).join(
-        SessionLog, ActivityLog.id == SessionLog.activity_log_id
-    ).filter(
-        ActivityLog.user_id.in_(member_ids),
-        ActivityLog.circuit_name.isnot(None),
-        SessionLog.best_lap_seconds.isnot(None),
-        ActivityLog.share_with_teams == True # 公開設定のログのみ対象
-    ).group_by(
-        ActivityLog.user_id,
-        ActivityLog.circuit_name
-    ).subquery()
-
+    # メンバーごとのベストラップは team_circuit_bests に集計済みのものを読むだけにする
     # User オブジェクトは表示に必要な列のみロード (JSON/JSONB列を読み込まない)
     circuit_rankings_query = db.session.query(
         User,
-        best_lap_subquery.c.circuit_name,
-        best_lap_subquery.c.personal_best
+        TeamCircuitBest.circuit_name,
+        TeamCircuitBest.best_lap_seconds
     ).options(
         load_only(User.id, User.display_name, User.misskey_username, User.avatar_url)
     ).join(
-        best_lap_subquery, User.id == best_lap_subquery.c.user_id
+        TeamCircuitBest, User.id == TeamCircuitBest.user_id
+    ).filter(
+        TeamCircuitBest.team_id == team.id
     ).order_by(
-        best_lap_subquery.c.circuit_name.asc(),
-        best_lap_subquery.c.personal_best.asc()
+        TeamCircuitBest.circuit_name.asc(),
+        TeamCircuitBest.best_lap_seconds.asc()
     ).all()
 
     circuit_data = {}
@@ -225,7 +216,7 @@ def leave_team(team_id):
     """チームから脱退する"""
     team = Team.query.get_or_404(team_id)
     
-    if current_user not in team.members:
+    if not team.has_member(current_user.id):
         flash('あなたはこのチームのメンバーではありません。', 'warning')
         return redirect(url_for('main.index'))
         
@@ -235,6 +226,8 @@ def leave_team(team_id):
 
     team.members.remove(current_user)
     try:
+        db.session.flush()
+        refresh_team_circuit_bests(user_ids=[current_user.id], team_id=team.id)
         db.session.commit()
         flash(f'チーム「{team.name}」から脱退しました。', 'success')
     except Exception as e:
@@ -260,8 +253,10 @@ def remove_member(team_id, user_id):
 
     member_to_remove = User.query.get_or_404(user_id)
     
-    if member_to_remove in team.members:
+    if team.has_member(member_to_remove.id):
         team.members.remove(member_to_remove)
+        db.session.flush()
+        refresh_team_circuit_bests(user_ids=[member_to_remove.id], team_id=team.id)
         db.session.commit()
         flash(f'「{member_to_remove.display_name}」をチームから削除しました。', 'success')
     else:
@@ -2,10 +2,9 @@
 import json
 from datetime import datetime, date, timezone, timedelta
 import requests
-import time # ◀◀◀ timeモジュールをインポート
 
 from flask import (
-    Blueprint, flash, redirect, render_template, request, url_for, current_app, jsonify
+    Blueprint, flash, redirect, render_template, request, url_for, current_app, jsonify, Response
 )
 from sqlalchemy import func
 from sqlalchemy.orm import joinedload, subqueryload
@@ -20,13 +19,8 @@ from ..services import CryptoService
 touring_bp = Blueprint('touring', __name__, url_prefix='/touring')
 
 from ..utils.view_helpers import get_motorcycle_or_404
-# ▼▼▼ 絵文字キャッシュ用の変数をグローバルスコープに定義 ▼▼▼
-emoji_cache = {
-    "data": None,
-    "timestamp": 0
-}
-CACHE_DURATION_SECONDS = 86400  # 24時間 (60秒 * 60分 * 24時間)
-# ▲▲▲ 変更ここまで ▲▲▲
+from ..utils.emoji_index import get_emoji_index
+from ..utils.misskey_notes import get_note_details, MAX_NOTE_IDS_PER_REQUEST
 
 @touring_bp.route('/<int:vehicle_id>')
 @login_required # ▼▼▼ デコレータを修正 ▼▼▼
@@ -275,21 +269,18 @@ def fetch_note_details_api():
         return jsonify({"error": "Failed to decrypt API token."}), 500
     # ▲▲▲ 変更ここまで ▲▲▲
     
+    # 重複を除き、1回で扱う件数を制限する (キャッシュにないものだけ Misskey から並列に取得)
+    note_ids = list(dict.fromkeys(note_id for note_id in note_ids if isinstance(note_id, str) and 0 < len(note_id) <= 32))
+    note_ids = note_ids[:MAX_NOTE_IDS_PER_REQUEST]
     misskey_instance_url = current_app.config.get('MISSKEY_INSTANCE_URL', 'https://misskey.io')
-    api_url = f"{misskey_instance_url}/api/notes/show"
-    headers = {'Content-Type': 'application/json'}
-    
-    note_details = {}
-    for note_id in note_ids:
-        payload = {'i': api_token, 'noteId': note_id}
-        try:
-            response = requests.post(api_url, headers=headers, json=payload, timeout=5)
-            if response.status_code == 200:
-                note_details[note_id] = response.json()
-            else:
-                note_details[note_id] = None
-        except requests.RequestException:
-            note_details[note_id] = None
+    note_details = get_note_details(
+        current_user.id, note_ids, misskey_instance_url, api_token, logger=current_app.logger
+    )
+    try:
+        db.session.commit()
+    except Exception as e:
+        db.session.rollback()
+        current_app.logger.error(f"Failed to store Misskey note cache for user {current_user.id}: {e}")
 
     return jsonify(note_details)
 
@@ -297,31 +288,31 @@ def fetch_note_details_api():
 @touring_bp.route('/api/emojis')
 @login_required
 def fetch_emojis_api():
-    """絵文字データを返すAPIエンドポイント（キャッシュ付き）"""
-    current_time = time.time()
-    
-    if emoji_cache["data"] and (current_time - emoji_cache["timestamp"] < CACHE_DURATION_SECONDS):
-        emojis_data = json.loads(emoji_cache["data"])
-    else:
-        try:
-            misskey_instance_url = current_app.config.get('MISSKEY_INSTANCE_URL', 'https://misskey.io')
-            response = requests.post(f"{misskey_instance_url}/api/emojis", json={}, timeout=10)
-            response.raise_for_status()
-            emojis_data = response.json().get("emojis", [])
-            emoji_cache["data"] = json.dumps(emojis_data)
-            emoji_cache["timestamp"] = current_time
-        except Exception as e:
-            current_app.logger.error(f"Failed to fetch Misskey emojis: {e}")
-            if emoji_cache["data"]:
-                emojis_data = json.loads(emoji_cache["data"])
-            else:
-                emojis_data = []
-    
+    """絵文字データを返すAPIエンドポイント（プロセス内の索引から返す）"""
+    misskey_instance_url = current_app.config.get('MISSKEY_INSTANCE_URL', 'https://misskey.io')
+    index = get_emoji_index(misskey_instance_url, logger=current_app.logger)
+
     # 検索フィルタ（オプショナル）
     query = request.args.get('q', '').strip().lower()
     if query:
-        emojis_data = [e for e in emojis_data if query in e.get('name', '').lower() or any(query in alias.lower() for alias in e.get('aliases', []))]
-    
-    resp = jsonify(emojis_data)
+        limit = request.args.get('limit', type=int)
+        if limit is not None and limit <= 0:
+            limit = None
+        resp = jsonify(index.search(query, limit=limit))
+        resp.headers['Cache-Control'] = 'public, max-age=3600' if index.emojis else 'no-store'
+        return resp
+
+    if not index.emojis:
+        # 取得に失敗して一覧が無い間は、空の結果をブラウザにキャッシュさせない
+        resp = Response(index.payload, mimetype='application/json')
+        resp.headers['Cache-Control'] = 'no-store'
+        return resp
+
+    # 全件は一覧の取得時にシリアライズ済みの JSON をそのまま返し、ETag でブラウザのキャッシュを再利用させる
+    if index.etag in request.if_none_match:
+        resp = Response(status=304)
+    else:
+        resp = Response(index.payload, mimetype='application/json')
+    resp.set_etag(index.etag)
     resp.headers['Cache-Control'] = 'public, max-age=3600'
     return resp
\ No newline at end of file
@@ -48,12 +48,14 @@ def vehicle_list():
     user_motorcycles = []
     for motorcycle, count in motorcycles_with_counts:
         motorcycle.activity_log_count = count or 0
-        if not motorcycle.is_racer:
-            motorcycle.avg_kpl = services.calculate_average_kpl(motorcycle)
-        else:
-            motorcycle.avg_kpl = None
         user_motorcycles.append(motorcycle)
 
+    # 平均燃費は車両数に関係なく1回のクエリでまとめて計算する
+    # (走行距離・稼働時間は Motorcycle の保持列を参照するためクエリ不要)
+    avg_kpl_map = services.calculate_average_kpl_bulk(user_motorcycles)
+    for motorcycle in user_motorcycles:
+        motorcycle.avg_kpl = avg_kpl_map.get(motorcycle.id)
+
     template_name = 'beta/vehicles_beta.html' if current_user.use_beta_ui else 'vehicles.html'
     return render_template(template_name, motorcycles=user_motorcycles)
 
@@ -145,6 +147,7 @@ def add_vehicle():
                     labor_cost=0
                 )
                 db.session.add(initial_maint_entry)
+                new_motorcycle.refresh_mileage_cache()
                 db.session.commit()
                 flash(f'車両「{new_motorcycle.name}」を登録し、初期ODOメーター値 ({initial_odo:,}km) を記録しました。', 'success')
             else:
@@ -611,6 +614,7 @@ def dashboard(vehicle_id):
     
     # 最近のデータを取得（各カテゴリ最大10件で十分、タイムライン構築時に30件に絞り込む）
     recent_fuels = FuelEntry.query.filter_by(motorcycle_id=motorcycle.id).order_by(FuelEntry.entry_date.desc(), FuelEntry.id.desc()).limit(10).all()
+    services.preload_fuel_kpl(recent_fuels)
     recent_maintenances = MaintenanceEntry.query.filter_by(motorcycle_id=motorcycle.id).order_by(MaintenanceEntry.maintenance_date.desc(), MaintenanceEntry.id.desc()).limit(10).all()
     recent_notes = GeneralNote.query.filter_by(motorcycle_id=motorcycle.id).order_by(GeneralNote.note_date.desc(), GeneralNote.id.desc()).limit(10).all()
     recent_activities = ActivityLog.query.filter_by(motorcycle_id=motorcycle.id).order_by(ActivityLog.activity_date.desc(), ActivityLog.id.desc()).limit(10).all()